@@ -3,7 +3,7 @@ import os
 import json
 from utils.data_loader import cargar_carteras, seleccionar_cartera, crear_cartera_si_necesario, renombrar_cartera
 from utils.transacciones import mostrar_tabla_transacciones, formulario_nueva_transaccion, importar_transacciones_excel, cargar_transacciones
-from utils.general import mostrar_estado_general, calcular_estado_actual
+from utils.general import mostrar_estado_general, calcular_estado_actual, mostrar_cache_negativa, mostrar_estado_fuentes
 from utils.ganancias import mostrar_ganancias_perdidas
 from utils.flujos import mostrar_flujos
 from utils.rentabilidad_frontend import mostrar_rentabilidad
@@ -12,6 +12,7 @@ from utils.benchmark import comparar_con_benchmark
 from utils.config import CACHE_TTL_HORAS
 from utils.formatting import mostrar_dataframe_formateado
 from utils.historial_nav import mostrar_gestor_historicos_nav
+from utils import nav_store
 
 # Configuración inicial
 st.set_page_config(page_title="Gestor de Carteras", layout="wide")
@@ -25,6 +26,14 @@ if not os.path.exists(CONFIG_PATH):
 with open(CONFIG_PATH, "r", encoding="utf-8") as f:
     settings = json.load(f)
 
+# Migración de los {ISIN}.csv nuevos o modificados de data/nav_historico al almacén Parquet
+# (una vez por proceso; los CSV no se mueven)
+@st.cache_resource
+def migrar_historicos_csv():
+    return nav_store.migrar_csvs()
+
+migrar_historicos_csv()
+
 # Título principal
 st.title("📈 Gestor de Carteras")
 
@@ -45,7 +54,7 @@ menu = st.sidebar.radio("Navegar a:", ["General", "Rentabilidad", "Ganancias / P
 if menu == "General":
     st.subheader(f"Resumen general - {cartera_activa}")
 
-    from utils.nav_fetcher import refrescar_navs_si_expirados
+    from utils.nav_fetcher import refrescar_navs_en_segundo_plano, isins_en_refresco
     from datetime import datetime, timedelta
     from utils.config import CACHE_TTL_HORAS  # Asegúrate de tener esto definido
 
@@ -60,21 +69,29 @@ if menu == "General":
         or not isinstance(ultima, datetime)
         or (ahora - ultima) > timedelta(hours=CACHE_TTL_HORAS)
     ):
-        refrescar_navs_si_expirados(df_transacciones)
+        # Stale-while-revalidate: se pinta ya con la caché y los expirados se refrescan en segundo plano
+        refrescar_navs_en_segundo_plano(df_transacciones)
         st.session_state["navs_ultima_actualizacion"] = ahora
-        print(f"⏱️ NAVs actualizados automáticamente a las {ahora}")
+        print(f"⏱️ Refresco automático de NAVs lanzado a las {ahora}")
 
     # Botón de actualización manual
     if st.button("🔄 Refrescar manualmente NAVs"):
-        refrescar_navs_si_expirados(df_transacciones, forzar=True)
+        refrescar_navs_en_segundo_plano(df_transacciones, forzar=True)
         st.session_state["navs_ultima_actualizacion"] = datetime.now()
-        st.success("✅ NAVs actualizados manualmente.")
         st.rerun()
 
-    df_resultado = calcular_estado_actual(df_transacciones)
+    en_refresco = isins_en_refresco()
+    if en_refresco:
+        st.info(f"🔄 Actualizando {len(en_refresco)} NAVs en segundo plano. Se muestran los últimos valores cacheados.")
+        if st.button("↻ Recargar valores"):
+            st.rerun()
+
+    df_resultado = calcular_estado_actual(df_transacciones, en_refresco=en_refresco)
     mostrar_dataframe_formateado(df_resultado)
     
     st.markdown("---")
+    mostrar_cache_negativa()
+    mostrar_estado_fuentes()
   
             
 elif menu == "Rentabilidad":
@@ -0,0 +1,145 @@
+"""
+Benchmark de los fetchers de NAV sobre respuestas grabadas, sin red.
+
+Grabar fixtures (requiere red; guarda en tests/fixtures/http):
+    python -m tests.benchmark_fetchers --grabar IE00B2NXKW18 IE0031724234
+
+Medir sobre las fixtures (reproducción local, determinista):
+    python -m tests.benchmark_fetchers --repeticiones 20
+
+Se mide cada fuente de dos formas:
+  - extremo a extremo: buscar_nav_* completo (resolución de URL + ficha + parseo)
+    contra una caché SQLite vacía, para que no haya aciertos entre repeticiones.
+  - solo parseo: parsear_ficha_* sobre el HTML grabado de la ficha.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import cache_db, http_client
+from utils.morningstar_fetcher import buscar_nav_morningstar, parsear_ficha_morningstar, resolver_url_morningstar
+from utils.ft_fetcher import buscar_nav_ft, parsear_ficha_ft, resolver_url_ft
+from utils.investing_fetcher import buscar_nav_investing, parsear_ficha_investing, resolver_url_investing
+
+FETCHERS = {
+    "morningstar": (buscar_nav_morningstar, parsear_ficha_morningstar, resolver_url_morningstar),
+    "ft": (buscar_nav_ft, parsear_ficha_ft, resolver_url_ft),
+    "investing": (buscar_nav_investing, parsear_ficha_investing, resolver_url_investing),
+}
+
+
+def ruta_manifiesto():
+    return http_client.FIXTURES_DIR / "manifiesto.json"
+
+
+def _base_vacia(directorio, nombre):
+    return cache_db.usar_base_datos(Path(directorio) / f"{nombre}.sqlite", migrar_json=False)
+
+
+def grabar(identificadores):
+    """Ejecuta los fetchers contra la red guardando las respuestas y el manifiesto de fichas."""
+    http_client.configurar_fixtures("grabar")
+    manifiesto = {"identificadores": list(identificadores), "fichas": {fuente: {} for fuente in FETCHERS}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, identificador in enumerate(identificadores):
+            with _base_vacia(tmp, f"grabar_{n}"):
+                for fuente, (buscar, _, resolver) in FETCHERS.items():
+                    try:
+                        resultado = buscar(identificador)
+                        # La URL de la ficha queda resuelta en la caché temporal: no vuelve a pedir la búsqueda
+                        url, _ = resolver(identificador)
+                    except http_client.ERRORES_PETICION as e:
+                        print(f"⚠️ {fuente} · {identificador}: {e}")
+                        continue
+                    print(f"{'✅' if resultado else '❌'} {fuente} · {identificador} → {url}")
+                    if url:
+                        manifiesto["fichas"][fuente][identificador] = url
+
+    ruta = ruta_manifiesto()
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    print(f"📼 Fixtures grabadas en {http_client.FIXTURES_DIR}")
+
+
+def _estadisticas(tiempos):
+    return {
+        "n": len(tiempos),
+        "media_ms": statistics.mean(tiempos) * 1000,
+        "p50_ms": statistics.median(tiempos) * 1000,
+        "min_ms": min(tiempos) * 1000,
+        "paginas_seg": len(tiempos) / sum(tiempos) if sum(tiempos) else float("inf"),
+    }
+
+
+def medir(repeticiones=10):
+    """Devuelve {(fuente, modo): estadísticas} reproduciendo las fixtures grabadas."""
+    ruta = ruta_manifiesto()
+    if not ruta.exists():
+        raise SystemExit(f"No hay fixtures grabadas ({ruta}). Ejecuta antes con --grabar.")
+    with open(ruta, "r", encoding="utf-8") as f:
+        manifiesto = json.load(f)
+
+    http_client.configurar_fixtures("reproducir")
+    resultados = {}
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        for fuente, (buscar, parsear, _) in FETCHERS.items():
+            fichas = manifiesto["fichas"].get(fuente, {})
+            extremo, parseo = [], []
+            for r in range(repeticiones):
+                for n, identificador in enumerate(fichas):
+                    with _base_vacia(tmp, f"{fuente}_{r}_{n}"):
+                        cache_db.conectar()  # el esquema se crea fuera de la medición
+                        inicio = time.perf_counter()
+                        try:
+                            buscar(identificador)
+                        except http_client.ERRORES_PETICION:
+                            pass
+                        extremo.append(time.perf_counter() - inicio)
+
+            paginas = [http_client.leer_fixture(url) for url in fichas.values()]
+            textos = [p.text for p in paginas if p is not None]
+            for _ in range(repeticiones):
+                for texto in textos:
+                    inicio = time.perf_counter()
+                    parsear(texto)
+                    parseo.append(time.perf_counter() - inicio)
+
+            if extremo:
+                resultados[(fuente, "extremo a extremo")] = _estadisticas(extremo)
+            if parseo:
+                resultados[(fuente, "solo parseo")] = _estadisticas(parseo)
+
+    return resultados
+
+
+def imprimir(resultados):
+    print(f"{'fuente':<12} {'modo':<18} {'n':>4} {'media ms':>9} {'p50 ms':>8} {'mín ms':>8} {'pág/s':>8}")
+    for (fuente, modo), e in resultados.items():
+        print(
+            f"{fuente:<12} {modo:<18} {e['n']:>4} {e['media_ms']:>9.2f} "
+            f"{e['p50_ms']:>8.2f} {e['min_ms']:>8.2f} {e['paginas_seg']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de los fetchers de NAV sobre fixtures grabadas.")
+    parser.add_argument("--grabar", nargs="+", metavar="IDENTIFICADOR", help="grabar fixtures de estos ISIN/nombres")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.grabar:
+        grabar(args.grabar)
+    else:
+        imprimir(medir(args.repeticiones))
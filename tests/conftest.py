@@ -0,0 +1,32 @@
+"""
+Fixtures compartidas por los tests que trabajan sobre un almacén NAV temporal.
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import nav_panel, nav_store
+
+ISIN_ALMACEN = "LU0000000001"
+
+
+@pytest.fixture
+def isin():
+    """ISIN del histórico que crea `almacen`."""
+    return ISIN_ALMACEN
+
+
+@pytest.fixture
+def almacen(tmp_path, isin):
+    """Almacén en tmp_path con un histórico: viernes 1, sábado 2 y lunes 4 de marzo de 2024."""
+    # La observación del fin de semana no se puede perder
+    nav_store.anadir(isin, pd.DataFrame({
+        "Date": ["2024-03-01", "2024-03-02", "2024-03-04"],
+        "Price": [10.0, 11.0, 12.0],
+    }), directorio=tmp_path)
+    yield tmp_path
+    nav_panel._paneles.pop(str(nav_panel.ruta_panel(tmp_path)), None)
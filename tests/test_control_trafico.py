@@ -0,0 +1,71 @@
+"""
+Limitador por host en los refrescos por lotes de NAVs, con fuentes y red simuladas.
+
+    python -m pytest -q tests/test_control_trafico.py
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import cache_db, control_trafico, http_client, merge_nav_data, nav_fetcher
+
+HOST = "fuente.test"
+PETICIONES_SEG = 20
+ISINS = [f"LU00000000{i:02d}" for i in range(8)]
+
+
+class _SesionFalsa:
+    """Anota el momento de cada GET y responde 200 sin salir a la red."""
+
+    def __init__(self):
+        self.momentos = []
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self._lock:
+            self.momentos.append(time.monotonic())
+        respuesta = requests.Response()
+        respuesta.status_code = 200
+        respuesta.url = url
+        return respuesta
+
+
+def _fuente_prueba(identificador):
+    http_client.get(f"https://{HOST}/fondos/{identificador}")
+    return {
+        "nombre": f"Fondo {identificador}", "isin": identificador, "nav": 100.0,
+        "fecha": "2026-10-16", "divisa": "EUR", "variacion_1d": 0.1,
+    }
+
+
+@pytest.fixture
+def sesion(monkeypatch, tmp_path):
+    sesion = _SesionFalsa()
+    monkeypatch.setattr(http_client, "MODO_FIXTURES", None)
+    monkeypatch.setattr(http_client, "sesion_para", lambda url: sesion)
+    monkeypatch.setattr(merge_nav_data, "FUENTES", [("prueba", _fuente_prueba)])
+    monkeypatch.setattr(merge_nav_data, "HOST_FUENTE", {"prueba": HOST})
+    monkeypatch.setattr(nav_fetcher, "guardar_en_historico", lambda resultados: None)
+    monkeypatch.setattr(control_trafico, "LIMITES_HOST", dict(control_trafico.LIMITES_HOST))
+    monkeypatch.setattr(control_trafico, "_limitadores", {})
+    monkeypatch.setattr(control_trafico, "_interruptores", {})
+    control_trafico.configurar_limite(PETICIONES_SEG, rafaga=1, host=HOST)
+    with cache_db.usar_base_datos(tmp_path / "cache_nav.sqlite", migrar_json=False):
+        yield sesion
+
+
+def test_refresco_por_lotes_respeta_el_limite_del_host(sesion):
+    resultados = nav_fetcher.get_nav_real_many(ISINS)
+
+    assert [r["isin"] for r in resultados] == ISINS
+    assert len(sesion.momentos) == len(ISINS)
+    # Con ráfaga 1, cada petición espera su token: el lote dura al menos (n - 1) / ritmo
+    momentos = sorted(sesion.momentos)
+    assert momentos[-1] - momentos[0] >= 0.9 * (len(ISINS) - 1) / PETICIONES_SEG
+    assert control_trafico.estado_limitadores()[HOST]["esperas"] > 0
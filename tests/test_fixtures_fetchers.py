@@ -0,0 +1,119 @@
+"""
+Reproduce las fixtures HTTP de tests/fixtures/http a través de los fetchers, sin red.
+
+Las páginas son fichas recortadas a mano con la estructura que espera cada parser
+(mismos nodos, clases y rutas XPath). Para regrabarlas contra la web real:
+    python -m tests.benchmark_fetchers --grabar IE00B2NXKW18
+
+    python -m pytest -q tests/test_fixtures_fetchers.py
+"""
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import cache_db, http_client, merge_nav_data
+from utils.morningstar_fetcher import buscar_nav_morningstar, parsear_ficha_morningstar
+from utils.ft_fetcher import buscar_nav_ft, parsear_ficha_ft
+from utils.investing_fetcher import buscar_nav_investing, parsear_ficha_investing
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "http"
+ISIN = "IE00B2NXKW18"
+NOMBRE = "Fondo Ejemplo Renta Variable Global EUR Acc"
+
+# fuente → (buscar, parsear, datos esperados de la ficha grabada)
+ESPERADOS = {
+    "morningstar": (buscar_nav_morningstar, parsear_ficha_morningstar, {
+        "nombre": NOMBRE, "isin": ISIN, "nav": 123.45, "fecha": "2026-10-16",
+        "divisa": "EUR", "fuente": "Morningstar.es", "variacion_1d": 0.52,
+    }),
+    "ft": (buscar_nav_ft, parsear_ficha_ft, {
+        "nombre": NOMBRE, "isin": ISIN, "nav": 1234.56, "fecha": "2026-10-16",
+        "divisa": "EUR", "fuente": "FT.com", "variacion_1d": 0.52,
+    }),
+    "investing": (buscar_nav_investing, parsear_ficha_investing, {
+        "nombre": f"{NOMBRE} (0P0000EJ01)", "isin": ISIN, "nav": 1234.56,
+        "divisa": "EUR", "fuente": "Investing.com", "variacion_1d": 0.52,
+    }),
+}
+
+
+@pytest.fixture
+def reproducir(monkeypatch, tmp_path):
+    """Fixtures en modo reproducir y una caché SQLite vacía en tmp_path."""
+    monkeypatch.setattr(http_client, "MODO_FIXTURES", "reproducir")
+    monkeypatch.setattr(http_client, "FIXTURES_DIR", FIXTURES_DIR)
+    with cache_db.usar_base_datos(tmp_path / "cache_nav.sqlite", migrar_json=False):
+        yield
+
+
+def _manifiesto():
+    with open(FIXTURES_DIR / "manifiesto.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _comprobar(resultado, esperado):
+    assert resultado is not None
+    for campo, valor in esperado.items():
+        assert resultado[campo] == valor, campo
+
+
+@pytest.mark.parametrize("fuente", list(ESPERADOS))
+def test_parsear_ficha_grabada(fuente, reproducir):
+    _, parsear, esperado = ESPERADOS[fuente]
+    url = _manifiesto()["fichas"][fuente][ISIN]
+    respuesta = http_client.leer_fixture(url)
+    assert respuesta is not None, f"Falta la fixture de {url}"
+
+    resultado = parsear(respuesta.text)
+    _comprobar(resultado, esperado)
+    if fuente == "investing":
+        # Investing solo publica día y mes: el año es el actual
+        assert resultado["fecha"].endswith("-10-16")
+
+
+@pytest.mark.parametrize("fuente", list(ESPERADOS))
+def test_buscar_nav_reproduce_busqueda_y_ficha(fuente, reproducir):
+    buscar, _, esperado = ESPERADOS[fuente]
+    _comprobar(buscar(ISIN), esperado)
+    # La URL de la ficha queda resuelta en la caché (FT la construye directamente desde el ISIN)
+    if fuente != "ft":
+        assert cache_db.leer_url_resuelta(fuente, ISIN) == _manifiesto()["fichas"][fuente][ISIN]
+
+
+def test_usar_base_datos_restaura_la_anterior(tmp_path):
+    anterior = cache_db.DB_PATH, cache_db.MIGRAR_JSON
+    with cache_db.usar_base_datos(tmp_path / "otra.sqlite", migrar_json=False) as ruta:
+        assert cache_db.DB_PATH == ruta
+        cache_db.conectar()
+    assert (cache_db.DB_PATH, cache_db.MIGRAR_JSON) == anterior
+
+
+def test_usar_base_datos_descarta_conexiones_anteriores(tmp_path):
+    ruta = tmp_path / "reutilizada.sqlite"
+    with ThreadPoolExecutor(max_workers=1) as hilo:
+        with cache_db.usar_base_datos(ruta, migrar_json=False):
+            hilo.submit(cache_db.registrar_fallo, "ft", "LU0000000001", "sin datos de NAV").result()
+        for sufijo in ("", "-wal", "-shm"):
+            ruta.with_name(ruta.name + sufijo).unlink(missing_ok=True)
+
+        # El hilo no reutiliza su conexión al fichero borrado: ve la base nueva, con su esquema
+        with cache_db.usar_base_datos(ruta, migrar_json=False):
+            assert hilo.submit(cache_db.listar_fallos).result() == []
+
+
+def test_sin_fixture_no_sale_a_la_red(reproducir):
+    with pytest.raises(http_client.FixtureNoEncontrada):
+        http_client.get("https://www.morningstar.es/es/no-grabada")
+
+
+def test_fallo_de_red_no_va_a_la_cache_negativa(reproducir):
+    # Sin fixtures para este ISIN, cada fuente se comporta como si no hubiera red
+    fuentes = merge_nav_data.consultar_fuentes("LU0000000001", presupuesto=0)
+    assert all(datos is None for _, datos in fuentes)
+    assert cache_db.listar_fallos() == []
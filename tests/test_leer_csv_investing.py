@@ -0,0 +1,46 @@
+"""
+Lectura de CSV de Investing.com con convenciones numéricas mezcladas.
+
+    python -m pytest -q tests/test_leer_csv_investing.py
+"""
+import io
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.historial_nav import MUESTRA_DETECCION, leer_csv_investing
+
+CABECERA = '"Date","Price","Open","High","Low","Vol.","Change %"\n'
+
+
+def _fila(fecha, precio):
+    return f'"{fecha:%m/%d/%Y}","{precio}","{precio}","{precio}","{precio}","","0.10%"\n'
+
+
+def test_magnitudes_mezcladas_tras_la_muestra():
+    # Más filas "9xx.xx" que la muestra de detección y, después, precios con miles "1,234.56"
+    fechas = pd.date_range("2010-01-01", periods=MUESTRA_DETECCION + 502, freq="D")
+    filas = [_fila(f, f"{900 + i % 100}.{i % 100:02d}") for i, f in enumerate(fechas[:-2])]
+    filas.append(_fila(fechas[-2], "1,234.56"))
+    filas.append(_fila(fechas[-1], "12,345.00"))
+
+    df = leer_csv_investing(io.StringIO(CABECERA + "".join(filas)))
+
+    assert df["Price"].notna().all()
+    assert df["Price"].iloc[-2:].tolist() == [1234.56, 12345.0]
+    assert df["High"].iloc[-1] == 12345.0
+    assert df["Price"].iloc[0] == 900.0
+    assert df.attrs["resumen_ingesta"]["precios_invalidos"] == 0
+
+
+def test_formato_europeo_con_un_valor_en_formato_ingles():
+    fechas = pd.date_range("2020-01-01", periods=4, freq="D")
+    precios = ["1.234,56", "1.240,10", "1,250.75", "998,20"]
+    texto = CABECERA + "".join(_fila(f, p) for f, p in zip(fechas, precios))
+
+    df = leer_csv_investing(io.StringIO(texto))
+
+    assert df["Price"].tolist() == [1234.56, 1240.10, 1250.75, 998.20]
@@ -0,0 +1,16 @@
+"""
+Series diarias del panel NAV sobre un almacén temporal.
+
+    python -m pytest -q tests/test_nav_panel.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import nav_panel
+
+
+def test_navs_diarios_incluye_el_sabado(almacen, isin):
+    df = nav_panel.navs_diarios([isin], "2024-03-05", directorio=almacen)
+    assert df["Price"].tolist() == [10.0, 11.0, 11.0, 12.0, 12.0]
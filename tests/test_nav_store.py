@@ -0,0 +1,39 @@
+"""
+Migración de los {ISIN}.csv al almacén Parquet (utils.nav_store) en un directorio temporal.
+
+    python -m pytest -q tests/test_nav_store.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import nav_store
+
+ISIN = "LU0000000001"
+CABECERA = "Date,Price,Open,High,Low,Change %\n"
+
+
+def test_migrar_csv_deja_el_original_y_no_repite(tmp_path):
+    csv = tmp_path / f"{ISIN}.csv"
+    csv.write_text(CABECERA + "2024-03-01,10,10,10,10,0.1%\n2024-03-04,12,12,12,12,0.2%\n", encoding="utf-8")
+
+    assert nav_store.migrar_csv(ISIN, tmp_path)
+    assert csv.exists()
+    assert nav_store.leer(ISIN, directorio=tmp_path)["Price"].tolist() == [10.0, 12.0]
+
+    # Mismo contenido: no se vuelve a importar ni se añaden partes
+    partes = nav_store.partes(ISIN, tmp_path)
+    assert nav_store.migrar_csvs(tmp_path) == 0
+    assert nav_store.partes(ISIN, tmp_path) == partes
+
+
+def test_migrar_csv_modificado_solo_anade_fechas_nuevas(tmp_path):
+    csv = tmp_path / f"{ISIN}.csv"
+    csv.write_text(CABECERA + "2024-03-01,10,10,10,10,0.1%\n", encoding="utf-8")
+    nav_store.migrar_csv(ISIN, tmp_path)
+
+    csv.write_text(CABECERA + "2024-03-01,99,99,99,99,0.1%\n2024-03-04,12,12,12,12,0.2%\n", encoding="utf-8")
+    assert nav_store.migrar_csv(ISIN, tmp_path)
+    assert nav_store.leer(ISIN, directorio=tmp_path)["Price"].tolist() == [10.0, 12.0]
+    assert nav_store._leer_origen_csv(ISIN, tmp_path)["filas_nuevas"] == 1
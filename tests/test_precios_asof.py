@@ -0,0 +1,46 @@
+"""
+Consultas as-of de NAVs (utils.precios_asof) sobre un almacén temporal.
+
+    python -m pytest -q tests/test_precios_asof.py
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import nav_panel, nav_store, precios_asof
+
+
+@pytest.mark.parametrize("fecha, observada, precio", [
+    ("2024-03-01", "2024-03-01", 10.0),
+    ("2024-03-02", "2024-03-02", 11.0),
+    ("2024-03-03", "2024-03-02", 11.0),
+    ("2024-03-04", "2024-03-04", 12.0),
+    ("2024-03-05", "2024-03-04", 12.0),
+])
+def test_buscar_nav_hacia_atras(almacen, isin, fecha, observada, precio):
+    assert precios_asof.buscar_nav(isin, fecha, directorio=almacen) == (pd.Timestamp(observada), precio)
+
+
+def test_direcciones_y_tolerancia(almacen, isin):
+    assert precios_asof.buscar_nav(isin, "2024-02-29", directorio=almacen) == (None, None)
+    assert precios_asof.buscar_nav(isin, "2024-03-03", precios_asof.ADELANTE, directorio=almacen)[1] == 12.0
+    assert precios_asof.buscar_nav(isin, "2024-03-03", precios_asof.CERCANA, directorio=almacen)[1] == 11.0
+    assert precios_asof.buscar_nav(isin, "2024-03-10", tolerancia_dias=3, directorio=almacen) == (None, None)
+    assert precios_asof.buscar_nav(isin, "2024-03-07", tolerancia_dias=3, directorio=almacen)[1] == 12.0
+
+
+def test_serie_caduca_con_el_historico(almacen, isin):
+    precios_asof.buscar_nav(isin, "2024-03-05", directorio=almacen)
+    nav_store.anadir(isin, pd.DataFrame({"Date": ["2024-03-05"], "Price": [13.0]}), directorio=almacen)
+    assert precios_asof.buscar_nav(isin, "2024-03-05", directorio=almacen)[1] == 13.0
+
+
+def test_coincide_con_el_panel_diario(almacen, isin):
+    panel = nav_panel.navs_diarios([isin], "2024-03-08", directorio=almacen)
+    precios, _ = precios_asof.buscar_navs([isin] * len(panel), panel["Fecha"], directorio=almacen)
+    np.testing.assert_array_equal(precios, panel["Price"].to_numpy())
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+from utils.config import LOCKS_DIR
+
+# Bloqueos entre procesos (varios workers de Streamlit, el precalentado por CLI...)
+# mediante ficheros con lock exclusivo del sistema operativo. El SO libera el lock
+# si el proceso muere, así que no quedan bloqueos huérfanos.
+
+if os.name == "nt":
+    import msvcrt
+
+    def _intentar_bloquear(fd):
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _desbloquear(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _intentar_bloquear(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _desbloquear(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+ESPERA_REINTENTO_SEG = 0.1
+
+
+def ruta_bloqueo(nombre):
+    """Fichero de lock para `nombre` (legible + hash para evitar colisiones y caracteres raros)."""
+    legible = re.sub(r"[^A-Za-z0-9]+", "_", nombre)[:40]
+    resumen = hashlib.sha1(nombre.encode("utf-8")).hexdigest()[:10]
+    return LOCKS_DIR / f"{legible}_{resumen}.lock"
+
+
+@contextmanager
+def bloqueo_exclusivo(nombre, timeout=None):
+    """
+    Context manager que mantiene un lock exclusivo entre procesos sobre `nombre`.
+    Devuelve True si se obtuvo o False si venció `timeout` (segundos) sin obtenerlo;
+    en ese caso el bloque se ejecuta igualmente y el llamador decide.
+    """
+    LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(ruta_bloqueo(nombre), os.O_RDWR | os.O_CREAT)
+    adquirido = False
+    try:
+        limite = None if timeout is None else time.monotonic() + timeout
+        while not (adquirido := _intentar_bloquear(fd)):
+            if limite is not None and time.monotonic() >= limite:
+                break
+            time.sleep(ESPERA_REINTENTO_SEG)
+        yield adquirido
+    finally:
+        if adquirido:
+            _desbloquear(fd)
+        os.close(fd)
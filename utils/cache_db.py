@@ -0,0 +1,569 @@
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from unidecode import unidecode
+from utils.config import CACHE_DB_PATH, CACHE_JSON_LEGACY
+
+# Caché unificada de NAV en SQLite. Sustituye a los cuatro JSON (uno por fuente
+# más cache_nav_real.json): cada entrada es una fila (fuente, clave) y las
+# escrituras son upserts transaccionales en lugar de reescribir el fichero entero.
+
+DB_PATH = CACHE_DB_PATH
+MIGRAR_JSON = True
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS cache_nav (
+    fuente      TEXT NOT NULL,
+    clave       TEXT NOT NULL,
+    isin        TEXT,
+    nombre_norm TEXT,
+    timestamp   TEXT NOT NULL,
+    datos       TEXT NOT NULL,
+    PRIMARY KEY (fuente, clave)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_nav_isin ON cache_nav (fuente, isin);
+CREATE INDEX IF NOT EXISTS idx_cache_nav_nombre ON cache_nav (fuente, nombre_norm);
+-- Índice persistente de alias (nombre normalizado, ISIN, SINISIN-*, clave) → ISIN canónico
+CREATE TABLE IF NOT EXISTS alias_nav (
+    fuente TEXT NOT NULL,
+    alias  TEXT NOT NULL,
+    isin   TEXT NOT NULL,
+    PRIMARY KEY (fuente, alias)
+);
+-- Trigramas de los alias de nombre, para búsquedas por subcadena sin recorrer la caché
+CREATE TABLE IF NOT EXISTS trigramas_nav (
+    fuente   TEXT NOT NULL,
+    trigrama TEXT NOT NULL,
+    isin     TEXT NOT NULL,
+    PRIMARY KEY (fuente, trigrama, isin)
+);
+-- URL de ficha ya resuelta por fuente (identificador → snapshot), evita repetir la búsqueda
+CREATE TABLE IF NOT EXISTS urls_resueltas (
+    fuente        TEXT NOT NULL,
+    identificador TEXT NOT NULL,
+    url           TEXT NOT NULL,
+    timestamp     TEXT NOT NULL,
+    PRIMARY KEY (fuente, identificador)
+);
+-- Caché negativa: identificadores que una fuente no supo resolver, con backoff exponencial
+CREATE TABLE IF NOT EXISTS cache_negativa (
+    fuente            TEXT NOT NULL,
+    identificador     TEXT NOT NULL,
+    motivo            TEXT,
+    intentos          INTEGER NOT NULL,
+    ultimo_fallo      TEXT NOT NULL,
+    proximo_reintento TEXT NOT NULL,
+    PRIMARY KEY (fuente, identificador)
+);
+-- Telemetría por (fuente, identificador): latencia y completitud como medias móviles exponenciales
+CREATE TABLE IF NOT EXISTS telemetria_fuentes (
+    fuente          TEXT NOT NULL,
+    identificador   TEXT NOT NULL,
+    consultas       INTEGER NOT NULL,
+    exitos          INTEGER NOT NULL,
+    latencia_seg    REAL NOT NULL,
+    completitud     REAL NOT NULL,
+    ultima_consulta TEXT NOT NULL,
+    PRIMARY KEY (fuente, identificador)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+"""
+
+# La URL de la ficha de un fondo no cambia: se guarda mucho más tiempo que el NAV
+URL_RESUELTA_TTL_DIAS = 90
+
+# Backoff de la caché negativa: 30 min tras el primer fallo, doblando hasta un máximo de 7 días
+NEGATIVA_ESPERA_BASE_MIN = 30
+NEGATIVA_ESPERA_MAX_HORAS = 7 * 24
+
+# Peso de la última observación en las medias móviles de la telemetría de fuentes
+TELEMETRIA_ALFA = 0.3
+
+# Fuentes cuyas entradas se indexan por alias (la caché combinada que consulta get_nav_real)
+FUENTES_INDEXADAS = {"real"}
+
+# Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+_local = threading.local()
+_INIT_LOCK = threading.Lock()
+_inicializada = set()
+# Cambia con cada usar_base_datos: cada hilo descarta las conexiones que abrió antes
+_generacion = 0
+
+
+def normalizar_nombre(nombre):
+    """Minúsculas, sin acentos y con espacios colapsados. Clave de búsqueda por nombre."""
+    if not isinstance(nombre, str):
+        return None
+    return re.sub(r"\s+", " ", unidecode(nombre).lower()).strip() or None
+
+
+def conectar():
+    """Devuelve la conexión del hilo actual, creando el esquema y migrando los JSON la primera vez."""
+    conexiones = getattr(_local, "conexiones", None)
+    if conexiones is None or getattr(_local, "generacion", None) != _generacion:
+        _cerrar_conexiones_hilo()
+        conexiones = _local.conexiones = {}
+        _local.generacion = _generacion
+
+    ruta = str(DB_PATH)
+    conn = conexiones.get(ruta)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(ruta, timeout=30)
+        # WAL permite lectores concurrentes mientras otra sesión escribe
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conexiones[ruta] = conn
+
+        with _INIT_LOCK:
+            if ruta not in _inicializada:
+                conn.executescript(_ESQUEMA)
+                _inicializada.add(ruta)
+                if MIGRAR_JSON and not _leer_meta(conn, "migracion_json"):
+                    migrar_desde_json(conn)
+                if not _leer_meta(conn, "indice_alias"):
+                    reconstruir_indice_alias(conn)
+    return conn
+
+
+def _cerrar_conexiones_hilo():
+    for conn in getattr(_local, "conexiones", {}).values():
+        conn.close()
+    _local.conexiones = {}
+
+
+@contextmanager
+def usar_base_datos(ruta, migrar_json=True):
+    """
+    Solo para tests y benchmarks: apunta la caché de todo el proceso a otra base (p. ej.
+    una vacía) mientras dure el bloque `with`; al salir se restaura la anterior.
+    Con migrar_json=False no se importan los JSON antiguos al crearla.
+
+    No es seguro con otros hilos usando la caché a la vez (p. ej. refrescos en segundo
+    plano): todos ven la base temporal durante el bloque, y una tarea que siga en marcha
+    al salir escribe ya en la restaurada. Las conexiones abiertas antes del cambio se
+    descartan en cada hilo la próxima vez que llame a conectar(), y el esquema de `ruta`
+    se vuelve a crear aunque esa ruta ya se hubiera usado (el fichero puede ser nuevo).
+    """
+    global DB_PATH, MIGRAR_JSON, _generacion
+    with _INIT_LOCK:
+        anterior = DB_PATH, MIGRAR_JSON
+        DB_PATH = Path(ruta)
+        MIGRAR_JSON = migrar_json
+        _inicializada.discard(str(DB_PATH))
+        _generacion += 1
+    try:
+        yield DB_PATH
+    finally:
+        with _INIT_LOCK:
+            DB_PATH, MIGRAR_JSON = anterior
+            _generacion += 1
+        # Las de este hilo se cierran ya, para poder borrar la base temporal
+        _cerrar_conexiones_hilo()
+
+
+def _leer_meta(conn, clave):
+    fila = conn.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+    return fila[0] if fila else None
+
+
+def _fila(fuente, clave, datos, timestamp):
+    datos = datos or {}
+    isin = datos.get("isin") or None
+    return (
+        fuente,
+        clave,
+        isin.upper() if isinstance(isin, str) else None,
+        normalizar_nombre(datos.get("nombre")),
+        timestamp or datetime.now().isoformat(),
+        json.dumps(datos, ensure_ascii=False),
+    )
+
+
+def trigramas(texto):
+    """Conjunto de trigramas de un texto ya normalizado."""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _isin_canonico(clave, datos):
+    isin = (datos or {}).get("isin")
+    if isinstance(isin, str) and isin.strip():
+        return isin.strip().upper()
+    if re.fullmatch(r"[A-Z]{2}[A-Z0-9]{10}|SINISIN-.+", clave.strip().upper()):
+        return clave.strip().upper()
+    return None
+
+
+def _indexar_alias(conn, fuente, entradas):
+    """Registra clave, nombre e ISIN de cada entrada como alias de su ISIN canónico."""
+    alias_filas, trigrama_filas = [], []
+    for clave, datos in entradas.items():
+        isin = _isin_canonico(clave, datos)
+        if not isin:
+            continue
+        for alias in {normalizar_nombre(clave), normalizar_nombre((datos or {}).get("nombre")), isin.lower()}:
+            if not alias:
+                continue
+            alias_filas.append((fuente, alias, isin))
+            trigrama_filas.extend((fuente, t, isin) for t in trigramas(alias))
+    conn.executemany(
+        "INSERT OR REPLACE INTO alias_nav (fuente, alias, isin) VALUES (?, ?, ?)", alias_filas
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO trigramas_nav (fuente, trigrama, isin) VALUES (?, ?, ?)", trigrama_filas
+    )
+
+
+def reconstruir_indice_alias(conn=None):
+    """Regenera alias y trigramas a partir de las entradas ya guardadas."""
+    conn = conn or conectar()
+    with conn:
+        conn.execute("DELETE FROM alias_nav")
+        conn.execute("DELETE FROM trigramas_nav")
+        for fuente in FUENTES_INDEXADAS:
+            filas = conn.execute(
+                "SELECT clave, datos FROM cache_nav WHERE fuente = ?", (fuente,)
+            ).fetchall()
+            _indexar_alias(conn, fuente, {clave: json.loads(datos) for clave, datos in filas})
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('indice_alias', ?)",
+            (datetime.now().isoformat(),),
+        )
+
+
+def guardar_entradas(fuente, entradas, timestamp=None, conn=None):
+    """
+    Inserta o actualiza varias entradas {clave: datos} de una fuente en una sola transacción.
+    En las fuentes indexadas también actualiza el índice de alias.
+    """
+    if not entradas:
+        return
+    conn = conn or conectar()
+    filas = [_fila(fuente, clave, datos, timestamp) for clave, datos in entradas.items()]
+    with conn:
+        if fuente in FUENTES_INDEXADAS:
+            _indexar_alias(conn, fuente, entradas)
+        conn.executemany(
+            """
+            INSERT INTO cache_nav (fuente, clave, isin, nombre_norm, timestamp, datos)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (fuente, clave) DO UPDATE SET
+                isin = excluded.isin,
+                nombre_norm = excluded.nombre_norm,
+                timestamp = excluded.timestamp,
+                datos = excluded.datos
+            """,
+            filas,
+        )
+
+
+def guardar_entrada(fuente, clave, datos, timestamp=None):
+    guardar_entradas(fuente, {clave: datos}, timestamp=timestamp)
+
+
+def leer_entrada(fuente, clave):
+    """Devuelve {"timestamp", "data"} para (fuente, clave) o None."""
+    fila = conectar().execute(
+        "SELECT timestamp, datos FROM cache_nav WHERE fuente = ? AND clave = ?",
+        (fuente, clave),
+    ).fetchone()
+    if not fila:
+        return None
+    return {"timestamp": fila[0], "data": json.loads(fila[1])}
+
+
+def leer_fuente(fuente):
+    """Devuelve todas las entradas de una fuente como {clave: {"timestamp", "data"}}."""
+    filas = conectar().execute(
+        "SELECT clave, timestamp, datos FROM cache_nav WHERE fuente = ?", (fuente,)
+    ).fetchall()
+    return {clave: {"timestamp": ts, "data": json.loads(datos)} for clave, ts, datos in filas}
+
+
+def buscar_por_isin(fuente, isin, con_nav=False):
+    """Entrada más reciente de una fuente cuyo contenido tiene ese ISIN, o None."""
+    filtro_nav = "AND json_extract(datos, '$.nav') IS NOT NULL" if con_nav else ""
+    fila = conectar().execute(
+        f"""
+        SELECT clave, timestamp, datos FROM cache_nav
+        WHERE fuente = ? AND isin = ? {filtro_nav}
+        ORDER BY timestamp DESC LIMIT 1
+        """,
+        (fuente, isin.upper()),
+    ).fetchone()
+    if not fila:
+        return None
+    return {"clave": fila[0], "timestamp": fila[1], "data": json.loads(fila[2])}
+
+
+def buscar_por_nombre(fuente, nombre):
+    """Entrada más reciente de una fuente con ese nombre normalizado, o None."""
+    nombre_norm = normalizar_nombre(nombre)
+    if not nombre_norm:
+        return None
+    fila = conectar().execute(
+        """
+        SELECT clave, timestamp, datos FROM cache_nav
+        WHERE fuente = ? AND nombre_norm = ?
+        ORDER BY timestamp DESC LIMIT 1
+        """,
+        (fuente, nombre_norm),
+    ).fetchone()
+    if not fila:
+        return None
+    return {"clave": fila[0], "timestamp": fila[1], "data": json.loads(fila[2])}
+
+
+def resolver_alias(fuente, texto):
+    """ISIN canónico cuyo alias coincide exactamente con `texto` normalizado, o None."""
+    alias = normalizar_nombre(texto)
+    if not alias:
+        return None
+    fila = conectar().execute(
+        "SELECT isin FROM alias_nav WHERE fuente = ? AND alias = ?", (fuente, alias)
+    ).fetchone()
+    return fila[0] if fila else None
+
+
+def buscar_alias_por_subcadena(fuente, texto):
+    """
+    ISINs canónicos con algún alias que contiene `texto` normalizado.
+    Los candidatos salen del índice de trigramas y luego se verifica la subcadena.
+    """
+    consulta = normalizar_nombre(texto)
+    if not consulta:
+        return []
+    conn = conectar()
+
+    if len(consulta) < 3:
+        # Demasiado corto para trigramas: solo prefijo, que también usa el índice
+        filas = conn.execute(
+            "SELECT DISTINCT isin FROM alias_nav WHERE fuente = ? AND alias >= ? AND alias < ?",
+            (fuente, consulta, consulta + "\U0010ffff"),
+        ).fetchall()
+        return [fila[0] for fila in filas]
+
+    tris = sorted(trigramas(consulta))
+    marcadores = ", ".join("?" for _ in tris)
+    candidatos = [
+        fila[0]
+        for fila in conn.execute(
+            f"""
+            SELECT isin FROM trigramas_nav
+            WHERE fuente = ? AND trigrama IN ({marcadores})
+            GROUP BY isin HAVING COUNT(DISTINCT trigrama) = ?
+            """,
+            (fuente, *tris, len(tris)),
+        ).fetchall()
+    ]
+    if not candidatos:
+        return []
+
+    marcadores = ", ".join("?" for _ in candidatos)
+    filas = conn.execute(
+        f"SELECT isin, alias FROM alias_nav WHERE fuente = ? AND isin IN ({marcadores})",
+        (fuente, *candidatos),
+    ).fetchall()
+    return sorted({isin for isin, alias in filas if consulta in alias})
+
+
+def leer_url_resuelta(fuente, identificador, ttl_dias=URL_RESUELTA_TTL_DIAS):
+    """URL de ficha guardada para (fuente, identificador) si no ha caducado, o None."""
+    fila = conectar().execute(
+        "SELECT url, timestamp FROM urls_resueltas WHERE fuente = ? AND identificador = ?",
+        (fuente, identificador.strip().lower()),
+    ).fetchone()
+    if not fila:
+        return None
+    try:
+        if datetime.now() - datetime.fromisoformat(fila[1]) > timedelta(days=ttl_dias):
+            return None
+    except ValueError:
+        return None
+    return fila[0]
+
+
+def guardar_url_resuelta(fuente, identificador, url):
+    conn = conectar()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO urls_resueltas (fuente, identificador, url, timestamp)
+            VALUES (?, ?, ?, ?)
+            """,
+            (fuente, identificador.strip().lower(), url, datetime.now().isoformat()),
+        )
+
+
+def invalidar_url_resuelta(fuente, identificador):
+    """Olvida la URL guardada, p.ej. cuando la ficha devuelve 404."""
+    conn = conectar()
+    with conn:
+        conn.execute(
+            "DELETE FROM urls_resueltas WHERE fuente = ? AND identificador = ?",
+            (fuente, identificador.strip().lower()),
+        )
+
+
+def leer_fallo(fuente, identificador):
+    """Entrada de la caché negativa para (fuente, identificador), o None."""
+    fila = conectar().execute(
+        """
+        SELECT motivo, intentos, ultimo_fallo, proximo_reintento FROM cache_negativa
+        WHERE fuente = ? AND identificador = ?
+        """,
+        (fuente, identificador.strip().lower()),
+    ).fetchone()
+    if not fila:
+        return None
+    return {
+        "fuente": fuente,
+        "identificador": identificador.strip().lower(),
+        "motivo": fila[0],
+        "intentos": fila[1],
+        "ultimo_fallo": fila[2],
+        "proximo_reintento": fila[3],
+    }
+
+
+def en_espera(fallo):
+    """True si el fallo registrado aún no permite reintentar."""
+    return bool(fallo) and datetime.now() < datetime.fromisoformat(fallo["proximo_reintento"])
+
+
+def registrar_fallo(fuente, identificador, motivo):
+    """Anota un fallo y programa el siguiente reintento con backoff exponencial."""
+    previo = leer_fallo(fuente, identificador)
+    intentos = (previo["intentos"] if previo else 0) + 1
+    espera = min(
+        timedelta(minutes=NEGATIVA_ESPERA_BASE_MIN * 2 ** (intentos - 1)),
+        timedelta(hours=NEGATIVA_ESPERA_MAX_HORAS),
+    )
+    ahora = datetime.now()
+    conn = conectar()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO cache_negativa
+                (fuente, identificador, motivo, intentos, ultimo_fallo, proximo_reintento)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (fuente, identificador.strip().lower(), motivo, intentos,
+             ahora.isoformat(), (ahora + espera).isoformat()),
+        )
+
+
+def borrar_fallo(fuente, identificador):
+    """Quita un identificador de la caché negativa (éxito posterior o borrado manual)."""
+    conn = conectar()
+    with conn:
+        conn.execute(
+            "DELETE FROM cache_negativa WHERE fuente = ? AND identificador = ?",
+            (fuente, identificador.strip().lower()),
+        )
+
+
+def listar_fallos():
+    """Todas las entradas de la caché negativa, las más recientes primero."""
+    filas = conectar().execute(
+        """
+        SELECT fuente, identificador, motivo, intentos, ultimo_fallo, proximo_reintento
+        FROM cache_negativa ORDER BY ultimo_fallo DESC
+        """
+    ).fetchall()
+    columnas = ["fuente", "identificador", "motivo", "intentos", "ultimo_fallo", "proximo_reintento"]
+    return [dict(zip(columnas, fila)) for fila in filas]
+
+
+def registrar_telemetria(fuente, identificador, exito, latencia_seg, completitud):
+    """Acumula una consulta a `fuente` para `identificador` (completitud entre 0 y 1)."""
+    conn = conectar()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO telemetria_fuentes
+                (fuente, identificador, consultas, exitos, latencia_seg, completitud, ultima_consulta)
+            VALUES (?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (fuente, identificador) DO UPDATE SET
+                consultas = consultas + 1,
+                exitos = exitos + excluded.exitos,
+                latencia_seg = latencia_seg + ? * (excluded.latencia_seg - latencia_seg),
+                completitud = completitud + ? * (excluded.completitud - completitud),
+                ultima_consulta = excluded.ultima_consulta
+            """,
+            (fuente, identificador.strip().lower(), int(bool(exito)), latencia_seg, completitud,
+             datetime.now().isoformat(), TELEMETRIA_ALFA, TELEMETRIA_ALFA),
+        )
+
+
+def leer_telemetria(identificador):
+    """Telemetría de cada fuente para `identificador` como {fuente: {...}}."""
+    filas = conectar().execute(
+        """
+        SELECT fuente, consultas, exitos, latencia_seg, completitud, ultima_consulta
+        FROM telemetria_fuentes WHERE identificador = ?
+        """,
+        (identificador.strip().lower(),),
+    ).fetchall()
+    columnas = ["consultas", "exitos", "latencia_seg", "completitud", "ultima_consulta"]
+    return {fila[0]: dict(zip(columnas, fila[1:])) for fila in filas}
+
+
+def listar_telemetria():
+    """Toda la telemetría de fuentes, las consultas más recientes primero."""
+    filas = conectar().execute(
+        """
+        SELECT fuente, identificador, consultas, exitos, latencia_seg, completitud, ultima_consulta
+        FROM telemetria_fuentes ORDER BY ultima_consulta DESC
+        """
+    ).fetchall()
+    columnas = ["fuente", "identificador", "consultas", "exitos", "latencia_seg", "completitud", "ultima_consulta"]
+    return [dict(zip(columnas, fila)) for fila in filas]
+
+
+def migrar_desde_json(conn=None):
+    """
+    Migración única desde los JSON antiguos. Los ficheros de las fuentes guardan
+    {clave: {"timestamp", "data"}}; cache_nav_real.json guarda {clave: datos}.
+    Los JSON se dejan en disco como copia de seguridad.
+    """
+    conn = conn or conectar()
+    total = 0
+    for fuente, ruta in CACHE_JSON_LEGACY.items():
+        if not ruta.exists():
+            continue
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                contenido = json.load(f)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer {ruta} para migrar: {e}")
+            continue
+
+        por_timestamp = {}
+        for clave, valor in contenido.items():
+            if not isinstance(valor, dict):
+                continue
+            if fuente == "real":
+                por_timestamp.setdefault(None, {})[clave] = valor
+            elif "data" in valor:
+                # Las fuentes guardaban las claves en minúsculas
+                por_timestamp.setdefault(valor.get("timestamp"), {})[clave.lower()] = valor["data"]
+
+        for timestamp, entradas in por_timestamp.items():
+            guardar_entradas(fuente, entradas, timestamp=timestamp, conn=conn)
+            total += len(entradas)
+
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('migracion_json', ?)",
+            (datetime.now().isoformat(),),
+        )
+    print(f"📦 Migradas {total} entradas de caché JSON a {DB_PATH}")
+    return total
@@ -0,0 +1,120 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from utils.config import CALENDARIOS_NAV
+
+# Los fondos publican el NAV de un día hábil con cierto retraso (normalmente al día
+# hábil siguiente). Con el calendario del domicilio se calcula cuándo puede existir
+# un NAV más nuevo que el cacheado y solo entonces merece la pena volver a scrapear.
+
+CALENDARIO_POR_DEFECTO = {
+    "festivos_fijos": ["01-01", "05-01", "12-25", "12-26"],
+    "festivos_moviles": ["viernes_santo", "lunes_pascua"],
+    "festivos_extra": [],
+    "retraso_dias_habiles": 1,
+    "hora_publicacion": "09:00",
+}
+
+# Si el NAV esperado ya debería estar publicado pero el último scrapeo no lo trajo,
+# se espera este margen antes de volver a intentarlo
+REINTENTO_HORAS = 6
+
+
+def domicilio_isin(isin):
+    """País de domicilio según el prefijo del ISIN, o None si no es un ISIN."""
+    if not isinstance(isin, str) or isin.upper().startswith("SINISIN") or len(isin) < 2:
+        return None
+    return isin[:2].upper()
+
+
+def calendario_para(domicilio):
+    """Configuración del calendario del domicilio, completada con la de por defecto."""
+    calendario = dict(CALENDARIO_POR_DEFECTO)
+    calendario.update(CALENDARIOS_NAV.get("default", {}))
+    if domicilio:
+        calendario.update(CALENDARIOS_NAV.get(domicilio, {}))
+    return calendario
+
+
+def _domingo_pascua(anio):
+    # Algoritmo de Meeus/Jones/Butcher (calendario gregoriano)
+    a = anio % 19
+    b, c = divmod(anio, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(anio, mes, dia + 1)
+
+
+@lru_cache(maxsize=None)
+def festivos(domicilio, anio):
+    """Conjunto de festivos de un domicilio en un año."""
+    calendario = calendario_para(domicilio)
+    dias = set()
+    for mm_dd in calendario["festivos_fijos"]:
+        mes, dia = map(int, mm_dd.split("-"))
+        dias.add(date(anio, mes, dia))
+
+    pascua = _domingo_pascua(anio)
+    moviles = {"viernes_santo": pascua - timedelta(days=2), "lunes_pascua": pascua + timedelta(days=1)}
+    for nombre in calendario["festivos_moviles"]:
+        if nombre in moviles:
+            dias.add(moviles[nombre])
+
+    for extra in calendario["festivos_extra"]:
+        dia = date.fromisoformat(extra)
+        if dia.year == anio:
+            dias.add(dia)
+    return frozenset(dias)
+
+
+def es_dia_habil(dia, domicilio=None):
+    return dia.weekday() < 5 and dia not in festivos(domicilio, dia.year)
+
+
+def sumar_dias_habiles(dia, n, domicilio=None):
+    """Avanza `n` días hábiles desde `dia` (sin contar el propio `dia`)."""
+    while n > 0:
+        dia += timedelta(days=1)
+        if es_dia_habil(dia, domicilio):
+            n -= 1
+    return dia
+
+
+def proxima_publicacion(fecha_nav, domicilio=None):
+    """
+    Momento a partir del cual puede estar publicado el NAV siguiente a `fecha_nav`:
+    el NAV del siguiente día hábil, publicado `retraso_dias_habiles` después a la
+    `hora_publicacion` del calendario.
+    """
+    calendario = calendario_para(domicilio)
+    siguiente_nav = sumar_dias_habiles(fecha_nav, 1, domicilio)
+    dia_publicacion = sumar_dias_habiles(siguiente_nav, int(calendario["retraso_dias_habiles"]), domicilio)
+    hora = time.fromisoformat(calendario["hora_publicacion"])
+    return datetime.combine(dia_publicacion, hora)
+
+
+def nav_expirado(datos, obtenido, ahora=None):
+    """
+    Decide si un NAV cacheado puede haber quedado superado.
+
+    `datos` es la entrada de caché (usa "fecha" e "isin") y `obtenido` el momento
+    del scrapeo. Devuelve (expirado, motivo).
+    """
+    ahora = ahora or datetime.now()
+    fecha_nav = date.fromisoformat(str(datos.get("fecha"))[:10])
+    disponible = proxima_publicacion(fecha_nav, domicilio_isin(datos.get("isin")))
+
+    if ahora < disponible:
+        return False, f"NAV del {fecha_nav}, el siguiente no se espera antes de {disponible:%Y-%m-%d %H:%M}"
+
+    # Ya se scrapeó después de la publicación esperada sin obtener un NAV nuevo
+    # (retraso de la gestora o festivo no configurado): no insistir en cada recarga
+    if obtenido and obtenido >= disponible and ahora - obtenido < timedelta(hours=REINTENTO_HORAS):
+        return False, f"NAV del {fecha_nav} consultado a las {obtenido:%H:%M}, reintento en {REINTENTO_HORAS} h"
+
+    return True, f"NAV del {fecha_nav}, publicación esperada desde {disponible:%Y-%m-%d %H:%M}"
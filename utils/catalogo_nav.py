@@ -0,0 +1,288 @@
+import bisect
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils import cache_db, nav_store
+from utils.bloqueos import bloqueo_exclusivo
+from utils.config import CACHE_NOMBRE_PATH, NAV_HISTORICO_DIR
+
+# Catálogo de los históricos NAV (data/nav_historico/_catalogo.json). Por ISIN guarda
+# la firma del histórico con la que se calculó la entrada y sus metadatos:
+#   filas, desde, hasta, intervalos continuos de fechas, checksum del contenido,
+#   divisa y nombre del activo
+# Se actualiza al guardar un histórico (fusionando solo las filas nuevas) y, si la
+# firma no coincide con la del almacén (migración, compactación, otro proceso...), se
+# recalcula leyendo el histórico una vez. Así los listados, el resumen y la revisión
+# de cobertura no necesitan abrir los históricos ni scrapear nombres.
+#
+# El checksum es la suma (módulo 2^64) de un hash por fila, independiente del orden:
+# como al guardar solo se añaden fechas nuevas, se actualiza sumando las filas añadidas.
+
+CATALOGO = "_catalogo.json"
+CAMPOS_METADATOS = ("divisa", "nombre")
+# Misma fuente que usa nav_fetcher para los NAV consultados online
+FUENTE_CACHE_NAV = "real"
+
+_catalogos = {}
+_nombres = {}
+_CATALOGOS_LOCK = threading.Lock()
+
+
+def ruta_catalogo(directorio=None):
+    return Path(directorio if directorio is not None else NAV_HISTORICO_DIR) / CATALOGO
+
+
+def _bloqueo(directorio=None):
+    return bloqueo_exclusivo(f"catalogo_{ruta_catalogo(directorio).resolve()}")
+
+
+def calcular_intervalos(fechas) -> list:
+    """
+    Intervalos continuos (sin saltos de más de un día) de una colección de fechas.
+    Lista de dicts con start, end y rows, como detectar_intervalos_continuos.
+    """
+    dias = np.unique(pd.to_datetime(pd.Series(fechas), errors="coerce").dropna().values.astype("datetime64[D]"))
+    if not len(dias):
+        return []
+    cortes = np.flatnonzero(np.diff(dias).astype("int64") > 1) + 1
+    inicios = np.concatenate([[0], cortes])
+    finales = np.concatenate([cortes - 1, [len(dias) - 1]])
+    return [
+        {"start": str(dias[i]), "end": str(dias[f]), "rows": int(f - i + 1)}
+        for i, f in zip(inicios, finales)
+    ]
+
+
+def _fusionar_intervalos(intervalos, nuevos) -> list:
+    """Une dos listas de intervalos de fechas disjuntas, juntando los contiguos."""
+    resultado = []
+    for intervalo in sorted(intervalos + nuevos, key=lambda i: i["start"]):
+        if resultado and (pd.Timestamp(intervalo["start"]) - pd.Timestamp(resultado[-1]["end"])).days <= 1:
+            ultimo = resultado[-1]
+            ultimo["end"] = max(ultimo["end"], intervalo["end"])
+            ultimo["rows"] += intervalo["rows"]
+        else:
+            resultado.append(dict(intervalo))
+    return resultado
+
+
+def checksum_filas(df) -> int:
+    """Suma (módulo 2^64) del hash de cada fila de las columnas del histórico."""
+    if df.empty:
+        return 0
+    filas = pd.DataFrame({
+        "Date": df["Date"].values.astype("datetime64[D]").astype("int64"),
+        **{col: df[col].astype("float64").values for col in nav_store.COLUMNAS_NUMERICAS},
+    })
+    return int(pd.util.hash_pandas_object(filas, index=False).to_numpy().sum(dtype="uint64"))
+
+
+def _sumar_checksum(checksum_hex, df) -> str:
+    return f"{(int(checksum_hex, 16) + checksum_filas(df)) % (1 << 64):016x}"
+
+
+def _leer(directorio=None):
+    """Catálogo en disco, cacheado en el proceso mientras no cambie el fichero."""
+    ruta = ruta_catalogo(directorio)
+    try:
+        marca = ruta.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _CATALOGOS_LOCK:
+        cacheado = _catalogos.get(str(ruta))
+        if cacheado and cacheado[0] == marca:
+            return cacheado[1]
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            catalogo = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    with _CATALOGOS_LOCK:
+        _catalogos[str(ruta)] = (marca, catalogo)
+    return catalogo
+
+
+def _guardar(catalogo, directorio=None):
+    ruta = ruta_catalogo(directorio)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.parent / f".{CATALOGO}-{uuid.uuid4().hex[:6]}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(catalogo, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def actualizar_entradas(entradas, directorio=None):
+    """Escribe varias entradas {isin: entrada} releyendo el catálogo bajo lock."""
+    with _bloqueo(directorio):
+        catalogo = dict(_leer(directorio))
+        catalogo.update(entradas)
+        _guardar(catalogo, directorio)
+
+
+def _leer_nombres() -> dict:
+    """Caché de nombres por ISIN (CACHE_NOMBRE_PATH), leída una vez mientras no cambie el fichero."""
+    try:
+        marca = CACHE_NOMBRE_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _CATALOGOS_LOCK:
+        if _nombres.get("marca") == marca:
+            return _nombres["nombres"]
+    try:
+        with open(CACHE_NOMBRE_PATH, "r", encoding="utf-8") as f:
+            nombres = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    with _CATALOGOS_LOCK:
+        _nombres.update(marca=marca, nombres=nombres)
+    return nombres
+
+
+def metadatos_locales(isin) -> dict:
+    """
+    Nombre y divisa del ISIN según lo ya guardado en local (caché de nombres y caché
+    de NAVs), sin scrapear. Los que no se conozcan quedan en None.
+    """
+    metadatos = dict.fromkeys(CAMPOS_METADATOS)
+    metadatos["nombre"] = _leer_nombres().get(isin)
+    try:
+        entrada = cache_db.buscar_por_isin(FUENTE_CACHE_NAV, isin)
+    except Exception as e:
+        print(f"⚠️ No se pudo consultar la caché de NAVs para {isin}: {e}")
+        entrada = None
+    if entrada:
+        datos = entrada["data"]
+        metadatos["nombre"] = metadatos["nombre"] or datos.get("nombre")
+        if datos.get("divisa") not in (None, "", "ERROR", "—"):
+            metadatos["divisa"] = datos["divisa"]
+    return metadatos
+
+
+def _con_resumen(entrada) -> dict:
+    """Completa filas, desde y hasta a partir de los intervalos de la entrada."""
+    intervalos = entrada["intervalos"]
+    entrada["filas"] = sum(i["rows"] for i in intervalos)
+    entrada["desde"] = intervalos[0]["start"] if intervalos else None
+    entrada["hasta"] = intervalos[-1]["end"] if intervalos else None
+    return entrada
+
+
+def _completar_metadatos(isin, entrada, metadatos=None) -> dict:
+    """Aplica los metadatos recibidos y busca en local los que sigan sin conocerse."""
+    for campo, valor in (metadatos or {}).items():
+        if campo in CAMPOS_METADATOS and valor:
+            entrada[campo] = valor
+    if any(not entrada.get(campo) for campo in CAMPOS_METADATOS):
+        for campo, valor in metadatos_locales(isin).items():
+            entrada[campo] = entrada.get(campo) or valor
+    return entrada
+
+
+def _entrada_desde_almacen(isin, directorio=None, anterior=None):
+    df = nav_store.leer(isin, directorio=directorio)
+    entrada = {
+        "firma": nav_store.firma(isin, directorio),
+        "intervalos": calcular_intervalos(df["Date"]),
+        "checksum": f"{checksum_filas(df):016x}",
+        **{campo: (anterior or {}).get(campo) for campo in CAMPOS_METADATOS},
+    }
+    return _completar_metadatos(isin, _con_resumen(entrada))
+
+
+def entrada_tras_anadir(isin, df_nuevas, firma_anterior, anterior, metadatos=None, directorio=None):
+    """
+    Entrada del catálogo tras añadir al histórico las filas `df_nuevas`, partiendo de
+    la entrada `anterior`, o None si no cambia nada. No escribe el catálogo.
+    """
+    cambia_metadatos = any(
+        valor and (anterior or {}).get(campo) != valor
+        for campo, valor in (metadatos or {}).items() if campo in CAMPOS_METADATOS
+    )
+    if df_nuevas.empty and anterior is not None and not cambia_metadatos:
+        return None
+
+    if anterior is not None and firma_anterior is not None and anterior.get("firma") == firma_anterior:
+        entrada = dict(anterior)
+        if not df_nuevas.empty:
+            entrada["firma"] = nav_store.firma(isin, directorio)
+            entrada["intervalos"] = _fusionar_intervalos(anterior["intervalos"], calcular_intervalos(df_nuevas["Date"]))
+            entrada["checksum"] = _sumar_checksum(anterior["checksum"], df_nuevas)
+        return _completar_metadatos(isin, _con_resumen(entrada), metadatos)
+    return _completar_metadatos(isin, _entrada_desde_almacen(isin, directorio, anterior), metadatos)
+
+
+def registrar_filas(isin, df_nuevas, firma_anterior, metadatos=None, directorio=None, pendientes=None):
+    """
+    Actualiza el catálogo tras añadir al histórico las filas `df_nuevas` (fechas que no
+    estaban). Si la entrada correspondía al histórico previo (`firma_anterior`) solo se
+    fusionan las filas nuevas; si no, se recalcula desde el almacén.
+    `metadatos` (divisa, nombre) sustituye a los guardados cuando trae valores.
+    Con `pendientes` (dict) la entrada se acumula ahí en vez de escribirse: en una
+    importación masiva el llamador guarda todas al final con actualizar_entradas.
+    """
+    if pendientes is not None:
+        anterior = pendientes[isin] if isin in pendientes else _leer(directorio).get(isin)
+        entrada = entrada_tras_anadir(isin, df_nuevas, firma_anterior, anterior, metadatos, directorio)
+        if entrada is not None:
+            pendientes[isin] = entrada
+        return
+
+    with _bloqueo(directorio):
+        catalogo = dict(_leer(directorio))
+        entrada = entrada_tras_anadir(isin, df_nuevas, firma_anterior, catalogo.get(isin), metadatos, directorio)
+        if entrada is not None:
+            catalogo[isin] = entrada
+            _guardar(catalogo, directorio)
+
+
+def _vigente(entrada, firma) -> bool:
+    return entrada is not None and entrada.get("firma") == firma and "checksum" in entrada
+
+
+def entradas(isins=None, directorio=None) -> dict:
+    """
+    {isin: entrada} de los ISIN pedidos (por defecto, todos los del almacén) que tienen
+    histórico. Solo se comprueba la firma de cada uno (nombres de sus ficheros, sin
+    leerlos); las entradas que faltan o no coinciden se recalculan y se guardan en un
+    único paso.
+    """
+    if isins is None:
+        isins = nav_store.listar_isins(directorio)
+    catalogo = _leer(directorio)
+    resultado, recalculadas = {}, {}
+    for isin in isins:
+        firma = nav_store.firma(isin, directorio)
+        if firma is None:
+            continue
+        entrada = catalogo.get(isin)
+        if not _vigente(entrada, firma):
+            entrada = recalculadas[isin] = _entrada_desde_almacen(isin, directorio, entrada)
+        resultado[isin] = entrada
+    if recalculadas:
+        actualizar_entradas(recalculadas, directorio)
+    return resultado
+
+
+class IndiceCobertura:
+    """Intervalos de un ISIN ordenados por inicio, para consultar cobertura con bisect."""
+
+    def __init__(self, intervalos, margen_dias=7):
+        ordenados = sorted(intervalos, key=lambda i: i["start"])
+        self.inicios = [pd.Timestamp(i["start"]) for i in ordenados]
+        self.finales = [pd.Timestamp(i["end"]) for i in ordenados]
+        self.margen = pd.Timedelta(days=margen_dias)
+
+    def cubierta(self, fecha):
+        """
+        True si `fecha` cae en un intervalo o hasta `margen_dias` después de su final
+        (el último NAV sigue siendo válido unos días).
+        """
+        i = bisect.bisect_right(self.inicios, fecha) - 1
+        return i >= 0 and fecha <= self.finales[i] + self.margen
+
+    def sin_cobertura(self, fechas):
+        return [fecha for fecha in fechas if not self.cubierta(fecha)]
@@ -12,6 +12,12 @@ with open("config/settings.json", "r", encoding="utf-8") as f:
 
 CARTERAS_PATH = SETTINGS["carteras_path"]
 
+# Límites de peticiones por host e interruptor de fuentes caídas (ver control_trafico)
+HTTP_SETTINGS = SETTINGS.get("http", {})
+
+# Calendarios de publicación de NAV por domicilio del fondo (prefijo del ISIN)
+CALENDARIOS_NAV = SETTINGS.get("calendarios_nav", {})
+
 # --------------------------
 # Rutas base de datos locales
 # --------------------------
@@ -22,6 +28,7 @@ NAV_HISTORICO_DIR = DATA_DIR / "nav_historico"
 BENCHMARK_DIR = DATA_DIR / "benchmark"
 OUTPUT_DIR = DATA_DIR / "outputs"
 CACHE_DIR = DATA_DIR / "cache"
+LOCKS_DIR = CACHE_DIR / "locks"
 
 # Asegurar existencia de directorios
 TRANSACCIONES_DIR.mkdir(parents=True, exist_ok=True)
@@ -37,6 +44,26 @@ CACHE_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_NOMBRE_PATH = NAV_HISTORICO_DIR / "cache_nombre_activo.json"
 
 
+# --------------------------
+# CACHE UNIFICADA DE NAV (SQLite)
+# --------------------------
+CACHE_DB_PATH = DATA_DIR / "cache_nav.sqlite"
+
+# Ficheros JSON antiguos por fuente, solo se leen para la migración inicial
+CACHE_JSON_LEGACY = {
+    "morningstar": DATA_DIR / "cache_nav_morningstar.json",
+    "ft": DATA_DIR / "cache_nav_ft.json",
+    "investing": DATA_DIR / "cache_nav_investing.json",
+    "real": DATA_DIR / "cache_nav_real.json",
+}
+
+
+# --------------------------
+# FIXTURES HTTP (grabación/reproducción de los fetchers)
+# --------------------------
+HTTP_FIXTURES_DIR = Path("tests") / "fixtures" / "http"
+
+
 # Any module get the path for a given portfolio without knowing the structure. Remove hard-coded paths in the backend
 def get_transactions_path(portfolio_name: str):
     """
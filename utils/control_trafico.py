@@ -0,0 +1,176 @@
+import threading
+import time
+from datetime import datetime
+from utils.config import HTTP_SETTINGS
+
+# Control de tráfico hacia las webs de NAVs, por host:
+#   - limitador token-bucket: ritmo sostenido `peticiones_seg` con ráfagas de hasta `rafaga`
+#   - interruptor (circuit breaker): tras `fallos_para_abrir` fallos seguidos el host queda
+#     abierto `espera_abierto_seg`; después se deja pasar una única petición de prueba
+#     (semiabierto) que lo cierra si va bien o lo vuelve a abrir si falla.
+# Ambos son por proceso, actúan en toda petición de http_client (app, refrescos en segundo
+# plano y precalentado) y se pueden consultar con estado_limitadores / estado_interruptores.
+# Un host con peticiones_seg = 0 no se limita.
+
+LIMITE_POR_DEFECTO = {"peticiones_seg": 2.0, "rafaga": 5}
+INTERRUPTOR_POR_DEFECTO = {"fallos_para_abrir": 5, "espera_abierto_seg": 300}
+
+LIMITES_HOST = {**{"default": LIMITE_POR_DEFECTO}, **HTTP_SETTINGS.get("limites_host", {})}
+INTERRUPTOR = {**INTERRUPTOR_POR_DEFECTO, **HTTP_SETTINGS.get("interruptor", {})}
+
+CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    """El interruptor del host está abierto: la petición no se envía."""
+
+
+class LimitadorTokens:
+    def __init__(self, peticiones_seg, rafaga):
+        self.peticiones_seg = peticiones_seg
+        self.rafaga = max(1, int(rafaga))
+        self.tokens = float(self.rafaga)
+        self.ultimo = time.monotonic()
+        self.esperas = 0
+        self._lock = threading.Lock()
+
+    def _reponer(self, ahora):
+        self.tokens = min(self.rafaga, self.tokens + (ahora - self.ultimo) * self.peticiones_seg)
+        self.ultimo = ahora
+
+    def adquirir(self):
+        """Consume un token, esperando lo necesario si el cubo está vacío."""
+        if not self.peticiones_seg:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            self._reponer(ahora)
+            # El token se reserva ya (puede quedar en negativo) y la espera se hace fuera del lock
+            self.tokens -= 1
+            espera = -self.tokens / self.peticiones_seg if self.tokens < 0 else 0.0
+            if espera:
+                self.esperas += 1
+        if espera:
+            time.sleep(espera)
+
+    def estado(self):
+        with self._lock:
+            self._reponer(time.monotonic())
+            return {
+                "peticiones_seg": self.peticiones_seg,
+                "rafaga": self.rafaga,
+                "tokens": round(max(self.tokens, 0.0), 2),
+                "esperas": self.esperas,
+            }
+
+
+class Interruptor:
+    def __init__(self, fallos_para_abrir, espera_abierto_seg):
+        self.fallos_para_abrir = fallos_para_abrir
+        self.espera_abierto_seg = espera_abierto_seg
+        self.estado = CERRADO
+        self.fallos_seguidos = 0
+        self.abierto_desde = None
+        self.prueba_en_curso = False
+        self.ultimo_error = None
+        self._lock = threading.Lock()
+
+    def abierto(self):
+        """True si el host está abierto y aún no toca la petición de prueba."""
+        with self._lock:
+            return self.estado == ABIERTO and time.monotonic() - self.abierto_desde < self.espera_abierto_seg
+
+    def permitir(self):
+        """Autoriza una petición o lanza CircuitoAbierto. En semiabierto solo pasa una prueba."""
+        with self._lock:
+            if self.estado == ABIERTO:
+                if time.monotonic() - self.abierto_desde < self.espera_abierto_seg:
+                    raise CircuitoAbierto(f"circuito abierto ({self.ultimo_error})")
+                self.estado = SEMIABIERTO
+            if self.estado == SEMIABIERTO:
+                if self.prueba_en_curso:
+                    raise CircuitoAbierto("circuito semiabierto: prueba en curso")
+                self.prueba_en_curso = True
+
+    def registrar_exito(self):
+        with self._lock:
+            self.estado = CERRADO
+            self.fallos_seguidos = 0
+            self.abierto_desde = None
+            self.prueba_en_curso = False
+
+    def registrar_fallo(self, motivo):
+        with self._lock:
+            self.fallos_seguidos += 1
+            self.ultimo_error = motivo
+            if self.estado == SEMIABIERTO or self.fallos_seguidos >= self.fallos_para_abrir:
+                if self.estado != ABIERTO:
+                    print(f"🔌 Circuito abierto tras {self.fallos_seguidos} fallos seguidos: {motivo}")
+                self.estado = ABIERTO
+                self.abierto_desde = time.monotonic()
+            self.prueba_en_curso = False
+
+    def resumen(self):
+        with self._lock:
+            reabre = None
+            if self.estado == ABIERTO:
+                restante = self.espera_abierto_seg - (time.monotonic() - self.abierto_desde)
+                reabre = datetime.fromtimestamp(time.time() + max(restante, 0)).isoformat(timespec="seconds")
+            return {
+                "estado": self.estado,
+                "fallos_seguidos": self.fallos_seguidos,
+                "ultimo_error": self.ultimo_error,
+                "prueba_desde": reabre,
+            }
+
+
+_limitadores = {}
+_interruptores = {}
+_REGISTRO_LOCK = threading.Lock()
+
+
+def limitador(host):
+    with _REGISTRO_LOCK:
+        if host not in _limitadores:
+            config = {**LIMITES_HOST["default"], **LIMITES_HOST.get(host, {})}
+            _limitadores[host] = LimitadorTokens(config["peticiones_seg"], config["rafaga"])
+        return _limitadores[host]
+
+
+def interruptor(host):
+    with _REGISTRO_LOCK:
+        if host not in _interruptores:
+            _interruptores[host] = Interruptor(INTERRUPTOR["fallos_para_abrir"], INTERRUPTOR["espera_abierto_seg"])
+        return _interruptores[host]
+
+
+def configurar_limite(peticiones_seg, rafaga=None, host="default"):
+    """Cambia el límite de un host (o el de por defecto, que aplica a todos los que no tienen uno propio)."""
+    with _REGISTRO_LOCK:
+        config = dict(LIMITES_HOST.get(host, LIMITES_HOST["default"]))
+        config["peticiones_seg"] = peticiones_seg or 0
+        if rafaga is not None:
+            config["rafaga"] = rafaga
+        LIMITES_HOST[host] = config
+        # Se recrean con la nueva configuración en la siguiente petición
+        if host == "default":
+            _limitadores.clear()
+        else:
+            _limitadores.pop(host, None)
+
+
+def estado_limitadores():
+    """Configuración y tokens disponibles por host, más los límites configurados aún sin uso."""
+    with _REGISTRO_LOCK:
+        activos = dict(_limitadores)
+        configurados = dict(LIMITES_HOST)
+    estado = {host: lim.estado() for host, lim in activos.items()}
+    for host, config in configurados.items():
+        estado.setdefault(host, {**config, "tokens": None, "esperas": 0})
+    return estado
+
+
+def estado_interruptores():
+    with _REGISTRO_LOCK:
+        activos = dict(_interruptores)
+    return {host: interruptor.resumen() for host, interruptor in activos.items()}
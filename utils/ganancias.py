@@ -2,7 +2,7 @@ import os
 import pandas as pd
 import streamlit as st
 import numpy as np
-from utils.nav_fetcher import get_nav_real as get_nav
+from utils.nav_fetcher import get_nav_real_many
 from utils.config import get_ganancias_cache_path
 from utils.fifo import process_fifo_for_isin, apply_fifo_to_dataframe
 from utils.config import get_transactions_path, get_ganancias_cache_path
@@ -126,12 +126,14 @@ def calcular_ganancias_perdidas(df):
     nombre_map = df.groupby("ISIN")["Posición"].agg(lambda x: x.mode().iloc[0] if not x.mode().empty else x.iloc[-1]).reset_index()
     resumen = pd.merge(resumen, nombre_map, on="ISIN", how="left").rename(columns={"Posición": "Nombre del activo"})
 
-    def obtener_nav(row):
+    def consulta_nav(row):
         isin = row.get("ISIN", "").strip().replace("\u200b", "").replace("\u00a0", "") if isinstance(row.get("ISIN"), str) else ""
         nombre = row.get("Nombre del activo")
-        return get_nav(isin) or get_nav(nombre) or {}
+        return (isin, nombre)
 
-    nav_data = resumen.apply(obtener_nav, axis=1)
+    # Una sola lectura y escritura de caché para todas las filas
+    consultas = [consulta_nav(row) for _, row in resumen.iterrows()]
+    nav_data = pd.Series([datos or {} for datos in get_nav_real_many(consultas)], index=resumen.index)
     resumen["NAV actual"] = nav_data.apply(lambda x: x.get("nav"))
     resumen["ISIN"] = nav_data.apply(lambda x: x.get("isin", "—"))
 
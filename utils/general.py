@@ -1,7 +1,8 @@
 import os
 import pandas as pd
 import streamlit as st
-from utils.nav_fetcher import get_nav_real as get_nav
+from utils.nav_fetcher import get_nav_real_many
+from utils import cache_db, control_trafico
 from datetime import datetime
 
 TRANSACCIONES_DIR = "data/transacciones"
@@ -15,7 +16,12 @@ def cargar_transacciones(cartera):
 
 from datetime import datetime
 
-def calcular_estado_actual(df):
+def calcular_estado_actual(df, en_refresco=None):
+    """
+    Calcula la posición actual por activo con el último NAV cacheado.
+    `en_refresco` es el conjunto de ISIN cuyo NAV se está actualizando en segundo
+    plano; esas filas se marcan en la columna "Estado NAV".
+    """
     from utils.nav_fetcher import limpiar_isin, validar_isin_vs_nombre
     df = limpiar_isin(df)
     validar_isin_vs_nombre(df)
@@ -30,7 +36,7 @@ def calcular_estado_actual(df):
     if df.empty:
         return pd.DataFrame(columns=[
             "Nombre del activo", "ID", "Último NAV (EUR)", "Divisa", "1 d%",
-            "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity"
+            "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity", "Estado NAV"
         ])
 
     df["Importe"] = df["Participaciones"] * df["Precio"]
@@ -74,25 +80,31 @@ def calcular_estado_actual(df):
 
     print(f"📊 df_agrupado:\n{df_agrupado}")
 
+    # Resolver todos los NAVs de una vez: ISIN primero y, si falla, el nombre
+    consultas = []
     for _, row in df_agrupado.iterrows():
         isin = row.get("ISIN")
         nombre = row.get("Posición")
-        identificador = isin if isinstance(isin, str) and isin.strip() and isin != "—" else nombre
-
-        print(f"🔍 Buscando NAV para: {identificador}")
 
         if isinstance(isin, str):
             isin = isin.strip().replace("\u200b", "").replace("\u00a0", "")
         else:
             isin = ""
 
-        datos_nav = {}
         if isin and isin != "—":
-            datos_nav = get_nav(isin) or get_nav(nombre) or {}
+            consultas.append((isin, nombre))
         else:
-            datos_nav = get_nav(nombre) or {}
+            consultas.append((nombre,))
+
+    navs = get_nav_real_many(consultas)
+
+    for (_, row), datos_nav in zip(df_agrupado.iterrows(), navs):
+        isin = row.get("ISIN")
+        nombre = row.get("Posición")
+        identificador = isin if isinstance(isin, str) and isin.strip() and isin != "—" else nombre
 
-        print(f"📦 Resultado: {datos_nav}")
+        datos_nav = datos_nav or {}
+        print(f"📦 Resultado para {identificador}: {datos_nav}")
 
         nav_actual = datos_nav.get("nav", None)
         if nav_actual is None:
@@ -115,7 +127,7 @@ def calcular_estado_actual(df):
     if not resultados:
         return pd.DataFrame(columns=[
             "Nombre del activo", "ID", "Último NAV (EUR)", "Divisa", "1 d%",
-            "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity"
+            "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity", "Estado NAV"
         ])
 
     df_resultado = pd.DataFrame(resultados)
@@ -167,12 +179,18 @@ def calcular_estado_actual(df):
 
     df_resultado["NAV Validity"] = df_resultado.apply(calcular_validez, axis=1)
 
+    # Marcar las filas cuyo NAV se está refrescando todavía en segundo plano
+    en_refresco = en_refresco or set()
+    df_resultado["Estado NAV"] = df_resultado["ID"].apply(
+        lambda isin: "🔄 Actualizando" if isin in en_refresco else ""
+    )
+
     # Quitar columna fuente_nav (si no quieres mostrarla más)
     df_resultado = df_resultado.drop(columns=["fuente_nav"])
 
     columnas_finales = [
         "Nombre del activo", "ID", "Último NAV (EUR)", "Divisa", "1 d%",
-        "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity"
+        "#Participaciones", "Valor (EUR)", "Peso %", "Fecha", "NAV Validity", "Estado NAV"
     ]
 
     return df_resultado[columnas_finales].reset_index(drop=True)
@@ -200,3 +218,63 @@ def mostrar_estado_general(cartera):
     }, errors="ignore")
 
     st.dataframe(df_general, use_container_width=True)
+
+
+def mostrar_cache_negativa():
+    """
+    Lista los identificadores que alguna fuente no pudo resolver y que se están
+    saltando hasta su próximo reintento. Permite borrarlos para forzar un nuevo intento.
+    """
+    fallos = cache_db.listar_fallos()
+    with st.expander(f"🚫 Identificadores sin NAV en espera de reintento ({len(fallos)})"):
+        if not fallos:
+            st.info("No hay identificadores en la caché negativa.")
+            return
+
+        df_fallos = pd.DataFrame(fallos).rename(columns={
+            "fuente": "Fuente",
+            "identificador": "Identificador",
+            "motivo": "Motivo",
+            "intentos": "Intentos",
+            "ultimo_fallo": "Último fallo",
+            "proximo_reintento": "Próximo reintento",
+        })
+        st.dataframe(df_fallos, use_container_width=True)
+
+        opciones = [f"{f['fuente']} · {f['identificador']}" for f in fallos]
+        seleccion = st.selectbox("Entrada a borrar", opciones, key="cache_negativa_seleccion")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("🗑️ Borrar entrada seleccionada"):
+                fallo = fallos[opciones.index(seleccion)]
+                cache_db.borrar_fallo(fallo["fuente"], fallo["identificador"])
+                st.rerun()
+        with col2:
+            if st.button("🗑️ Borrar todas"):
+                for fallo in fallos:
+                    cache_db.borrar_fallo(fallo["fuente"], fallo["identificador"])
+                st.rerun()
+
+def mostrar_estado_fuentes():
+    """Estado de los interruptores (circuit breakers) y limitadores de peticiones por host."""
+    interruptores = control_trafico.estado_interruptores()
+    abiertos = sum(1 for estado in interruptores.values() if estado["estado"] != control_trafico.CERRADO)
+    with st.expander(f"🔌 Estado de las fuentes de NAV ({abiertos} con el circuito abierto)"):
+        if interruptores:
+            df_interruptores = pd.DataFrame.from_dict(interruptores, orient="index").rename(columns={
+                "estado": "Estado",
+                "fallos_seguidos": "Fallos seguidos",
+                "ultimo_error": "Último error",
+                "prueba_desde": "Prueba a partir de",
+            })
+            st.dataframe(df_interruptores, use_container_width=True)
+        else:
+            st.info("Aún no se ha hecho ninguna petición en este proceso.")
+
+        df_limites = pd.DataFrame.from_dict(control_trafico.estado_limitadores(), orient="index").rename(columns={
+            "peticiones_seg": "Peticiones/s",
+            "rafaga": "Ráfaga",
+            "tokens": "Tokens disponibles",
+            "esperas": "Esperas",
+        })
+        st.dataframe(df_limites, use_container_width=True)
@@ -1,10 +1,27 @@
+import csv
+import io
 import json
+import multiprocessing
 import os
+import posixpath
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import streamlit as st
 from utils.investing_fetcher import buscar_nav_investing
 from utils.config import NAV_HISTORICO_DIR, TRANSACCIONES_DIR, CACHE_NOMBRE_PATH
+from utils.bloqueos import bloqueo_exclusivo
+from utils import catalogo_nav, http_client, nav_store
 
 # # Ruta del directorio compartido de históricos
 # NAV_HISTORICO_DIR = Path("data/nav_historico")
@@ -13,172 +30,510 @@ from utils.config import NAV_HISTORICO_DIR, TRANSACCIONES_DIR, CACHE_NOMBRE_PATH
 # TRANSACCIONES_DIR = Path("data/transacciones")
 # TRANSACCIONES_DIR.mkdir(parents=True, exist_ok=True)
 
-def normalize_number_str(s: str) -> str:
+COLUMNAS_HISTORICO = nav_store.COLUMNAS
+
+# Valores por columna con los que se decide la convención numérica y el formato de fecha
+MUESTRA_DETECCION = 2000
+
+
+def detectar_separadores_numericos(valores: pd.Series) -> tuple:
     """
-    Normaliza un string numérico con formato de miles/decimal.
-    
-    - Si tiene punto como separador decimal (US): elimina comas.
-    - Si tiene coma como separador decimal (EU): elimina puntos y convierte coma en punto.
-    """
-    if s is None:
-        return s
-    s = str(s).strip().replace('"', '').replace("'", '')
-    if not s:
-        return s
-
-    last_dot = s.rfind('.')
-    last_comma = s.rfind(',')
-
-    if last_dot > last_comma:
-        return s.replace(',', '')
-    elif last_comma > last_dot:
-        return s.replace('.', '').replace(',', '.')
-    else:
-        return s
+    Decide una sola vez para toda una columna de texto cuál es el separador decimal
+    y cuál el de miles. Devuelve (decimal, miles), con miles None si no se usa.
+    - Si algún valor usa ambos, el que aparece último es el decimal ("1.234,56")
+    - Si uno se repite dentro de un valor, es el de miles ("1.234.567")
+    - Si no, la coma es decimal (formato europeo "232,179") y el punto, si aparece, de miles
+    """
+    muestra = valores.dropna()
+    muestra = muestra[muestra != ""].head(MUESTRA_DETECCION)
+    con_punto = muestra.str.contains(".", regex=False)
+    con_coma = muestra.str.contains(",", regex=False)
+
+    ambos = muestra[con_punto & con_coma]
+    if not ambos.empty:
+        coma_ultima = (ambos.str.rfind(",") > ambos.str.rfind(".")).mean() >= 0.5
+        return (",", ".") if coma_ultima else (".", ",")
+    if con_coma.any():
+        if (muestra.str.count(",") > 1).any():
+            return (".", ",")
+        return (",", ".") if con_punto.any() else (",", None)
+    if con_punto.any() and (muestra.str.count(r"\.") > 1).any():
+        return (",", ".")
+    return (".", None)
+
+
+def interpretar_por_valor(textos: pd.Series, decimal_columna: str) -> pd.Series:
+    """
+    Convierte a float valores que no encajan en la convención de su columna, cada uno
+    con la suya: si usa los dos separadores el decimal es el que aparece último
+    ("1,234.56"); si solo usa uno, es decimal si aparece una vez y coincide con el
+    decimal de la columna, y de miles en otro caso. Lo que no es un número queda NaN.
+    """
+    ultima_coma = textos.str.rfind(",")
+    ultimo_punto = textos.str.rfind(".")
+    solo_coma = (ultima_coma >= 0) & (ultimo_punto < 0)
+    solo_punto = (ultimo_punto >= 0) & (ultima_coma < 0)
+    decimal_coma = np.where(
+        (ultima_coma >= 0) & (ultimo_punto >= 0),
+        ultima_coma > ultimo_punto,
+        np.where(
+            solo_coma,
+            (textos.str.count(",") == 1) & (decimal_columna == ","),
+            solo_punto & ~((textos.str.count(r"\.") == 1) & (decimal_columna == ".")),
+        ),
+    )
+    como_coma = textos.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    como_punto = textos.str.replace(",", "", regex=False)
+    return pd.to_numeric(pd.Series(np.where(decimal_coma, como_coma, como_punto), index=textos.index), errors="coerce")
 
 
-def leer_csv_investing(file) -> pd.DataFrame:
+def convertir_columna_numerica(valores: pa.Array, separadores: tuple = None) -> tuple:
     """
-    Lee un archivo CSV descargado desde Investing.com.
-    - Mantiene las columnas estándar (Date, Price, Open, High, Low, Change %)
-    - Convierte Date a formato YYYY-MM-DD
-    - Convierte precios a float
+    Convierte una columna de texto (Arrow) a float64 con operaciones sobre la columna
+    entera. Los valores que no son números quedan nulos.
+    `separadores` (decimal, miles) se detectan con la muestra si no se indican. Los
+    valores con separadores que no encajan en esa convención (p. ej. "1,234.56" tras
+    miles de "912.40") se reinterpretan uno a uno con interpretar_por_valor.
+    Devuelve (array, separadores).
     """
-    
-    print("========== LEYENDO CSV ==========")
-    
+    textos = pc.replace_substring_regex(valores, r"[\"'%\s]", "")
+    decimal, miles = separadores or detectar_separadores_numericos(textos.slice(0, MUESTRA_DETECCION).to_pandas())
+    limpios = textos
+    if miles:
+        limpios = pc.replace_substring(limpios, miles, "")
+    if decimal != ".":
+        limpios = pc.replace_substring(limpios, decimal, ".")
+    validos = pc.match_substring_regex(limpios, r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+    if miles:
+        # Un separador de miles detrás del decimal ("1,234.56" en una columna "1.234,56") no encaja
+        validos = pc.and_(validos, pc.invert(pc.match_substring_regex(textos, f"{re.escape(decimal)}.*{re.escape(miles)}")))
+    numeros = pc.cast(pc.if_else(validos, limpios, pa.scalar(None, pa.string())), pa.float64())
+
+    fallidos = pc.fill_null(pc.and_(pc.invert(validos), pc.match_substring_regex(textos, r"[.,]")), False)
+    if pc.any(fallidos).as_py():
+        posiciones = np.flatnonzero(fallidos.to_numpy(zero_copy_only=False))
+        corregidos = numeros.to_numpy(zero_copy_only=False).copy()
+        corregidos[posiciones] = interpretar_por_valor(textos.take(posiciones).to_pandas(), decimal).to_numpy()
+        numeros = pa.array(corregidos, type=pa.float64(), from_pandas=True)
+    return numeros, (decimal, miles)
+
+
+FORMATOS_FECHA_INVESTING = ["%m/%d/%Y", "%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%b %d, %Y", "%d-%m-%Y"]
+
+
+def detectar_formato_fecha(valores: pd.Series) -> str:
+    """
+    Formato de FORMATOS_FECHA_INVESTING que interpreta más fechas de la muestra
+    (el de Investing.com en inglés, MM/DD/YYYY, tiene prioridad si hay empate).
+    """
+    muestra = valores.dropna().str.strip()
+    muestra = muestra[muestra != ""].head(MUESTRA_DETECCION)
+    aciertos = [pd.to_datetime(muestra, format=formato, errors="coerce").notna().sum() for formato in FORMATOS_FECHA_INVESTING]
+    if not muestra.empty and max(aciertos) > 0:
+        return FORMATOS_FECHA_INVESTING[aciertos.index(max(aciertos))]
+    raise ValueError(f"❌ Formato de fecha no reconocido. Ejemplos: {muestra.head(3).tolist()}")
+
+
+# Tamaño de los bloques que se leen del CSV (bytes)
+BLOQUE_LECTURA_BYTES = 4 << 20
+
+
+def _abrir_binario(file):
+    """Objeto binario legible desde el inicio a partir de una ruta, un fichero subido o texto."""
+    if isinstance(file, (str, Path)):
+        return open(file, "rb")
     try:
         file.seek(0)
     except Exception as e:
         print("❌ No se pudo hacer seek(0):", e)
-    
+    if isinstance(file, io.TextIOBase):
+        return io.BytesIO(file.read().encode("utf-8"))
+    return file
+
+
+def leer_csv_investing(file) -> pd.DataFrame:
+    """
+    Lee un archivo CSV descargado desde Investing.com.
+    - Mantiene las columnas estándar (Date, Price, Open, High, Low, Change %)
+    - Detecta una vez el separador de columnas (coma o punto y coma), el formato de fecha
+      y, por columna, la convención de miles/decimal de los precios
+    - Lee el fichero por bloques y convierte cada columna entera con pyarrow.compute
+    Devuelve Date como fecha y precios como float. El resumen de la ingesta queda
+    en df.attrs["resumen_ingesta"].
+    """
+    inicio = time.perf_counter()
+    origen = _abrir_binario(file)
+    cabecera = origen.readline().decode("utf-8-sig")
+    origen.seek(0)
+    separador = ";" if cabecera.count(";") > cabecera.count(",") else ","
+    nombres = next(csv.reader([cabecera], delimiter=separador))
+
+    expected_columns = ["Date", "Price", "Open", "High", "Low", "Change %"]
+    normalizados = {nombre: nombre.strip().lstrip("\ufeff") for nombre in nombres}
+    # Asegurar columnas esperadas
+    if not all(col in normalizados.values() for col in expected_columns):
+        raise ValueError(f"❌ El CSV no tiene las columnas esperadas. Encontradas: {list(normalizados.values())}")
+
+    bloques, separadores, formato_fecha = [], {}, None
+    filas_leidas = fechas_invalidas = 0
     try:
-        df = pd.read_csv(
-            file,
-            quotechar='"',
-            dtype=str,
-            keep_default_na=False,
-            encoding='utf-8'
+        lector = pa_csv.open_csv(
+            origen,
+            read_options=pa_csv.ReadOptions(block_size=BLOQUE_LECTURA_BYTES),
+            parse_options=pa_csv.ParseOptions(delimiter=separador, quote_char='"'),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={nombre: pa.string() for nombre in nombres},
+                strings_can_be_null=False,
+            ),
         )
-        print("✅ CSV leido con éxito")
-    except Exception as e:
-        print("❌ Error al leer CSV:", e)
-        raise
+        for lote in lector:
+            columnas_lote = dict(zip((normalizados[n] for n in lote.schema.names), lote.columns))
+            filas_leidas += lote.num_rows
+
+            # El formato de fecha se decide con el primer bloque
+            fechas_texto = pc.utf8_trim_whitespace(columnas_lote["Date"])
+            formato_fecha = formato_fecha or detectar_formato_fecha(fechas_texto.slice(0, MUESTRA_DETECCION).to_pandas())
+            fechas = pc.strptime(fechas_texto, format=formato_fecha, unit="s", error_is_null=True)
+            fechas_invalidas += fechas.null_count
+
+            convertidas = {"Date": fechas}
+            # La convención de miles/decimal de cada columna se fija con el primer bloque
+            for col in expected_columns[1:]:
+                convertidas[col], separadores[col] = convertir_columna_numerica(columnas_lote[col], separadores.get(col))
+            tabla = pa.table(convertidas)
+            bloques.append(tabla.filter(pc.is_valid(tabla["Date"])))
+    finally:
+        if isinstance(file, (str, Path)):
+            origen.close()
+
+    if bloques:
+        df = pa.concat_tables(bloques).to_pandas()
+    else:
+        df = pd.DataFrame(columns=expected_columns)
+    df = df.sort_values("Date", kind="stable").reset_index(drop=True)
+
+    resumen = {
+        "filas_leidas": filas_leidas,
+        "filas_validas": len(df),
+        "fechas_invalidas": fechas_invalidas,
+        "precios_invalidos": int(df["Price"].isna().sum()),
+        "separador_columnas": separador,
+        "formato_fecha": formato_fecha,
+        "convencion_numerica": {
+            col: f"decimal '{decimal}'" + (f", miles '{miles}'" if miles else "")
+            for col, (decimal, miles) in separadores.items()
+        },
+        "desde": df["Date"].min().strftime("%Y-%m-%d") if len(df) else None,
+        "hasta": df["Date"].max().strftime("%Y-%m-%d") if len(df) else None,
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+    df.attrs["resumen_ingesta"] = resumen
+    print(f"📥 CSV Investing leído: {json.dumps(resumen, ensure_ascii=False)}")
+    return df
+
+def cargar_historico_isin(isin: str, columnas=None, desde=None, hasta=None) -> pd.DataFrame:
+    """
+    Carga el histórico guardado para un ISIN desde el almacén Parquet (/data/nav_historico/{ISIN}/)
+    - Devuelve un DataFrame con el formato estándar (Date como fecha, precios como float)
+    - `columnas`, `desde` y `hasta` limitan lo que se lee del disco
+    - Si no existe, devuelve DataFrame vacío
+    """
+    return nav_store.leer(isin, columnas=columnas, desde=desde, hasta=hasta)
 
-    print("\n👉 Encabezados crudos:", list(df.columns))
-    print("\n👉 Primeras filas crudas:")
-    print(df.head(5))
 
-    # Asegurar columnas esperadas
-    expected_columns = ["Date", "Price", "Open", "High", "Low", "Change %"]
-    df.columns = [col.strip() for col in df.columns]
-    print("\n👉 Encabezados normalizados:", list(df.columns))
+def fusionar_incremental(df_nuevo: pd.DataFrame, isin: str, metadatos=None, pendientes=None) -> dict:
+    """
+    Incorpora al histórico las filas de `df_nuevo` sin reescribir lo existente.
+    Debe llamarse con el lock del ISIN (ver guardar_historico_isin).
+    - Solo se lee del almacén el rango de fechas que solapa con el bloque nuevo
+    - Las fechas nuevas se añaden como una parte más (escritura atómica)
+    - Fechas ya presentes con el mismo Price: se ignoran (duplicadas)
+    - Fechas ya presentes con otro Price: se conserva el guardado y se informan como conflicto
+    - El catálogo NAV se actualiza con las filas añadidas y los `metadatos` (divisa, nombre);
+      con `pendientes` la entrada se acumula para escribir el catálogo una vez por lote
+    Devuelve resumen con nº de filas nuevas, duplicadas, DataFrame de conflictos y
+    (primera, última) fecha añadida.
+    """
+    df_nuevo = nav_store.normalizar(df_nuevo).drop_duplicates(subset=["Date"]).sort_values("Date")
+    resumen = {
+        "isin": isin,
+        "nuevas": 0,
+        "duplicadas": 0,
+        "conflictos": pd.DataFrame(columns=["Date", "Price guardado", "Price nuevo"]),
+        "rango_nuevas": None,
+    }
+    if df_nuevo.empty:
+        return resumen
+
+    df_solape = nav_store.leer(isin, columnas=["Price"], desde=df_nuevo["Date"].min(), hasta=df_nuevo["Date"].max())
+    cruce = df_nuevo[["Date", "Price"]].merge(df_solape, on="Date", how="inner", suffixes=(" nuevo", " guardado"))
+    distintos = ~np.isclose(cruce["Price nuevo"], cruce["Price guardado"], rtol=1e-9, atol=1e-9, equal_nan=True)
+
+    df_nuevas = df_nuevo[~df_nuevo["Date"].isin(df_solape["Date"])]
+    firma_anterior = nav_store.firma(isin)
+    nav_store.anadir(isin, df_nuevas)
+    catalogo_nav.registrar_filas(isin, df_nuevas, firma_anterior, metadatos, pendientes=pendientes)
+
+    resumen["nuevas"] = len(df_nuevas)
+    resumen["duplicadas"] = int((~distintos).sum())
+    resumen["conflictos"] = cruce.loc[distintos, ["Date", "Price guardado", "Price nuevo"]].reset_index(drop=True)
+    if not df_nuevas.empty:
+        resumen["rango_nuevas"] = (df_nuevas["Date"].min().strftime("%Y-%m-%d"), df_nuevas["Date"].max().strftime("%Y-%m-%d"))
+    if not resumen["conflictos"].empty:
+        print(f"⚠️ Histórico {isin}: {len(resumen['conflictos'])} fechas con un Price distinto al guardado (se conserva el guardado)")
+    return resumen
+
+
+def guardar_historico_isin(df_nuevo: pd.DataFrame, isin: str, pendientes=None) -> dict:
+    """
+    Fusiona un DataFrame nuevo con el histórico existente (si lo hay) de forma incremental
+    - Solo se añaden las fechas que no estaban; el histórico existente no se reescribe
+    - Las fechas repetidas con valores distintos se devuelven como conflictos
+    - Guarda en el almacén Parquet /data/nav_historico/{ISIN}/
+    Devuelve el resumen de fusionar_incremental (`pendientes`: ver fusionar_incremental).
+    """
+    with bloqueo_exclusivo(nav_store.clave_bloqueo(isin)):
+        return fusionar_incremental(df_nuevo, isin, pendientes=pendientes)
 
-    if not all(col in df.columns for col in expected_columns):
-        raise ValueError(f"❌ El CSV no tiene las columnas esperadas. Encontradas: {list(df.columns)}")
 
-    # Procesar fechas
-    print("\n========== CONVIRTIENDO FECHAS ==========")
-    df["Date"] = pd.to_datetime(df["Date"], errors="coerce").dt.strftime("%Y-%m-%d")
-    print(df[["Date"]].head(5))
-    df = df.dropna(subset=["Date"])
-    print("✅ Fechas normalizadas y NaNs eliminados")
+def _fila_observacion(fecha, nav, variacion=None) -> dict:
+    # Formato de Investing.com para fondos: un único valor liquidativo diario
+    return {
+        "Date": fecha,
+        "Price": nav,
+        "Open": nav,
+        "High": nav,
+        "Low": nav,
+        "Change %": f"{variacion:.2f}%" if variacion is not None else None,
+    }
 
-    # Normalizar valores numéricos
-    for col in ["Price", "Open", "High", "Low"]:
-        print(f"\n========== NORMALIZANDO {col} ==========")
-        print("ANTES:")
-        print(df[col].head(5).to_list())
 
-        try:
-            df[col] = (
-                df[col]
-                .apply(normalize_number_str)
-                .astype(float)
+def registrar_observaciones_nav(observaciones) -> int:
+    """
+    Añade al histórico de cada ISIN los NAV validados obtenidos online.
+    - `observaciones`: iterable de dicts con isin, fecha (YYYY-MM-DD), nav y opcionalmente
+      variacion_1d, nombre y divisa (estos dos se guardan en el catálogo NAV)
+    - Idempotente: las fechas que ya están en el histórico no se vuelven a escribir
+    - Por lotes: una sola escritura por ISIN, como una parte nueva del almacén
+      (no se reescribe el histórico existente) y una del catálogo NAV para todos
+    Devuelve el número de filas añadidas.
+    """
+    por_isin = defaultdict(dict)
+    metadatos = defaultdict(dict)
+    for obs in observaciones:
+        isin, fecha, nav = obs.get("isin"), obs.get("fecha"), obs.get("nav")
+        if not isin or not fecha or nav is None:
+            continue
+        fecha = str(fecha)[:10]
+        por_isin[isin][fecha] = _fila_observacion(fecha, nav, obs.get("variacion_1d"))
+        metadatos[isin].update({campo: obs[campo] for campo in catalogo_nav.CAMPOS_METADATOS if obs.get(campo)})
+
+    añadidas = 0
+    pendientes = {}
+
+    for isin, filas in por_isin.items():
+        # Lock entre procesos/hilos: dos refrescos del mismo ISIN no duplican filas
+        with bloqueo_exclusivo(nav_store.clave_bloqueo(isin)):
+            resumen = fusionar_incremental(
+                pd.DataFrame(list(filas.values()), columns=COLUMNAS_HISTORICO), isin, metadatos[isin], pendientes
             )
-        except Exception as e:
-            print(f"❌ Error al convertir columna {col}:")
-            print(df[col].head(10).to_list())
-            raise
 
-        print("DESPUÉS:")
-        print(df[col].head(5).to_list())
+        if resumen["nuevas"]:
+            añadidas += resumen["nuevas"]
+            print(f"🗂️ Histórico {isin}: {resumen['nuevas']} NAV añadidos desde las consultas online")
 
-    print("\n========== NORMALIZANDO Change % ==========")
-    print("ANTES:")
-    print(df["Change %"].head(5).to_list())
+    if pendientes:
+        catalogo_nav.actualizar_entradas(pendientes)
+    return añadidas
 
-    try:
-        df["Change %"] = (
-            df["Change %"]
-            .str.replace("%", "")
-            .apply(normalize_number_str)
-            .astype(float)
-        )
-    except Exception as e:
-        print(f"❌ Error al convertir columna Change %:")
-        print(df["Change %"].head(10).to_list())
-        raise
 
-    print("DESPUÉS:")
-    print(df["Change %"].head(5).to_list())
+# Importación masiva: manifiestos reconocidos (columnas archivo/file e ISIN)
+MANIFIESTOS = ("manifiesto.csv", "manifest.csv")
+# ISIN dentro de un nombre de fichero: país, 9 alfanuméricos y el dígito de control
+PATRON_ISIN_ARCHIVO = re.compile(r"(?<![A-Z0-9])([A-Z]{2}[A-Z0-9]{9}[0-9])(?![A-Z0-9])")
+# Con menos ficheros no compensa arrancar el pool de procesos
+MIN_ARCHIVOS_EN_PARALELO = 4
+COLUMNAS_INFORME_LOTE = [
+    "Archivo", "ISIN", "Estado", "Filas leídas", "Filas válidas",
+    "Nuevas", "Duplicadas", "Conflictos", "Cobertura nueva", "Detalle",
+]
 
-    # Ordenar
-    df = df.sort_values("Date").reset_index(drop=True)
-    print("\n✅ DataFrame final ordenado por fecha:")
-    print(df.head(5))
 
-    print("\n✅✅✅ LECTURA Y NORMALIZACIÓN COMPLETADAS ✅✅✅")
-    return df
+def isin_desde_nombre(nombre: str):
+    """ISIN contenido en el nombre del fichero (p. ej. "LU0996182563 Historical Data.csv") o None."""
+    coincidencia = PATRON_ISIN_ARCHIVO.search(Path(nombre).stem.upper())
+    return coincidencia.group(1) if coincidencia else None
+
+
+def _ruta_relativa(*partes) -> str:
+    """Ruta dentro del lote en formato posix y normalizada ("sub/./a.csv" → "sub/a.csv")."""
+    return posixpath.normpath(posixpath.join(*(p.replace("\\", "/") for p in partes))).lstrip("/")
+
 
-def cargar_historico_isin(isin: str) -> pd.DataFrame:
+def _leer_manifiesto(contenido: bytes, carpeta: str = "") -> dict:
     """
-    Carga el histórico guardado para un ISIN desde /data/nav_historico/{ISIN}.csv
-    - Devuelve un DataFrame con el formato estándar
-    - Si no existe, devuelve DataFrame vacío
+    {ruta relativa en el lote: ISIN} a partir del manifiesto CSV de un lote. Las rutas
+    de la columna archivo son relativas a la carpeta del manifiesto, así que dos
+    ficheros con el mismo nombre en subcarpetas distintas no se confunden.
     """
-    path = NAV_HISTORICO_DIR / f"{isin}.csv"
+    df = pd.read_csv(io.BytesIO(contenido), sep=None, engine="python", dtype=str, encoding="utf-8-sig")
+    columnas = {str(col).strip().lower(): col for col in df.columns}
+    col_archivo = columnas.get("archivo") or columnas.get("file")
+    col_isin = columnas.get("isin")
+    if col_archivo is None or col_isin is None:
+        raise ValueError(f"❌ El manifiesto debe tener columnas archivo e ISIN. Encontradas: {list(df.columns)}")
+    df = df.dropna(subset=[col_archivo, col_isin])
+    return {_ruta_relativa(carpeta, a.strip()): i.strip().upper() for a, i in zip(df[col_archivo], df[col_isin])}
 
-    columnas_estandar = ["Date", "Price", "Open", "High", "Low", "Change %"]
 
-    if path.exists():
-        df = pd.read_csv(path)
-        df.columns = [col.strip() for col in df.columns]
-        return df[columnas_estandar]
-    else:
-        return pd.DataFrame(columns=columnas_estandar)
+def _archivos_lote(origen) -> tuple:
+    """
+    CSV de un lote: `origen` es un directorio local (se recorre con subcarpetas) o la
+    ruta de un zip. Devuelve ([(nombre, ruta, miembro)], manifiesto): `nombre` es la ruta
+    relativa dentro del lote y `miembro` el fichero dentro del zip (None en un directorio).
+    Los contenidos no se leen aquí: cada proceso del pool abre el suyo.
+    """
+    archivos, manifiesto = [], {}
+    if Path(origen).is_dir():
+        base = Path(origen)
+        for ruta in sorted(base.rglob("*.csv")):
+            if ruta.name.startswith("."):
+                continue
+            nombre = ruta.relative_to(base).as_posix()
+            if ruta.name.lower() in MANIFIESTOS:
+                manifiesto.update(_leer_manifiesto(ruta.read_bytes(), posixpath.dirname(nombre)))
+            else:
+                archivos.append((nombre, str(ruta), None))
+        return archivos, manifiesto
+
+    with zipfile.ZipFile(origen) as zf:
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            nombre = Path(info.filename)
+            if info.is_dir() or nombre.suffix.lower() != ".csv" or nombre.name.startswith(".") or "__MACOSX" in nombre.parts:
+                continue
+            if nombre.name.lower() in MANIFIESTOS:
+                manifiesto.update(_leer_manifiesto(zf.read(info), posixpath.dirname(_ruta_relativa(info.filename))))
+            else:
+                archivos.append((_ruta_relativa(info.filename), str(origen), info.filename))
+    return archivos, manifiesto
 
 
-def guardar_historico_isin(df_nuevo: pd.DataFrame, isin: str):
+def _leer_archivo_lote(tarea) -> tuple:
+    """Parsea un CSV del lote (se ejecuta en los procesos del pool). Devuelve (nombre, df, error)."""
+    nombre, ruta, miembro = tarea
+    try:
+        if miembro is None:
+            return nombre, leer_csv_investing(ruta), None
+        with zipfile.ZipFile(ruta) as zf, zf.open(miembro) as contenido:
+            return nombre, leer_csv_investing(contenido), None
+    except Exception as e:
+        return nombre, None, str(e)
+
+
+def _leer_archivos_lote(tareas, procesos):
+    """Resultados de _leer_archivo_lote a medida que terminan, en paralelo si hay ficheros suficientes."""
+    if procesos <= 1 or len(tareas) < MIN_ARCHIVOS_EN_PARALELO:
+        yield from map(_leer_archivo_lote, tareas)
+        return
+    # spawn y no fork: el proceso de Streamlit tiene hilos y locks que un fork copiaría a medias
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(procesos, len(tareas)), mp_context=contexto) as executor:
+        futuros = {executor.submit(_leer_archivo_lote, tarea): tarea[0] for tarea in tareas}
+        for futuro in as_completed(futuros):
+            try:
+                yield futuro.result()
+            except Exception as e:
+                # El proceso que lo parseaba ha muerto (memoria, señal...)
+                yield futuros[futuro], None, f"fallo del proceso de lectura: {e}"
+
+
+def _fila_informe_lote(nombre, isin, estado, df=None, resumen=None, detalle=""):
+    ingesta = df.attrs.get("resumen_ingesta", {}) if df is not None else {}
+    resumen = resumen or {}
+    return {
+        "Archivo": nombre,
+        "ISIN": isin,
+        "Estado": estado,
+        "Filas leídas": ingesta.get("filas_leidas"),
+        "Filas válidas": ingesta.get("filas_validas"),
+        "Nuevas": resumen.get("nuevas"),
+        "Duplicadas": resumen.get("duplicadas"),
+        "Conflictos": len(resumen["conflictos"]) if "conflictos" in resumen else None,
+        "Cobertura nueva": " → ".join(resumen["rango_nuevas"]) if resumen.get("rango_nuevas") else "",
+        "Detalle": detalle,
+    }
+
+
+def importar_lote_historicos(origen, procesos=None) -> pd.DataFrame:
     """
-    Fusiona un DataFrame nuevo con el histórico existente (si lo hay)
-    - Elimina fechas duplicadas
-    - Ordena por Date
-    - Guarda el resultado en /data/nav_historico/{ISIN}.csv
+    Importa de una vez un zip (ruta o fichero subido) o un directorio con exportaciones
+    CSV de Investing.com.
+    - ISIN de cada fichero: el del manifiesto (manifiesto.csv o manifest.csv, columnas
+      archivo e ISIN, con rutas relativas a su carpeta) o, si no aparece en él, el que
+      lleve el nombre del fichero
+    - Los CSV se parsean en un pool de procesos (por defecto uno por núcleo)
+    - Cada fichero se fusiona en este proceso con guardar_historico_isin, a medida
+      que llega, de forma incremental y con el lock de su ISIN; el catálogo NAV se
+      escribe una sola vez al final del lote
+    Devuelve el informe por fichero: estado, filas leídas/válidas/nuevas, conflictos
+    y cobertura añadida.
     """
-    path = NAV_HISTORICO_DIR / f"{isin}.csv"
-
-    # Cargar histórico existente
-    if path.exists():
-        df_existente = pd.read_csv(path)
-        df_existente.columns = [col.strip() for col in df_existente.columns]
-    else:
-        df_existente = pd.DataFrame(columns=df_nuevo.columns)
+    inicio = time.perf_counter()
+    temporal = None
+    if not isinstance(origen, (str, Path)):
+        # Fichero subido: los procesos del pool abren el zip por ruta, así que se vuelca a disco
+        with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as f:
+            origen.seek(0)
+            shutil.copyfileobj(origen, f)
+        origen = temporal = f.name
+    try:
+        return _importar_lote(origen, procesos, inicio)
+    finally:
+        if temporal:
+            os.unlink(temporal)
 
-    # Concatenar y limpiar duplicados por Date
-    df_todo = pd.concat([df_existente, df_nuevo], ignore_index=True)
-    df_todo = df_todo.drop_duplicates(subset=["Date"]).copy()
 
-    # Normalizar fechas y ordenar
-    df_todo["Date"] = pd.to_datetime(df_todo["Date"], errors="coerce").dt.strftime("%Y-%m-%d")
-    df_todo = df_todo.dropna(subset=["Date"])
-    df_todo = df_todo.sort_values("Date").reset_index(drop=True)
+def _importar_lote(origen, procesos, inicio) -> pd.DataFrame:
+    archivos, manifiesto = _archivos_lote(origen)
 
-    # Guardar en disco
-    df_todo.to_csv(path, index=False)
+    informe, tareas, isin_por_archivo = [], [], {}
+    for tarea in archivos:
+        nombre = tarea[0]
+        isin = manifiesto.get(nombre) or isin_desde_nombre(nombre)
+        if isin:
+            tareas.append(tarea)
+            isin_por_archivo[nombre] = isin
+        else:
+            informe.append(_fila_informe_lote(nombre, None, "⚠️ Sin ISIN", detalle="no está en el manifiesto ni en el nombre"))
 
-    # 🔥 Actualizar cache de nombre
-    get_nombre_activo_por_isin(isin)
+    # Las entradas del catálogo se acumulan y se escriben una sola vez al final del lote
+    pendientes = {}
+    try:
+        for nombre, df, error in _leer_archivos_lote(tareas, procesos or os.cpu_count() or 1):
+            isin = isin_por_archivo[nombre]
+            if error:
+                informe.append(_fila_informe_lote(nombre, isin, "❌ Error", detalle=error))
+                continue
+            try:
+                resumen = guardar_historico_isin(df, isin, pendientes)
+            except Exception as e:
+                informe.append(_fila_informe_lote(nombre, isin, "❌ Error", df, detalle=f"al guardar: {e}"))
+                continue
+            estado = "✅ Importado" if resumen["nuevas"] else "➖ Sin fechas nuevas"
+            detalle = "se conserva el precio guardado en los conflictos" if not resumen["conflictos"].empty else ""
+            informe.append(_fila_informe_lote(nombre, isin, estado, df, resumen, detalle))
+    finally:
+        if pendientes:
+            catalogo_nav.actualizar_entradas(pendientes)
+
+    df_informe = pd.DataFrame(informe, columns=COLUMNAS_INFORME_LOTE).sort_values("Archivo").reset_index(drop=True)
+    print(
+        f"📦 Importación masiva: {len(archivos)} ficheros, "
+        f"{int((df_informe['Estado'] == '✅ Importado').sum())} con fechas nuevas, "
+        f"{int(df_informe['Estado'].isin(['❌ Error', '⚠️ Sin ISIN']).sum())} con error "
+        f"({time.perf_counter() - inicio:.1f}s)"
+    )
+    return df_informe
 
 def detectar_intervalos_continuos(df: pd.DataFrame) -> list:
     """
@@ -190,82 +545,33 @@ def detectar_intervalos_continuos(df: pd.DataFrame) -> list:
     if df.empty or "Date" not in df.columns:
         return []
 
-    df = df.copy()
-    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-    df = df.dropna(subset=["Date"]).sort_values("Date").reset_index(drop=True)
-
-    if df.empty:
-        return []
-
-    intervalos = []
-    start = df.loc[0, "Date"]
-    prev = start
-    count = 1
-
-    for i in range(1, len(df)):
-        actual = df.loc[i, "Date"]
-        diff = (actual - prev).days
-
-        if diff > 1:
-            intervalos.append({
-                "start": start.strftime("%Y-%m-%d"),
-                "end": prev.strftime("%Y-%m-%d"),
-                "rows": count
-            })
-            start = actual
-            count = 1
-        else:
-            count += 1
-
-        prev = actual
-
-    # Añadir último intervalo
-    intervalos.append({
-        "start": start.strftime("%Y-%m-%d"),
-        "end": prev.strftime("%Y-%m-%d"),
-        "rows": count
-    })
-
-    return intervalos
+    return catalogo_nav.calcular_intervalos(df["Date"])
 
 def listar_isins_disponibles() -> list:
     """
     Escanea /data/nav_historico/
-    - Devuelve lista de ISINs disponibles (basado en nombres de archivo .csv)
+    - Devuelve lista de ISINs disponibles en el almacén (los .csv sueltos se migran al arrancar la app)
     """
-    if not NAV_HISTORICO_DIR.exists():
-        return []
-
-    isins = []
-    for file in NAV_HISTORICO_DIR.glob("*.csv"):
-        isin = file.stem.strip()
-        if isin:
-            isins.append(isin)
-
-    return sorted(isins)
+    return nav_store.listar_isins()
 
 def resumen_historicos_cargados():
     """
-    Devuelve DataFrame con resumen de ISINs cargados:
-    ISIN, nº intervalos, fecha inicio más antigua, fecha fin más reciente
+    Devuelve DataFrame con resumen de ISINs cargados, leído solo del catálogo NAV
+    (sin abrir los históricos ni scrapear nombres):
+    nombre, ISIN, divisa, nº filas, nº intervalos, fecha inicio más antigua, fecha fin más reciente
     """
     resumen = []
 
-    isins = listar_isins_disponibles()
-    for isin in isins:
-        df = cargar_historico_isin(isin)
-        intervalos = detectar_intervalos_continuos(df)
-        if intervalos:
-            fechas_inicio = [i["start"] for i in intervalos]
-            fechas_fin = [i["end"] for i in intervalos]
-            nombre_activo = get_nombre_activo_por_isin(isin)
-
+    for isin, entrada in sorted(catalogo_nav.entradas().items()):
+        if entrada["intervalos"]:
             resumen.append({
-                "Nombre de activo": nombre_activo,
+                "Nombre de activo": entrada.get("nombre") or "(nombre desconocido)",
                 "ISIN": isin,
-                "Nº intervalos": len(intervalos),
-                "Inicio más antiguo": min(fechas_inicio),
-                "Fin más reciente": max(fechas_fin)
+                "Divisa": entrada.get("divisa") or "—",
+                "Nº filas": entrada["filas"],
+                "Nº intervalos": len(entrada["intervalos"]),
+                "Inicio más antiguo": entrada["desde"],
+                "Fin más reciente": entrada["hasta"]
             })
 
     return pd.DataFrame(resumen)
@@ -285,8 +591,12 @@ def get_nombre_activo_por_isin(isin: str) -> str:
     if isin in cache:
         return cache[isin]
 
-    # Si no está en cache, scrappear
-    datos = buscar_nav_investing(isin)
+    # Si no está en cache, scrappear. Sin red no se guarda nada: se reintentará la próxima vez
+    try:
+        datos = buscar_nav_investing(isin)
+    except http_client.ERRORES_PETICION as e:
+        print(f"⚠️ No se pudo consultar el nombre de {isin}: {e}")
+        return "(nombre desconocido)"
     if datos and "nombre" in datos:
         nombre = datos["nombre"]
     else:
@@ -304,28 +614,23 @@ def detectar_faltantes_nav_por_cartera(transacciones_dir, nav_historico_dir):
     """
     Cruza las fechas de las transacciones de todas las carteras
     con los intervalos NAV disponibles.
+    - Los intervalos salen del catálogo de históricos (sin leer los NAV salvo si cambiaron),
+      una sola vez por ISIN aunque aparezca en varias carteras
+    - Cada fecha se comprueba con bisect sobre los intervalos ordenados
     
     Devuelve DataFrame con:
     Cartera | ISIN | Nombre de activo | Fechas de transacción sin NAV | Intervalos NAV disponibles
     """
-    import pandas as pd
-
-    resultados = []
-
-    # Obtener todos los CSV de transacciones (cada uno es una cartera)
-    archivos_carteras = list(transacciones_dir.glob("*.csv"))
-
-    if not archivos_carteras:
-        return pd.DataFrame(columns=[
-            "Cartera", "ISIN", "Nombre de activo",
-            "Fechas transacción sin NAV", "Intervalos NAV disponibles"
-        ])
-
-    for archivo in archivos_carteras:
-        nombre_cartera = archivo.stem
-
+    columnas = [
+        "Cartera", "ISIN", "Nombre de activo",
+        "Fechas transacción sin NAV", "Intervalos NAV disponibles"
+    ]
+
+    # Fechas de transacción por (cartera, ISIN), leyendo de cada cartera solo ISIN y Fecha
+    fechas_por_cartera = {}
+    for archivo in sorted(transacciones_dir.glob("*.csv")):
         try:
-            df_trans = pd.read_csv(archivo)
+            df_trans = pd.read_csv(archivo, usecols=lambda col: col in ("ISIN", "Fecha"))
         except Exception as e:
             print(f"Error leyendo {archivo}: {e}")
             continue
@@ -334,67 +639,37 @@ def detectar_faltantes_nav_por_cartera(transacciones_dir, nav_historico_dir):
         if "ISIN" not in df_trans.columns or "Fecha" not in df_trans.columns:
             continue
 
-        # Limpieza mínima
         df_trans["Fecha"] = pd.to_datetime(df_trans["Fecha"], errors='coerce')
         df_trans = df_trans.dropna(subset=["ISIN", "Fecha"])
+        for isin, fechas in df_trans.groupby("ISIN")["Fecha"]:
+            fechas_por_cartera[(archivo.stem, isin)] = sorted(fechas.unique())
 
-        # Agrupar transacciones por ISIN
-        isins_en_cartera = df_trans["ISIN"].unique()
+    if not fechas_por_cartera:
+        return pd.DataFrame(columns=columnas)
 
-        for isin in isins_en_cartera:
-            fechas_tx = df_trans[df_trans["ISIN"] == isin]["Fecha"].sort_values().unique()
+    isins = sorted({isin for _, isin in fechas_por_cartera})
+    try:
+        catalogo = catalogo_nav.entradas(isins, directorio=nav_historico_dir)
+    except Exception as e:
+        print(f"Error leyendo el catálogo NAV: {e}")
+        catalogo = {}
+    intervalos = {isin: entrada["intervalos"] for isin, entrada in catalogo.items()}
+    indices = {isin: catalogo_nav.IndiceCobertura(intervalos.get(isin, [])) for isin in isins}
 
-            # Obtener intervalos NAV
-            nav_file = nav_historico_dir / f"{isin}.csv"
-            if not nav_file.exists():
-                intervalos = []
-            else:
-                try:
-                    df_nav = pd.read_csv(nav_file)
-                    intervalos = detectar_intervalos_continuos(df_nav)
-                except Exception as e:
-                    print(f"Error leyendo NAV para {isin}: {e}")
-                    intervalos = []
-
-            # Convertir intervalos a rango de fechas
-            intervalos_disponibles = [
-                (pd.to_datetime(i["start"]), pd.to_datetime(i["end"]))
-                for i in intervalos
-            ]
-
-            # Verificar cobertura de fechas
-            fechas_faltantes = []
-            for fecha in fechas_tx:
-                covered = False
-                for start, end in intervalos_disponibles:
-                    if start <= fecha <= end:
-                        covered = True
-                        break
-                    elif fecha > end and (fecha - end).days <= 7:
-                        covered = True
-                        break
-                if not covered:
-                    fechas_faltantes.append(fecha.strftime("%Y-%m-%d"))
-
-            if fechas_faltantes:
-                # Obtener nombre de activo (desde caché o scrapping)
-                nombre_activo = get_nombre_activo_por_isin(isin)
-
-                resultados.append({
-                    "Cartera": nombre_cartera,
-                    "ISIN": isin,
-                    "Nombre de activo": nombre_activo,
-                    "Fechas transacción sin NAV": ", ".join(fechas_faltantes),
-                    "Intervalos NAV disponibles": str(intervalos)
-                })
-
-    if resultados:
-        return pd.DataFrame(resultados)
-    else:
-        return pd.DataFrame(columns=[
-            "Cartera", "ISIN", "Nombre de activo",
-            "Fechas transacción sin NAV", "Intervalos NAV disponibles"
-        ])
+    resultados = []
+    for (nombre_cartera, isin), fechas_tx in fechas_por_cartera.items():
+        fechas_faltantes = indices[isin].sin_cobertura(fechas_tx)
+        if fechas_faltantes:
+            resultados.append({
+                "Cartera": nombre_cartera,
+                "ISIN": isin,
+                # Nombre del catálogo; sin histórico, desde caché o scrapping
+                "Nombre de activo": catalogo.get(isin, {}).get("nombre") or get_nombre_activo_por_isin(isin),
+                "Fechas transacción sin NAV": ", ".join(f.strftime("%Y-%m-%d") for f in fechas_faltantes),
+                "Intervalos NAV disponibles": str(intervalos.get(isin, []))
+            })
+
+    return pd.DataFrame(resultados, columns=columnas)
 
 #Funcion para el Frontend
 def mostrar_gestor_historicos_nav():
@@ -406,6 +681,7 @@ def mostrar_gestor_historicos_nav():
     - Vista previa del CSV cargado
     - Tabla de intervalos ya cargados
     - Botón para guardar
+    - Importación masiva desde un zip o un directorio
     """
     st.header("📥 Gestor de Históricos NAV")
     st.markdown("""
@@ -471,7 +747,7 @@ def mostrar_gestor_historicos_nav():
         **Date**, **Price**, **Open**, **High**, **Low**, **Change %**.
         - Para Investing.com en español o local europeo, asegúrate de exportar la web en INGLÉS.
         - Usar coma (`,`) como decimal (por ejemplo `232,179`) se convierte automáticamente.
-        - El separador de columnas debe ser punto y coma (`;`).
+        - El separador de columnas puede ser coma (`,`) o punto y coma (`;`).
         """
     )
     
@@ -480,26 +756,88 @@ def mostrar_gestor_historicos_nav():
     if archivo and isin_final:
         try:
             df_subido = leer_csv_investing(archivo)
+            resumen_ingesta = df_subido.attrs["resumen_ingesta"]
             st.subheader("👁️ Vista previa del CSV cargado")
+            st.caption(
+                f"{resumen_ingesta['filas_validas']} filas válidas de {resumen_ingesta['filas_leidas']} "
+                f"({resumen_ingesta['desde']} → {resumen_ingesta['hasta']}) · fechas {resumen_ingesta['formato_fecha']} · "
+                f"precios con {resumen_ingesta['convencion_numerica'].get('Price')}"
+            )
+            if resumen_ingesta["fechas_invalidas"] or resumen_ingesta["precios_invalidos"]:
+                st.warning(
+                    f"⚠️ {resumen_ingesta['fechas_invalidas']} filas con fecha no válida (descartadas) y "
+                    f"{resumen_ingesta['precios_invalidos']} sin precio válido."
+                )
             st.dataframe(df_subido)
         except Exception as e:
             st.error(f"❌ Error al procesar el CSV: {e}")
 
     # 4️⃣ Ver intervalos ya cargados
     if isin_final:
-        df_actual = cargar_historico_isin(isin_final)
-        if not df_actual.empty:
+        entrada = catalogo_nav.entradas([isin_final]).get(isin_final)
+        if entrada:
             st.subheader(f"📊 Intervalos ya cargados para {isin_final}")
-            intervalos = detectar_intervalos_continuos(df_actual)
-            st.table(intervalos)
+            st.table(entrada["intervalos"])
+            st.download_button(
+                "⬇️ Exportar histórico a CSV",
+                data=nav_store.exportar_csv(isin_final),
+                file_name=f"{isin_final}.csv",
+                mime="text/csv",
+            )
         else:
             st.info("ℹ️ No hay datos aún para este ISIN.")
 
     # 5️⃣ Botón para guardar
+    resumen = st.session_state.pop("resumen_guardado_nav", None)
+    if resumen:
+        st.success(
+            f"✅ Histórico actualizado para ISIN: {resumen['isin']} "
+            f"({resumen['nuevas']} filas nuevas, {resumen['duplicadas']} ya existentes)"
+        )
+        if not resumen["conflictos"].empty:
+            st.warning(
+                f"⚠️ {len(resumen['conflictos'])} fechas ya guardadas traen un precio distinto. "
+                "Se ha conservado el valor guardado:"
+            )
+            st.dataframe(resumen["conflictos"], use_container_width=True)
+
     if archivo and isin_final:
         if st.button("💾 Guardar histórico NAV"):
-            guardar_historico_isin(df_subido, isin_final)
-            st.success(f"✅ Histórico actualizado para ISIN: {isin_final}")
+            st.session_state["resumen_guardado_nav"] = guardar_historico_isin(df_subido, isin_final)
             st.rerun()
 
    
+
+    # 7️⃣ Importación masiva
+    st.markdown("---")
+    st.subheader("📦 Importación masiva de históricos")
+    st.caption(
+        """
+        Sube un `.zip` o indica un directorio local con exportaciones CSV de Investing.com.
+        El ISIN de cada fichero se toma de `manifiesto.csv` (columnas **archivo**, **ISIN**; rutas relativas a su carpeta) si lo hay,
+        o del nombre del fichero (por ejemplo `LU0996182563.csv`).
+        """
+    )
+    col_zip, col_dir = st.columns(2)
+    with col_zip:
+        archivo_zip = st.file_uploader("🗜️ Archivo .zip", type=["zip"], key="zip_historicos_nav")
+    with col_dir:
+        directorio_lote = st.text_input("📁 O ruta de un directorio local:", value="").strip()
+
+    informe = st.session_state.pop("informe_importacion_nav", None)
+    if informe is not None:
+        importados = int((informe["Estado"] == "✅ Importado").sum())
+        st.success(f"✅ Importación terminada: {len(informe)} ficheros, {importados} con fechas nuevas.")
+        st.dataframe(informe, use_container_width=True)
+
+    if (archivo_zip or directorio_lote) and st.button("📦 Importar lote"):
+        origen = archivo_zip or Path(directorio_lote)
+        if not archivo_zip and not origen.is_dir():
+            st.error(f"❌ No existe el directorio {origen}")
+        else:
+            try:
+                with st.spinner("Importando históricos..."):
+                    st.session_state["informe_importacion_nav"] = importar_lote_historicos(origen)
+                st.rerun()
+            except (zipfile.BadZipFile, ValueError) as e:
+                st.error(f"❌ No se pudo importar el lote: {e}")
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import requests
+from pathlib import Path
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from utils.config import HTTP_FIXTURES_DIR
+from utils import cache_db, control_trafico
+from utils.control_trafico import CircuitoAbierto
+
+# Cliente HTTP compartido por todos los fetchers: una Session con keep-alive por
+# host, timeouts de conexión/lectura y reintentos con backoff exponencial + jitter.
+# Cada petición pasa además por el interruptor y el limitador de su host (control_trafico).
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/124.0.0.0 Safari/537.36"
+    ),
+    # Todas las codificaciones que urllib3 sabe descomprimir aquí (gzip, deflate y br/zstd si están instalados)
+    "Accept-Encoding": ACCEPT_ENCODING,
+}
+
+TIMEOUT_CONEXION_SEG = 5
+TIMEOUT_LECTURA_SEG = 20
+
+REINTENTOS = 3
+BACKOFF_FACTOR = 0.5   # esperas de 0.5s, 1s, 2s...
+BACKOFF_JITTER = 0.5   # hasta 0.5s aleatorios extra para no sincronizar reintentos
+STATUS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Errores de una petición que los fetchers no se tragan: llegan a merge_nav_data, que
+# distingue un fallo de red o del servidor de un identificador que no se resuelve
+ERRORES_PETICION = (requests.RequestException, CircuitoAbierto)
+
+CONEXIONES_POR_HOST = 10
+
+_sesiones = {}
+_SESIONES_LOCK = threading.Lock()
+
+# Peticiones hechas por cada hilo: permite saber si una llamada salió a la red o
+# se resolvió entera desde la caché (ver peticiones_hilo)
+_local = threading.local()
+
+# Fixtures: "grabar" guarda cada respuesta real en el almacén local y "reproducir"
+# las sirve desde ahí sin tocar la red (pruebas y benchmarks deterministas).
+# Se activa con NAV_HTTP_MODO / NAV_HTTP_FIXTURES o con configurar_fixtures.
+MODOS_FIXTURES = ("grabar", "reproducir")
+MODO_FIXTURES = os.environ.get("NAV_HTTP_MODO") or None
+FIXTURES_DIR = Path(os.environ.get("NAV_HTTP_FIXTURES") or HTTP_FIXTURES_DIR)
+
+
+class FixtureNoEncontrada(requests.ConnectionError):
+    """En modo reproducir, la URL pedida no está grabada (equivale a no tener red)."""
+
+
+class _ReintentosLimitados(Retry):
+    """
+    Retry de urllib3 cuyos reintentos también pasan por el limitador del host: sin
+    esto, cada GET podría enviar hasta REINTENTOS peticiones extra fuera del ritmo fijado.
+    """
+    host = None
+
+    def new(self, **kwargs):
+        # urllib3 crea una copia por intento; el host no está entre sus parámetros
+        reintento = super().new(**kwargs)
+        reintento.host = self.host
+        return reintento
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.host:
+            control_trafico.limitador(self.host).adquirir()
+
+
+def _politica_reintentos(host):
+    reintentos = _ReintentosLimitados(
+        total=REINTENTOS,
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_JITTER,
+        status_forcelist=STATUS_REINTENTABLES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        # Tras agotar reintentos se devuelve la respuesta y el llamador decide con raise_for_status
+        raise_on_status=False,
+    )
+    reintentos.host = host
+    return reintentos
+
+
+def _crear_sesion(host):
+    sesion = requests.Session()
+    sesion.headers.update(HEADERS)
+    adaptador = HTTPAdapter(
+        max_retries=_politica_reintentos(host),
+        pool_connections=1,
+        pool_maxsize=CONEXIONES_POR_HOST,
+    )
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    return sesion
+
+
+def sesion_para(url):
+    """Devuelve la Session reutilizable del host de `url`, creándola la primera vez."""
+    host = urlsplit(url).netloc.lower()
+    with _SESIONES_LOCK:
+        sesion = _sesiones.get(host)
+        if sesion is None:
+            sesion = _sesiones[host] = _crear_sesion(host)
+    return sesion
+
+
+def limitar_peticiones_por_host(peticiones_por_seg):
+    """
+    Cambia el ritmo sostenido por defecto de los limitadores por host (los hosts con
+    límite propio en settings.json lo conservan); None o 0 deja sin límite al resto.
+    """
+    control_trafico.configurar_limite(peticiones_por_seg)
+
+
+def es_fallo_transitorio(error):
+    """
+    True si `error` dice que la fuente no respondió (timeout, conexión, 5xx/429 tras los
+    reintentos, circuito abierto) y no que el identificador no exista en ella.
+    """
+    if isinstance(error, CircuitoAbierto):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code in STATUS_REINTENTABLES
+    return isinstance(error, requests.RequestException)
+
+
+def host_de(url):
+    return urlsplit(url).netloc.lower()
+
+
+def circuito_abierto(url_o_host):
+    """True si el interruptor del host está abierto y sus peticiones se rechazan sin enviarse."""
+    host = host_de(url_o_host) if "://" in url_o_host else url_o_host.lower()
+    return control_trafico.interruptor(host).abierto()
+
+
+def configurar_fixtures(modo, directorio=None):
+    """Activa la grabación o reproducción de respuestas (modo None para usar la red)."""
+    global MODO_FIXTURES, FIXTURES_DIR
+    if modo not in (None, *MODOS_FIXTURES):
+        raise ValueError(f"Modo de fixtures desconocido: {modo}")
+    MODO_FIXTURES = modo
+    if directorio is not None:
+        FIXTURES_DIR = Path(directorio)
+
+
+def ruta_fixture(url):
+    """Fichero del almacén para `url`: un directorio por host y un nombre legible + hash."""
+    partes = urlsplit(url)
+    legible = re.sub(r"[^A-Za-z0-9]+", "_", f"{partes.path}_{partes.query}").strip("_")[:60]
+    resumen = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return FIXTURES_DIR / partes.netloc.lower() / f"{legible}_{resumen}.json"
+
+
+def grabar_fixture(url, respuesta):
+    ruta = ruta_fixture(url)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    fixture = {
+        "url": url,
+        "status_code": respuesta.status_code,
+        "reason": respuesta.reason,
+        "content_type": respuesta.headers.get("Content-Type"),
+        "texto": respuesta.text,
+    }
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+
+def leer_fixture(url):
+    """Respuesta grabada para `url` como requests.Response, o None si no existe."""
+    ruta = ruta_fixture(url)
+    if not ruta.exists():
+        return None
+    with open(ruta, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+
+    respuesta = requests.Response()
+    respuesta.url = fixture["url"]
+    respuesta.status_code = fixture["status_code"]
+    respuesta.reason = fixture.get("reason") or ""
+    respuesta.headers = CaseInsensitiveDict({"Content-Type": fixture.get("content_type") or "text/html"})
+    respuesta.encoding = "utf-8"
+    respuesta._content = fixture["texto"].encode("utf-8")
+    return respuesta
+
+
+def peticiones_hilo():
+    """Número de GET pedidos hasta ahora por el hilo actual (también los reproducidos)."""
+    return getattr(_local, "peticiones", 0)
+
+
+def get(url, **kwargs):
+    """
+    GET a través de la sesión del host con timeouts por defecto.
+    Acepta los mismos argumentos que requests.get.
+    """
+    _local.peticiones = peticiones_hilo() + 1
+    if MODO_FIXTURES == "reproducir":
+        respuesta = leer_fixture(url)
+        if respuesta is None:
+            raise FixtureNoEncontrada(f"Sin fixture grabada para {url}")
+        return respuesta
+
+    kwargs.setdefault("timeout", (TIMEOUT_CONEXION_SEG, TIMEOUT_LECTURA_SEG))
+    host = host_de(url)
+    interruptor = control_trafico.interruptor(host)
+    interruptor.permitir()
+    try:
+        control_trafico.limitador(host).adquirir()
+        respuesta = sesion_para(url).get(url, **kwargs)
+    except BaseException as e:
+        # Cualquier excepción cuenta como fallo: si era la prueba del semiabierto, la libera
+        interruptor.registrar_fallo(f"{type(e).__name__}: {e}")
+        raise
+    # Tras agotar los reintentos, un 5xx o 429 indica que el host está degradado
+    if respuesta.status_code in STATUS_REINTENTABLES:
+        interruptor.registrar_fallo(f"HTTP {respuesta.status_code}")
+    else:
+        interruptor.registrar_exito()
+
+    if MODO_FIXTURES == "grabar":
+        grabar_fixture(url, respuesta)
+    return respuesta
+
+
+def get_ficha(url, desde_cache, fuente, identificador, resolver):
+    """
+    GET de la ficha de un fondo cuya URL viene de `resolver` (el resolver_url_* de cada
+    fetcher, que devuelve (url, desde_cache)). Si la URL salía de la caché y la ficha ha
+    desaparecido (404), se olvida la URL guardada y se vuelve a buscar una vez.
+    Devuelve la respuesta, o None si la nueva búsqueda no encuentra enlace.
+    """
+    respuesta = get(url)
+    if respuesta.status_code == 404 and desde_cache:
+        print("🔗 Ficha cacheada devuelve 404 → se invalida y se busca de nuevo")
+        cache_db.invalidar_url_resuelta(fuente, identificador)
+        url, _ = resolver(identificador)
+        if not url:
+            return None
+        respuesta = get(url)
+    return respuesta
+
+
+def cerrar_sesiones():
+    """Cierra todas las conexiones abiertas (útil al terminar procesos por lotes)."""
+    with _SESIONES_LOCK:
+        for sesion in _sesiones.values():
+            sesion.close()
+        _sesiones.clear()
@@ -1,24 +1,13 @@
 import re
-import requests
-import json
-from pathlib import Path
-from bs4 import BeautifulSoup
 from datetime import datetime
 from unidecode import unidecode
 from urllib.parse import quote
-from lxml import html 
+from utils import cache_db, http_client
+from utils.parseo_html import clases, con_clase, parsear_html, primero
 
-CACHE_PATH = Path("data/cache_nav_investing.json")
+FUENTE_CACHE = "investing"
 CACHE_TTL_HORAS = 24
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/124.0.0.0 Safari/537.36"
-    )
-}
-
 def es_isin(valor: str) -> bool:
     """
     Determina si una cadena es un ISIN válido.
@@ -27,38 +16,26 @@ def es_isin(valor: str) -> bool:
     return bool(re.fullmatch(r"[A-Z]{2}[A-Z0-9]{10}", valor.upper()))
 
 def cargar_cache():
-    if CACHE_PATH.exists():
-        with open(CACHE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def guardar_cache(cache):
-    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+    return cache_db.leer_fuente(FUENTE_CACHE)
 
 def guardar_en_cache(nombre_fondo, data):
     print(f"📝 Guardando en caché: {nombre_fondo}")
-    cache = cargar_cache()
-    cache[nombre_fondo.lower()] = {
-        "timestamp": datetime.now().isoformat(),
-        "data": data
-    }
-    guardar_cache(cache)
+    cache_db.guardar_entrada(FUENTE_CACHE, nombre_fondo.lower(), data)
 
 def buscar_url_investing_por_isin(isin: str) -> str | None:
     query = quote(isin)
     url_busqueda = f"https://www.investing.com/search/?q={query}"
     try:
-        response = requests.get(url_busqueda, headers=HEADERS)
+        response = http_client.get(url_busqueda)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        enlaces = soup.select("a.js-inner-all-results-quote-item")
+        enlaces = parsear_html(response.text).xpath(f"//a[{con_clase('js-inner-all-results-quote-item')}]")
 
         for enlace in enlaces:
             href = enlace.get("href")
             if href and href.startswith("/funds/"):
                 return f"https://www.investing.com{href}"
+    except http_client.ERRORES_PETICION:
+        raise
     except Exception as e:
         print(f"⚠️ Error en búsqueda por ISIN: {e}")
     return None
@@ -67,27 +44,121 @@ def buscar_url_investing_por_nombre(nombre_fondo: str) -> str | None:
     query = quote(nombre_fondo)
     url_busqueda = f"https://www.investing.com/search/?q={query}"
     try:
-        response = requests.get(url_busqueda, headers=HEADERS)
+        response = http_client.get(url_busqueda)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        enlaces = soup.select("a.js-inner-all-results-quote-item")
+        enlaces = parsear_html(response.text).xpath(f"//a[{con_clase('js-inner-all-results-quote-item')}]")
 
         for enlace in enlaces:
             href = enlace.get("href", "")
             if href.startswith("/funds/"):
                 return f"https://www.investing.com{href}"
+    except http_client.ERRORES_PETICION:
+        raise
     except Exception as e:
         print(f"⚠️ Error en búsqueda por nombre: {e}")
     return None
 
+def resolver_url_investing(identificador: str) -> tuple[str | None, bool]:
+    """
+    Devuelve (url_ficha, desde_cache). La URL encontrada por ISIN o nombre se guarda
+    para no repetir la búsqueda en cada refresco.
+    """
+    url = cache_db.leer_url_resuelta(FUENTE_CACHE, identificador)
+    if url:
+        print(f"🔗 URL de ficha recuperada de caché: {url}")
+        return url, True
+
+    if es_isin(identificador):
+        url = buscar_url_investing_por_isin(identificador)
+    else:
+        url = buscar_url_investing_por_nombre(identificador)
+
+    if url:
+        cache_db.guardar_url_resuelta(FUENTE_CACHE, identificador, url)
+    return url, False
+
+def parsear_ficha_investing(texto: str) -> dict | None:
+    """Extrae los datos de NAV del HTML de la ficha de Investing. Sin red ni caché."""
+    tree = parsear_html(texto)
+
+    # Extraer NAV
+    nav_tag = primero(tree, '//span[@id="last_last"]')
+    if nav_tag is None:
+        return None
+    nav_str = nav_tag.text_content().strip().replace("\xa0", "")
+    if "." in nav_str and "," in nav_str:
+        nav_str = nav_str.replace(".", "").replace(",", ".")
+    else:
+        nav_str = nav_str.replace(",", ".")
+    nav = float(nav_str)
+
+    # Extraer variación diaria (1 d%) desde clase específica "pcp"
+    variacion_1d = None
+    try:
+        span_var = next(
+            (span for span in tree.xpath('//span[contains(@class, "-pcp")]')
+             if any(re.search(r"pid-\d+-pcp", clase) for clase in clases(span))),
+            None,
+        )
+        if span_var is not None:
+            texto_var = span_var.text_content().strip().replace("%", "").replace(",", ".")
+            variacion_1d = float(texto_var)
+    except Exception as e:
+        print(f"⚠️ Error al extraer variación relativa diaria: {e}")
+
+    # Extraer ISIN
+    isin = None
+    for span in tree.xpath('//span[. = "ISIN:"]'):
+        next_span = next((s for s in span.itersiblings("span") if "elp" in clases(s)), None)
+        if next_span is not None:
+            isin = (next_span.get("title") or next_span.text_content()).strip()
+            break
+
+    # Extraer fecha
+    fecha_tag = next(
+        (span for span in tree.xpath('//span[starts-with(normalize-space(@class), "bold pid-")]')
+         if " ".join(clases(span)).endswith("-time")),
+        None,
+    )
+    if fecha_tag is not None:
+        try:
+            raw_fecha = fecha_tag.text_content().strip()
+            fecha = datetime.strptime(raw_fecha, "%d/%m").replace(year=datetime.today().year).date().isoformat()
+        except:
+            fecha = None
+    else:
+        fecha = None
+
+    # Extraer Divisa
+    divisa = "ERROR"
+    try:
+        divisa_node = tree.xpath('/html/body/div[7]/section/div[4]/div[1]/div[1]/div[2]/div[2]/span[4]/text()')
+        if divisa_node:
+            divisa_raw = divisa_node[0].strip().upper()
+            if re.fullmatch(r"[A-Z]{3}", divisa_raw):
+                divisa = divisa_raw
+    except Exception as e:
+        print(f"⚠️ XPath divisa fallo: {e}")
+    
+    nombre_web = tree.xpath("//h1")[0].text_content().strip()
+    resultado = {
+        "nombre": nombre_web,
+        "isin": isin,
+        "nav": nav,
+        "fecha": fecha,
+        "divisa": divisa,
+        "fuente": "Investing.com",
+        "variacion_1d": variacion_1d
+    }
+    return resultado
+
 def buscar_nav_investing(identificador: str) -> dict | None:
     print(f"🔍 Buscando NAV en Investing.com para: {identificador}")
     clave_cache = f"isin:{identificador}" if es_isin(identificador) else f"nombre:{identificador}"
 
     # Buscar en caché
-    cache = cargar_cache()
-    if clave_cache in cache:
-        entrada = cache[clave_cache]
+    entrada = cache_db.leer_entrada(FUENTE_CACHE, clave_cache.lower())
+    if entrada:
         try:
             fecha_guardado = datetime.fromisoformat(entrada["timestamp"])
             if (datetime.now() - fecha_guardado).total_seconds() < CACHE_TTL_HORAS * 3600:
@@ -100,17 +171,13 @@ def buscar_nav_investing(identificador: str) -> dict | None:
 
     # 2. Si clave_cache no existe, pero es un ISIN, buscar dentro del contenido cacheado
     if es_isin(identificador):
-        for key, entrada in cache.items():
-            datos = entrada["data"]
-            if "isin" in datos and datos["isin"] == identificador.upper():
-                print(f"📦 Recuperado de caché por ISIN ({identificador}) en entrada {key}")
-                return datos
+        entrada = cache_db.buscar_por_isin(FUENTE_CACHE, identificador)
+        if entrada:
+            print(f"📦 Recuperado de caché por ISIN ({identificador}) en entrada {entrada['clave']}")
+            return entrada["data"]
 
     # Búsqueda online
-    if es_isin(identificador):
-        url = buscar_url_investing_por_isin(identificador)
-    else:
-        url = buscar_url_investing_por_nombre(identificador)
+    url, desde_cache = resolver_url_investing(identificador)
 
     if not url:
         print("❌ No se encontró un enlace válido")
@@ -118,76 +185,21 @@ def buscar_nav_investing(identificador: str) -> dict | None:
 
     print(f"✅ Enlace preciso encontrado: {url}")
     try:
-        response_fondo = requests.get(url, headers=HEADERS)
+        response_fondo = http_client.get_ficha(url, desde_cache, FUENTE_CACHE, identificador, resolver_url_investing)
+        if response_fondo is None:
+            print("❌ No se encontró un enlace válido")
+            return None
         response_fondo.raise_for_status()
-        soup_fondo = BeautifulSoup(response_fondo.text, "html.parser")
-
-        # Extraer NAV
-        nav_tag = soup_fondo.find("span", id="last_last")
-        if not nav_tag:
+        resultado = parsear_ficha_investing(response_fondo.text)
+        if not resultado:
             return None
-        nav_str = nav_tag.text.strip().replace("\xa0", "")
-        if "." in nav_str and "," in nav_str:
-            nav_str = nav_str.replace(".", "").replace(",", ".")
-        else:
-            nav_str = nav_str.replace(",", ".")
-        nav = float(nav_str)
-
-        # Extraer variación diaria (1 d%) desde clase específica "pcp"
-        variacion_1d = None
-        try:
-            span_var = soup_fondo.find("span", class_=re.compile(r"pid-\d+-pcp"))
-            if span_var:
-                texto_var = span_var.text.strip().replace("%", "").replace(",", ".")
-                variacion_1d = float(texto_var)
-        except Exception as e:
-            print(f"⚠️ Error al extraer variación relativa diaria: {e}")
-
-        # Extraer ISIN
-        isin = None
-        for span in soup_fondo.find_all("span", string="ISIN:"):
-            next_span = span.find_next_sibling("span", class_="elp")
-            if next_span:
-                isin = (next_span.get("title") or next_span.text).strip()
-                break
-
-        # Extraer fecha
-        fecha_tag = soup_fondo.find("span", class_=lambda x: x and x.startswith("bold pid-") and x.endswith("-time"))
-        if fecha_tag:
-            try:
-                raw_fecha = fecha_tag.text.strip()
-                fecha = datetime.strptime(raw_fecha, "%d/%m").replace(year=datetime.today().year).date().isoformat()
-            except:
-                fecha = None
-        else:
-            fecha = None
-
-        # Extraer Divisa
-        divisa = "ERROR"
-        try:
-            tree = html.fromstring(response_fondo.text)
-            divisa_node = tree.xpath('/html/body/div[7]/section/div[4]/div[1]/div[1]/div[2]/div[2]/span[4]/text()')
-            if divisa_node:
-                divisa_raw = divisa_node[0].strip().upper()
-                if re.fullmatch(r"[A-Z]{3}", divisa_raw):
-                    divisa = divisa_raw
-        except Exception as e:
-            print(f"⚠️ XPath divisa fallo: {e}")
-        
-        nombre_web = soup_fondo.find("h1").text.strip()
-        resultado = {
-            "nombre": nombre_web,
-            "isin": isin,
-            "nav": nav,
-            "fecha": fecha,
-            "divisa": divisa,
-            "fuente": "Investing.com",
-            "variacion_1d": variacion_1d
-        }
 
         guardar_en_cache(clave_cache, resultado)
         return resultado
 
+    except http_client.ERRORES_PETICION:
+        # Fallo de red o del servidor: lo clasifica merge_nav_data (no es "fondo no encontrado")
+        raise
     except Exception as e:
         print(f"⚠️ Error al buscar fondo: {e}")
         return None
@@ -1,8 +1,48 @@
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from utils.investing_fetcher import buscar_nav_investing
 from utils.morningstar_fetcher import buscar_nav_morningstar
 from utils.ft_fetcher import buscar_nav_ft
+from utils import cache_db, http_client
+
+# Fuentes en orden de prioridad: el primer valor válido de cada campo gana
+FUENTES = [
+    ("morningstar", buscar_nav_morningstar),
+    ("ft", buscar_nav_ft),
+    ("investing", buscar_nav_investing),
+]
+
+# Host de cada fuente, para consultar su interruptor (circuit breaker) en http_client
+HOST_FUENTE = {
+    "morningstar": "www.morningstar.es",
+    "ft": "markets.ft.com",
+    "investing": "www.investing.com",
+}
+
+# Identificadores que se pueden estar combinando a la vez en un proceso: los lotes de
+# get_nav_real_many (4), los refrescos en segundo plano (2) y algo de margen. El pool
+# tiene un hilo por fuente de cada uno para que, en el pico, ninguna consulta espere en cola.
+MAX_IDENTIFICADORES_SIMULTANEOS = 8
+MAX_WORKERS_FUENTES = len(FUENTES) * MAX_IDENTIFICADORES_SIMULTANEOS
+
+# Plazo máximo por fuente, contado desde que su consulta empieza a ejecutarse; una
+# consulta que sigue en cola pasado este mismo plazo se cancela
+TIMEOUT_FUENTE_SEG = 20
+
+# Si la mejor fuente no ha respondido en este tiempo se consulta también al resto en
+# paralelo, sin esperar a que agote su plazo
+PRESUPUESTO_PRIMERA_FUENTE_SEG = 4
+
+# Orden adaptativo: estimación previa para fuentes sin telemetría y número de
+# observaciones a partir del cual pesa más lo medido que lo supuesto
+LATENCIA_PREVIA_SEG = 3.0
+OBSERVACIONES_PREVIAS = 3
+
+# Pool acotado a nivel de módulo: varias llamadas concurrentes a merge_nav_data
+# no crean hilos sin límite
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS_FUENTES, thread_name_prefix="nav_fuente")
 
 def es_valido_isin(isin):
     return bool(re.fullmatch(r"[A-Z]{2}[A-Z0-9]{10}", isin or ""))
@@ -34,36 +74,197 @@ def es_valido_variacion_1d(var):
     except:
         return False
 
+# Campos del resultado combinado y su validador
+VALIDADORES = {
+    "nombre": es_valido_nombre,
+    "isin": es_valido_isin,
+    "nav": es_valido_nav,
+    "fecha": es_valido_fecha,
+    "divisa": es_valido_divisa,
+    "variacion_1d": es_valido_variacion_1d,
+}
+CAMPOS = list(VALIDADORES)
+
+def completitud(datos):
+    """Fracción de campos validados que aporta una respuesta (0 si no hay datos)."""
+    if not datos:
+        return 0.0
+    return sum(1 for campo, valido in VALIDADORES.items() if valido(datos.get(campo))) / len(CAMPOS)
+
+def datos_completos(respuestas):
+    """True si entre todas las respuestas ya hay un valor válido para cada campo."""
+    return all(
+        any(datos and valido(datos.get(campo)) for datos in respuestas)
+        for campo, valido in VALIDADORES.items()
+    )
+
+def puntuar_fuente(telemetria):
+    """
+    Utilidad esperada de consultar una fuente: probabilidad de éxito × completitud
+    por segundo de latencia. Con pocas observaciones domina la estimación previa
+    (éxito seguro, datos completos y latencia LATENCIA_PREVIA_SEG).
+    """
+    if not telemetria:
+        return 1.0 / LATENCIA_PREVIA_SEG
+    consultas, exitos = telemetria["consultas"], telemetria["exitos"]
+    tasa_exito = (exitos + 1) / (consultas + 2)
+    peso = consultas / (consultas + OBSERVACIONES_PREVIAS)
+    completitud_media = peso * telemetria["completitud"] + (1 - peso)
+    latencia = peso * telemetria["latencia_seg"] + (1 - peso) * LATENCIA_PREVIA_SEG
+    return tasa_exito * completitud_media / max(latencia, 0.1)
+
+def ordenar_fuentes(identificador):
+    """FUENTES ordenadas por su telemetría para este identificador (empates: prioridad fija)."""
+    telemetria = cache_db.leer_telemetria(identificador)
+    return sorted(FUENTES, key=lambda f: -puntuar_fuente(telemetria.get(f[0])))
+
+def _ejecutar_fuente(funcion, identificador, inicios, fuente):
+    """(datos, error, segundos, desde_cache); desde_cache si la fuente no hizo ninguna petición HTTP."""
+    inicios[fuente] = time.monotonic()
+    peticiones = http_client.peticiones_hilo()
+    inicio = time.perf_counter()
+    try:
+        datos, error = funcion(identificador), None
+    except Exception as e:
+        datos, error = None, e
+    return datos, error, time.perf_counter() - inicio, http_client.peticiones_hilo() == peticiones
+
+def _registrar_respuesta(fuente, identificador, resultado, fallos):
+    """Anota en la telemetría y en la caché negativa lo que devolvió una fuente. Devuelve sus datos."""
+    datos, error, segundos, desde_cache = resultado
+    motivo = None
+    if error is not None:
+        print(f"⚠️ Error en {fuente} para {identificador}: {type(error).__name__}: {error}")
+        motivo = f"error: {type(error).__name__}: {error}"
+    elif not datos:
+        motivo = "sin datos de NAV"
+
+    # Un acierto en la caché del propio fetcher no mide la fuente (ni su latencia ni si
+    # responde): solo las consultas que salen a la red entran en la telemetría
+    if not desde_cache:
+        cache_db.registrar_telemetria(fuente, identificador, motivo is None, segundos, completitud(datos))
+    if error is not None and http_client.es_fallo_transitorio(error):
+        # Timeout, conexión, 5xx o circuito abierto: la fuente no respondió, lo que no dice
+        # nada del identificador. Penaliza la telemetría pero no va a la caché negativa
+        print(f"🌐 {fuente} no respondió para {identificador}: fallo no atribuido al identificador")
+    elif motivo and http_client.circuito_abierto(HOST_FUENTE[fuente]):
+        # El fallo es de la fuente entera, no de este identificador: no va a la caché negativa
+        print(f"🔌 {fuente} con el circuito abierto: fallo no atribuido a {identificador}")
+    elif motivo:
+        cache_db.registrar_fallo(fuente, identificador, motivo)
+    elif fallos[fuente]:
+        cache_db.borrar_fallo(fuente, identificador)
+    return datos
+
+def _consultar(identificador, candidatas, fallos, timeout, presupuesto):
+    """
+    Consulta `candidatas` (ya ordenadas) y devuelve {fuente: datos}.
+
+    Primero se lanza solo la mejor fuente. El resto se lanza a la vez en cuanto esa
+    responde sin completar los campos, falla o supera `presupuesto` segundos sin
+    responder (entonces compiten en paralelo con ella). Cada fuente tiene `timeout`
+    segundos desde que empieza a ejecutarse (el tiempo en cola no cuenta). En cuanto
+    los datos reunidos están completos se deja de esperar: las fuentes que siguen en
+    marcha se anotan en la telemetría al terminar.
+    """
+    inicios = {}
+    lanzadas = {}  # fuente → (futuro, momento del envío)
+    respuestas = {}
+    resto = candidatas[1:]
+
+    def lanzar(oleada):
+        for fuente, funcion in oleada:
+            futuro = _EXECUTOR.submit(_ejecutar_fuente, funcion, identificador, inicios, fuente)
+            lanzadas[fuente] = (futuro, time.monotonic())
+
+    lanzar(candidatas[:1])
+    limite_resto = time.monotonic() + presupuesto
+    completos = False
+    while True:
+        for fuente, (futuro, _) in lanzadas.items():
+            if futuro.done() and fuente not in respuestas:
+                respuestas[fuente] = _registrar_respuesta(fuente, identificador, futuro.result(), fallos)
+
+        completos = bool(respuestas) and datos_completos(respuestas.values())
+        if completos:
+            if resto:
+                print(f"⏭️ Datos completos para {identificador}: se omiten {[fuente for fuente, _ in resto]}")
+            break
+
+        ahora = time.monotonic()
+        pendientes = [(fuente, futuro) for fuente, (futuro, _) in lanzadas.items() if not futuro.done()]
+        if resto and (not pendientes or ahora >= limite_resto):
+            for fuente, _ in pendientes:
+                print(f"🐢 {fuente} sin respuesta tras {presupuesto}s para {identificador} → se consulta también al resto")
+            lanzar(resto)
+            resto = []
+            continue
+
+        plazos = [inicios.get(fuente, lanzadas[fuente][1]) + timeout for fuente, _ in pendientes]
+        if not pendientes or all(plazo <= ahora for plazo in plazos):
+            break
+        plazo = min(p for p in plazos if p > ahora)
+        if resto:
+            plazo = min(plazo, limite_resto)
+        wait([futuro for _, futuro in pendientes], timeout=plazo - ahora, return_when=FIRST_COMPLETED)
+
+    for fuente, (futuro, _) in lanzadas.items():
+        if fuente in respuestas:
+            continue
+        respuestas[fuente] = None
+        if futuro.cancel():
+            if not completos:
+                # Nunca llegó a ejecutarse: el pool estaba saturado, no es culpa de la fuente
+                print(f"🚫 {fuente} cancelada para {identificador}: seguía en cola tras {timeout}s")
+        elif completos:
+            # Ya no hace falta, pero su resultado sigue contando para la telemetría
+            futuro.add_done_callback(
+                lambda f, fuente=fuente: _registrar_respuesta(fuente, identificador, f.result(), fallos)
+            )
+        else:
+            # Un timeout es transitorio y la búsqueda puede acabar cacheando el dato: no cuenta
+            # como fallo en la caché negativa, pero sí penaliza la fuente en la telemetría
+            print(f"⏱️ {fuente} sin respuesta tras {timeout}s para {identificador} → se ignora")
+            cache_db.registrar_telemetria(fuente, identificador, False, timeout, 0.0)
+    return respuestas
+
+def consultar_fuentes(identificador, timeout=TIMEOUT_FUENTE_SEG, presupuesto=PRESUPUESTO_PRIMERA_FUENTE_SEG):
+    """
+    Consulta las fuentes en el orden que aconseja su telemetría para este
+    identificador y devuelve [(fuente, datos)] en orden de prioridad; una fuente
+    que falla, no responde a tiempo o no hace falta consultar aporta None.
+
+    Evaluación perezosa: primero se pregunta solo a la mejor fuente y, si su
+    respuesta no rellena todos los campos validados o tarda más de `presupuesto`
+    segundos, al resto a la vez (cada fuente, como mucho `timeout` segundos).
+
+    Las fuentes con el circuito abierto (caídas o degradadas) y las que ya fallaron
+    para este identificador y siguen en su periodo de backoff (caché negativa) no se
+    consultan. Cada respuesta sin NAV o error que no sea de red (p. ej. un 404) se
+    registra en la caché negativa con su motivo; los timeouts, fallos de conexión y 5xx
+    solo cuentan en la telemetría. Cada éxito borra la entrada negativa.
+    """
+    fallos = {fuente: cache_db.leer_fallo(fuente, identificador) for fuente, _ in FUENTES}
+
+    candidatas = []
+    for fuente, funcion in ordenar_fuentes(identificador):
+        if http_client.circuito_abierto(HOST_FUENTE[fuente]):
+            print(f"🔌 {fuente} omitida para {identificador}: circuito abierto")
+        elif cache_db.en_espera(fallos[fuente]):
+            print(f"🚫 {fuente} omitida para {identificador} hasta {fallos[fuente]['proximo_reintento']} ({fallos[fuente]['motivo']})")
+        else:
+            candidatas.append((fuente, funcion))
+
+    respuestas = _consultar(identificador, candidatas, fallos, timeout, presupuesto) if candidatas else {}
+    return [(fuente, respuestas.get(fuente)) for fuente, _ in FUENTES]
+
 def merge_nav_data(identificador):
-    
-    import inspect
-
-    if "Seilern" in identificador:
-        print(f"\n🚨 merge_nav_data llamado con: '{identificador}'")
-        for f in inspect.stack()[1:4]:
-            print(f"↪️ desde {f.function} en {f.filename}:{f.lineno}")
-    
-    
-    fuentes = [
-        ("morningstar", buscar_nav_morningstar(identificador)),
-        ("ft", buscar_nav_ft(identificador)),
-        ("investing", buscar_nav_investing(identificador)),
-    ]
+    fuentes = consultar_fuentes(identificador)
 
     resultado = {}
-    campos = ["nombre", "isin", "nav", "fecha", "divisa", "variacion_1d"]
-    validadores = {
-        "isin": es_valido_isin,
-        "nav": es_valido_nav,
-        "fecha": es_valido_fecha,
-        "nombre": es_valido_nombre,
-        "divisa": es_valido_divisa,
-        "variacion_1d": es_valido_variacion_1d,
-    }
-
-    for campo in campos:
+    for campo in CAMPOS:
         for fuente, datos in fuentes:
-            if datos and campo in datos and validadores[campo](datos[campo]):
+            if datos and campo in datos and VALIDADORES[campo](datos[campo]):
                 resultado[campo] = datos[campo]
                 break
         else:
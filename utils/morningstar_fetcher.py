@@ -1,52 +1,139 @@
 import re
-import requests
-import json
-from pathlib import Path
-from bs4 import BeautifulSoup
 from datetime import datetime
 from urllib.parse import quote
+from utils import cache_db, http_client
+from utils.parseo_html import con_clase, parsear_html, primero, texto_nodo
 
-CACHE_PATH = Path("data/cache_nav_morningstar.json")
+FUENTE_CACHE = "morningstar"
 CACHE_TTL_HORAS = 24
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/124.0.0.0 Safari/537.36"
-    )
-}
-
 def es_isin(valor: str) -> bool:
     return bool(re.fullmatch(r"[A-Z]{2}[A-Z0-9]{10}", valor.upper()))
 
 def cargar_cache():
-    if CACHE_PATH.exists():
-        with open(CACHE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def guardar_cache(cache):
-    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+    return cache_db.leer_fuente(FUENTE_CACHE)
 
 def guardar_en_cache(nombre_clave, data):
     print(f"📝 Guardando en caché: {nombre_clave}")
-    cache = cargar_cache()
-    cache[nombre_clave.lower()] = {
-        "timestamp": datetime.now().isoformat(),
-        "data": data
+    cache_db.guardar_entrada(FUENTE_CACHE, nombre_clave.lower(), data)
+
+def buscar_url_morningstar(identificador: str) -> str | None:
+    """Busca el fondo en Morningstar y devuelve la URL de su ficha (snapshot), o None."""
+    query = quote(identificador)
+    url_busqueda = f"https://www.morningstar.es/es/funds/SecuritySearchResults.aspx?search={query}&type="
+
+    resp_busqueda = http_client.get(url_busqueda)
+    resp_busqueda.raise_for_status()
+    href = primero(parsear_html(resp_busqueda.text), "//a[contains(@href, '/funds/snapshot/snapshot.aspx?id=')]/@href")
+    if not href:
+        return None
+    return "https://www.morningstar.es" + href
+
+def resolver_url_morningstar(identificador: str) -> tuple[str | None, bool]:
+    """
+    Devuelve (url_ficha, desde_cache). La URL resuelta se guarda por identificador
+    para no repetir la búsqueda en cada refresco.
+    """
+    url = cache_db.leer_url_resuelta(FUENTE_CACHE, identificador)
+    if url:
+        print(f"🔗 URL de ficha recuperada de caché: {url}")
+        return url, True
+
+    url = buscar_url_morningstar(identificador)
+    if url:
+        cache_db.guardar_url_resuelta(FUENTE_CACHE, identificador, url)
+    return url, False
+
+def _extraer_divisa_nav(raw_texto):
+    match = re.search(r"([A-Z]{3})\s+([0-9]+[.,]?[0-9]*)", raw_texto)
+    if not match:
+        return None, None
+    try:
+        return match.group(1), float(match.group(2).replace(",", "."))
+    except ValueError:
+        return match.group(1), None
+
+def parsear_ficha_morningstar(texto: str) -> dict | None:
+    """Extrae los datos de NAV del HTML de una ficha (snapshot). Sin red ni caché."""
+    arbol = parsear_html(texto)
+    tabla = primero(arbol, f"//table[{con_clase('overviewKeyStatsTable')}]")
+    if tabla is None:
+        print("⚠️ Tabla de estadísticas no encontrada")
+        return None
+
+    nav, fecha, isin, variacion_1d = None, None, None, None
+    divisa = "ERROR"  # fallback inicial
+
+    # Un solo recorrido de las filas de la tabla: VL (fecha, divisa y valor), ISIN y cambio del día
+    for fila in tabla.iter("tr"):
+        celdas = fila.xpath(".//td")
+        if not celdas:
+            continue
+        etiqueta = texto_nodo(celdas[0])
+
+        if len(celdas) > 1 and "VL" in etiqueta.upper():
+            # Fecha en el <span class="heading"> de la etiqueta
+            fecha_tag = primero(celdas[0], f".//span[{con_clase('heading')}]")
+            if fecha_tag is not None:
+                try:
+                    fecha = datetime.strptime(texto_nodo(fecha_tag), "%d/%m/%Y").date().isoformat()
+                except ValueError:
+                    fecha = None
+
+            raw_texto = texto_nodo(celdas[1], " ").replace("\xa0", " ").strip()
+            divisa_fila, nav = _extraer_divisa_nav(raw_texto)
+            if divisa_fila:
+                divisa = divisa_fila
+            else:
+                print(f"⚠️ No se pudo extraer divisa y NAV de: {raw_texto}")
+
+        elif not isin and len(celdas) >= 3 and "ISIN" in etiqueta.upper():
+            posible_isin = texto_nodo(celdas[2]).upper()
+            if es_isin(posible_isin):
+                isin = posible_isin
+
+        elif variacion_1d is None and len(celdas) >= 2 and "Cambio del día" in etiqueta:
+            try:
+                variacion_1d = float(texto_nodo(celdas[-1]).replace("%", "").replace(",", "."))
+            except ValueError as e:
+                print(f"⚠️ Error al extraer variación diaria: {e}")
+
+    # Fallback para NAV si no hay fila de "VL": celda "line text" con divisa y valor
+    if nav is None:
+        for celda in tabla.xpath('.//td[@class="line text"]'):
+            if len(celda) or not celda.text or not re.search(r"[A-Z]{3}\s*[0-9]", celda.text):
+                continue
+            raw_texto = texto_nodo(celda, " ").replace("\xa0", " ").strip()
+            divisa_fila, nav = _extraer_divisa_nav(raw_texto)
+            if divisa_fila:
+                divisa = divisa_fila
+            else:
+                print(f"⚠️ Fallback: no se pudo extraer divisa y NAV de: {raw_texto}")
+            break
+
+    h1 = primero(arbol, "//h1")
+    nombre = h1.text_content().strip() if h1 is not None else "Fondo sin nombre"
+
+    if nav is None:
+        print("⚠️ No se pudo extraer NAV")
+        return None
+
+    return {
+        "nombre": nombre,
+        "isin": isin or "",
+        "nav": nav,
+        "fecha": fecha,
+        "divisa": divisa,
+        "fuente": "Morningstar.es",
+        "variacion_1d": variacion_1d
     }
-    guardar_cache(cache)
 
 def buscar_nav_morningstar(identificador: str) -> dict | None:
     print(f"🔍 Buscando NAV en Morningstar.es para: {identificador}")
     clave_cache = f"isin:{identificador}" if es_isin(identificador) else f"nombre:{identificador}"
-    cache = cargar_cache()
+    entrada = cache_db.leer_entrada(FUENTE_CACHE, clave_cache.lower())
 
-    if clave_cache in cache:
-        entrada = cache[clave_cache]
+    if entrada:
         try:
             fecha_guardado = datetime.fromisoformat(entrada["timestamp"])
             data = entrada["data"]
@@ -60,120 +147,29 @@ def buscar_nav_morningstar(identificador: str) -> dict | None:
         except Exception as e:
             print(f"⚠️ Error al interpretar timestamp: {e}")
 
-    query = quote(identificador)
-    url_busqueda = f"https://www.morningstar.es/es/funds/SecuritySearchResults.aspx?search={query}&type="
-
     try:
-        resp_busqueda = requests.get(url_busqueda, headers=HEADERS)
-        resp_busqueda.raise_for_status()
-        soup_busqueda = BeautifulSoup(resp_busqueda.text, "html.parser")
-        enlace = soup_busqueda.select_one("a[href*='/funds/snapshot/snapshot.aspx?id=']")
-        if not enlace:
+        url_fondo, desde_cache = resolver_url_morningstar(identificador)
+        if not url_fondo:
             print("❌ No se encontró enlace al fondo")
             return None
 
-        url_fondo = "https://www.morningstar.es" + enlace["href"]
         print(f"✅ Enlace preciso encontrado: {url_fondo}")
 
-        resp_fondo = requests.get(url_fondo, headers=HEADERS)
-        resp_fondo.raise_for_status()
-        soup = BeautifulSoup(resp_fondo.text, "html.parser")
-        tabla = soup.find("table", class_="overviewKeyStatsTable")
-        if not tabla:
-            print("⚠️ Tabla de estadísticas no encontrada")
+        resp_fondo = http_client.get_ficha(url_fondo, desde_cache, FUENTE_CACHE, identificador, resolver_url_morningstar)
+        if resp_fondo is None:
+            print("❌ No se encontró enlace al fondo")
             return None
-
-        nav, fecha, isin = None, None, None
-
-        divisa = "ERROR"  # fallback inicial
-        
-        for fila in tabla.find_all("tr"):
-            celdas = fila.find_all("td")
-            if not celdas:
-                continue
-            clave = celdas[0].get_text(strip=True).upper() if len(celdas) > 1 else ""
-            if "VL" in clave:
-                # Extraer fecha si está en un <span class="heading">
-                fecha_tag = celdas[0].find("span", class_="heading")
-                if fecha_tag:
-                    try:
-                        raw_fecha = fecha_tag.get_text(strip=True)
-                        fecha = datetime.strptime(raw_fecha, "%d/%m/%Y").date().isoformat()
-                    except:
-                        fecha = None
-
-                # Extraer divisa y valor
-                raw_texto = celdas[1].get_text(" ", strip=True).replace("\xa0", " ").strip()
-                match = re.search(r"([A-Z]{3})\s+([0-9]+[.,]?[0-9]*)", raw_texto)
-                if match:
-                    divisa = match.group(1)
-                    nav_str = match.group(2).replace(",", ".")
-                    try:
-                        nav = float(nav_str)
-                    except:
-                        nav = None
-                else:
-                    print(f"⚠️ No se pudo extraer divisa y NAV de: {raw_texto}")
-
-       
-        # Fallback para NAV si no hay fila de "VL"
-        if nav is None:
-            celda_nav = tabla.find("td", class_="line text", string=re.compile(r"[A-Z]{3}\s*[0-9]"))
-            if celda_nav:
-                raw_texto = celda_nav.get_text(" ", strip=True).replace("\xa0", " ").strip()
-                match = re.search(r"([A-Z]{3})\s+([0-9]+[.,]?[0-9]*)", raw_texto)
-                if match:
-                    divisa = match.group(1)
-                    nav_str = match.group(2).replace(",", ".")
-                    try:
-                        nav = float(nav_str)
-                    except:
-                        nav = None
-                else:
-                    print(f"⚠️ Fallback: no se pudo extraer divisa y NAV de: {raw_texto}")
-
-        # Fallback explícito para ISIN
-        if not isin:
-            for fila in tabla.find_all("tr"):
-                celdas = fila.find_all("td")
-                if len(celdas) >= 3 and "ISIN" in celdas[0].get_text(strip=True).upper():
-                    posible_isin = celdas[2].get_text(strip=True).upper()
-                    if es_isin(posible_isin):
-                        isin = posible_isin
-                        break
-
-        nombre = soup.find("h1").text.strip() if soup.find("h1") else "Fondo sin nombre"
-
-        # Extraer variación diaria (1 d%) con búsqueda contextual por fila "Cambio del día"
-        variacion_1d = None
-        try:
-            for fila in tabla.find_all("tr"):
-                celdas = fila.find_all("td")
-                if len(celdas) >= 2 and "Cambio del día" in celdas[0].get_text(strip=True):
-                    texto_var = celdas[-1].get_text(strip=True).replace("%", "").replace(",", ".")
-                    variacion_1d = float(texto_var)
-                    break
-        except Exception as e:
-            print(f"⚠️ Error al extraer variación diaria: {e}")
-        
-        if nav is None:
-            print("⚠️ No se pudo extraer NAV")
+        resp_fondo.raise_for_status()
+        resultado = parsear_ficha_morningstar(resp_fondo.text)
+        if not resultado:
             return None
-             
-        
-        resultado = {
-            "nombre": nombre,
-            "isin": isin or "",
-            "nav": nav,
-            "fecha": fecha,
-            "divisa": divisa,
-            "fuente": "Morningstar.es",
-            "variacion_1d": variacion_1d
-        }
 
         guardar_en_cache(clave_cache, resultado)
         return resultado
 
+    except http_client.ERRORES_PETICION:
+        # Fallo de red o del servidor: lo clasifica merge_nav_data (no es "fondo no encontrado")
+        raise
     except Exception as e:
         print(f"⚠️ Error al buscar fondo: {e}")
         return None
\ No newline at end of file
@@ -1,21 +1,14 @@
-import json
-import os
+from datetime import datetime
 from utils.merge_nav_data import merge_nav_data
+from utils import cache_db
 
-CACHE_NAV_REAL_PATH = os.path.join("data", "cache_nav_real.json")
+FUENTE_CACHE = "real"
 
 def actualizar_cache_isin(nombre, nuevo_isin):
-    """Actualiza el ISIN en el cache_nav_real.json, y lo complementa con datos reales si es posible."""
+    """Actualiza el ISIN en la caché de NAV combinada, y lo complementa con datos reales si es posible."""
 
     try:
-        # --- 1. Leer cache_nav_real ---
-        if os.path.exists(CACHE_NAV_REAL_PATH):
-            with open(CACHE_NAV_REAL_PATH, "r", encoding="utf-8") as f:
-                cache = json.load(f)
-        else:
-            cache = {}
-
-        # --- 2. Ejecutar merge_nav_data con el ISIN para obtener datos reales ---
+        # --- 1. Ejecutar merge_nav_data con el ISIN para obtener datos reales ---
         resultado = merge_nav_data(nuevo_isin.strip())
         if not resultado or not resultado.get("nav"):
             print(f"⚠️ No se pudo obtener NAV al actualizar cache para: {nuevo_isin}")
@@ -26,13 +19,12 @@ def actualizar_cache_isin(nombre, nuevo_isin):
         else:
             resultado["isin"] = nuevo_isin.strip()
             resultado["nombre"] = nombre
+            resultado["obtenido"] = datetime.now().isoformat(timespec="microseconds")
 
-        # --- 3. Guardar en cache bajo el nombre como clave ---
-        cache[nuevo_isin.strip()] = resultado
-        with open(CACHE_NAV_REAL_PATH, "w", encoding="utf-8") as f:
-            json.dump(cache, f, indent=2, ensure_ascii=False)
+        # --- 2. Guardar en cache bajo el ISIN como clave ---
+        cache_db.guardar_entrada(FUENTE_CACHE, nuevo_isin.strip(), resultado)
 
         print(f"✅ Cache NAV actualizado para {nombre} (ISIN: {nuevo_isin})")
 
     except Exception as e:
-        print(f"⚠️ Error actualizando cache_nav_real.json: {e}")
\ No newline at end of file
+        print(f"⚠️ Error actualizando la caché de NAV: {e}")
\ No newline at end of file
@@ -1,16 +1,36 @@
 import os
 import re
-import json
+import threading
 import streamlit as st
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from pathlib import Path
 from utils.merge_nav_data import merge_nav_data
+from utils import cache_db
+from utils.bloqueos import bloqueo_exclusivo
+from utils.calendario_nav import nav_expirado
+from utils.historial_nav import registrar_observaciones_nav
 
 
-CACHE_PATH = Path("data/cache_nav_real.json")
-CACHE_PATH.parent.mkdir(exist_ok=True, parents=True)
+# Entradas combinadas (merge de fuentes) dentro de la caché unificada SQLite
+FUENTE_CACHE = "real"
 
-CACHE_TTL_HORAS = 24
+# Scrapeos simultáneos en las consultas por lotes (cada uno abre a su vez las 3 fuentes)
+MAX_SCRAPEOS_CONCURRENTES = 4
+
+# Refresco en segundo plano (stale-while-revalidate): pool compartido por todas las
+# sesiones de Streamlit del proceso y ISINs que se están actualizando ahora mismo
+MAX_REFRESCOS_SEGUNDO_PLANO = 2
+_EXECUTOR_REFRESCO = ThreadPoolExecutor(max_workers=MAX_REFRESCOS_SEGUNDO_PLANO, thread_name_prefix="nav_refresco")
+_EN_REFRESCO = set()
+_REFRESCO_LOCK = threading.Lock()
+
+# Single-flight: scrapeos en curso en este proceso por identificador normalizado.
+# Las llamadas concurrentes para el mismo identificador esperan al mismo Future.
+_EN_VUELO = {}
+_VUELO_LOCK = threading.Lock()
+
+# Espera máxima por el lock entre procesos de un identificador antes de scrapear igualmente
+BLOQUEO_TIMEOUT_SEG = 120
 
 def es_isin(valor):
     return isinstance(valor, str) and re.fullmatch(r"[A-Z]{2}[A-Z0-9]{10}", valor.strip())
@@ -60,50 +80,51 @@ def validar_isin_vs_nombre(df):
             pas
 
 def cargar_cache_nav():
-    if CACHE_PATH.exists():
-        with open(CACHE_PATH, "r", encoding="utf-8") as f:
-            base = json.load(f)
-        # 🔁 Añadir clave por nombre explícitamente si no existe
-        extendido = dict(base)
-        for val in base.values():
-            nombre = val.get("nombre")
-            if nombre and nombre not in extendido:
-                extendido[nombre] = val
-        return extendido
-    return {}
+    """Todas las entradas de la caché combinada. Para buscar por nombre usar buscar_nav_en_cache."""
+    return {clave: entrada["data"] for clave, entrada in cache_db.leer_fuente(FUENTE_CACHE).items()}
 
 def guardar_cache_nav(cache):
-    with open(CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(cache, f, indent=2, ensure_ascii=False)
+    """Upsert de todas las entradas de `cache` en una única transacción."""
+    cache_db.guardar_entradas(FUENTE_CACHE, cache)
 
-def get_nav_real(nombre_o_isin, forzar=False):
-    """Devuelve los datos de NAV (nav, fecha, divisa, variación, etc.) a partir del nombre o ISIN del activo."""
-    nombre_o_isin = nombre_o_isin.strip()
-    cache = cargar_cache_nav()
+def actualizar_cache_nav(entradas):
+    """
+    Inserta o actualiza solo `entradas`. Al ser un upsert por clave, no pisa lo que
+    otro hilo o sesión haya guardado mientras se scrapeaba.
+    """
+    cache_db.guardar_entradas(FUENTE_CACHE, entradas)
 
-    import inspect
-    if not nombre_o_isin.startswith("IE") and "Seilern" in nombre_o_isin:
-        print(f"\n🧭 get_nav_real llamado con: '{nombre_o_isin}'")
-        for f in inspect.stack()[1:4]:
-            print(f"↪️ llamado desde {f.function} en {f.filename}:{f.lineno}")
+def buscar_nav_en_cache(nombre_o_isin, subcadena=True):
+    """
+    Busca datos de NAV válidos por clave, ISIN o nombre usando el índice de alias
+    de la caché: clave exacta → alias normalizado (nombre, ISIN, SINISIN-*) →
+    subcadena del nombre vía trigramas (si `subcadena`). Devuelve None si no hay.
+    """
+    entrada = cache_db.leer_entrada(FUENTE_CACHE, nombre_o_isin)
+    if entrada and entrada["data"].get("nav") is not None:
+        return entrada["data"]
 
-    # Si no se fuerza, intentar usar caché
-    if not forzar:
-        if es_isin(nombre_o_isin):
-            if nombre_o_isin in cache and cache[nombre_o_isin].get("nav") is not None:
-                return cache[nombre_o_isin]
-            for datos in cache.values():
-                if datos.get("isin", "").upper() == nombre_o_isin.upper() and datos.get("nav") is not None:
-                    return datos
+    isin = nombre_o_isin.upper() if es_isin(nombre_o_isin) else cache_db.resolver_alias(FUENTE_CACHE, nombre_o_isin)
+    if isin:
+        entrada = cache_db.buscar_por_isin(FUENTE_CACHE, isin, con_nav=True)
+        if entrada:
+            return entrada["data"]
 
-        if nombre_o_isin in cache and cache[nombre_o_isin].get("nav") is not None:
-            return cache[nombre_o_isin]
+    if not subcadena:
+        return None
 
-        for datos in cache.values():
-            if nombre_o_isin.lower() in datos.get("nombre", "").lower() and datos.get("nav") is not None:
-                return datos
+    for isin in cache_db.buscar_alias_por_subcadena(FUENTE_CACHE, nombre_o_isin):
+        entrada = cache_db.buscar_por_isin(FUENTE_CACHE, isin, con_nav=True)
+        if entrada:
+            return entrada["data"]
 
-    # Si no hay datos válidos o se ha forzado, hacer scraping
+    return None
+
+def scrapear_nav(nombre_o_isin):
+    """
+    Obtiene los datos combinados de las fuentes online y normaliza el ISIN.
+    No toca la caché: devuelve el resultado o None si no hay NAV.
+    """
     resultado = merge_nav_data(nombre_o_isin)
     if not resultado or not resultado.get("nav"):
         print(f"⛔ No se pudo obtener NAV para: {nombre_o_isin}")
@@ -115,53 +136,241 @@ def get_nav_real(nombre_o_isin, forzar=False):
         isin = f"SINISIN-{nombre_o_isin[:8].upper().replace(' ', '')}"
     resultado["isin"] = isin
     resultado.setdefault("nombre", nombre_o_isin)
+    # Momento del scrapeo, independiente de la fecha del NAV publicado. Con microsegundos:
+    # _refrescar_con_bloqueo lo compara con el momento en que empezó a esperar el lock
+    resultado["obtenido"] = datetime.now().isoformat(timespec="microseconds")
+    return resultado
+
+def guardar_en_historico(resultados):
+    """
+    Acumula en el histórico diario los NAV recién scrapeados (en un único lote).
+    Solo los que tienen ISIN real, NAV y fecha validados por merge_nav_data.
+    Un fallo aquí no afecta a la consulta: el NAV ya está en la caché.
+    """
+    observaciones = [
+        r for r in resultados
+        if r and es_isin(r.get("isin")) and r.get("nav") is not None and r.get("fecha")
+    ]
+    if not observaciones:
+        return
+    try:
+        registrar_observaciones_nav(observaciones)
+    except Exception as e:
+        print(f"⚠️ No se pudo actualizar el histórico NAV: {e}")
+
+def _refrescar_con_bloqueo(nombre_o_isin):
+    """
+    Scrapea y guarda en caché bajo el lock entre procesos del identificador. Si
+    mientras se esperaba el lock otro proceso ya lo refrescó, se reutiliza su dato.
+    """
+    inicio = datetime.now()
+    with bloqueo_exclusivo(f"nav_{nombre_o_isin.lower()}", timeout=BLOQUEO_TIMEOUT_SEG) as adquirido:
+        if not adquirido:
+            print(f"⚠️ Lock de {nombre_o_isin} no obtenido en {BLOQUEO_TIMEOUT_SEG}s → se scrapea igualmente")
+
+        entrada = cache_db.leer_entrada(FUENTE_CACHE, nombre_o_isin)
+        obtenido = entrada and entrada["data"].get("obtenido")
+        if obtenido and datetime.fromisoformat(obtenido) >= inicio:
+            print(f"🔒 {nombre_o_isin} refrescado por otro proceso mientras se esperaba")
+            return entrada["data"]
+
+        resultado = scrapear_nav(nombre_o_isin)
+        if resultado:
+            actualizar_cache_nav({resultado["isin"]: resultado, nombre_o_isin: resultado})
+        return resultado
+
+def refrescar_nav(nombre_o_isin):
+    """
+    Scrapea `nombre_o_isin` y actualiza la caché, compartiendo el trabajo con
+    cualquier otra petición del mismo identificador: dentro del proceso las
+    llamadas concurrentes esperan al mismo scrapeo (single-flight) y entre
+    procesos un lock por identificador evita refrescos duplicados.
+    Devuelve los datos o None.
+    """
+    nombre_o_isin = nombre_o_isin.strip()
+    clave = nombre_o_isin.lower()
+    with _VUELO_LOCK:
+        futuro = _EN_VUELO.get(clave)
+        lider = futuro is None
+        if lider:
+            futuro = _EN_VUELO[clave] = Future()
+
+    if not lider:
+        print(f"⏳ {nombre_o_isin} ya se está scrapeando en este proceso → se espera al resultado")
+        return futuro.result()
+
+    try:
+        resultado = _refrescar_con_bloqueo(nombre_o_isin)
+        futuro.set_result(resultado)
+        return resultado
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with _VUELO_LOCK:
+            _EN_VUELO.pop(clave, None)
+
+def get_nav_real(nombre_o_isin, forzar=False):
+    """Devuelve los datos de NAV (nav, fecha, divisa, variación, etc.) a partir del nombre o ISIN del activo."""
+    nombre_o_isin = nombre_o_isin.strip()
+
+    import inspect
+    if not nombre_o_isin.startswith("IE") and "Seilern" in nombre_o_isin:
+        print(f"\n🧭 get_nav_real llamado con: '{nombre_o_isin}'")
+        for f in inspect.stack()[1:4]:
+            print(f"↪️ llamado desde {f.function} en {f.filename}:{f.lineno}")
+
+    # Si no se fuerza, intentar usar caché
+    if not forzar:
+        datos = buscar_nav_en_cache(nombre_o_isin)
+        if datos:
+            return datos
 
-    # Guardar en caché por ISIN y por nombre
-    cache[isin] = resultado
-    cache[nombre_o_isin] = resultado
-    guardar_cache_nav(cache)
+    # Si no hay datos válidos o se ha forzado, hacer scraping (guarda por ISIN y por nombre)
+    resultado = refrescar_nav(nombre_o_isin)
+    if not resultado:
+        return None
+    guardar_en_historico([resultado])
 
-    print(f"📦 NAV cacheado: {nombre_o_isin} → {isin}")
+    print(f"📦 NAV cacheado: {nombre_o_isin} → {resultado['isin']}")
     return resultado
 
-def refrescar_navs_si_expirados(df, forzar=False):
+def get_nav_real_many(identificadores):
     """
-    Revisa los ISIN en el DataFrame y actualiza su NAV si ha expirado,
-    o siempre si se fuerza el refresco.
+    Versión por lotes de get_nav_real: resuelve los aciertos con consultas indexadas a la
+    caché y scrapea los fallos en paralelo con refrescar_nav, que comparte el scrapeo
+    con otras sesiones o procesos que pidan el mismo identificador.
+
+    Cada elemento de `identificadores` puede ser un nombre/ISIN o una tupla de alternativas
+    que se prueban en orden, equivalente a `get_nav_real(isin) or get_nav_real(nombre)`.
+    Devuelve una lista alineada con la entrada con los datos de NAV o None.
     """
-    cache = cargar_cache_nav()
+    candidatos = []
+    for item in identificadores:
+        alternativas = item if isinstance(item, (list, tuple)) else (item,)
+        candidatos.append([a.strip() for a in alternativas if isinstance(a, str) and a.strip()])
+
+    resultados = [None] * len(candidatos)
+    scrapeados = {}
+
+    # Cada ronda prueba la siguiente alternativa de los elementos aún sin resolver
+    for ronda in range(max((len(c) for c in candidatos), default=0)):
+        pendientes = {}
+        for i, alternativas in enumerate(candidatos):
+            if resultados[i] is not None or ronda >= len(alternativas):
+                continue
+            ident = alternativas[ronda]
+            datos = buscar_nav_en_cache(ident)
+            if datos:
+                resultados[i] = datos
+            elif ident in scrapeados:
+                resultados[i] = scrapeados[ident]
+            else:
+                pendientes.setdefault(ident, []).append(i)
+
+        if not pendientes:
+            continue
+
+        print(f"🌐 Scrapeando {len(pendientes)} NAVs no cacheados: {list(pendientes)}")
+        with ThreadPoolExecutor(max_workers=MAX_SCRAPEOS_CONCURRENTES) as executor:
+            obtenidos = dict(zip(pendientes, executor.map(refrescar_nav, pendientes)))
+
+        for ident, resultado in obtenidos.items():
+            scrapeados[ident] = resultado
+            if not resultado:
+                continue
+            for i in pendientes[ident]:
+                resultados[i] = resultado
+
+    if any(scrapeados.values()):
+        print(f"📦 {sum(1 for r in scrapeados.values() if r)} NAVs cacheados en lote")
+        guardar_en_historico(scrapeados.values())
+
+    return resultados
+
+def isins_a_refrescar(df, forzar=False):
+    """
+    Devuelve los ISIN del DataFrame cuyo NAV en caché falta o puede haber sido
+    superado por una publicación nueva según el calendario de su domicilio,
+    o todos si se fuerza el refresco.
+    """
+    cache = cache_db.leer_fuente(FUENTE_CACHE)
     ahora = datetime.now()
     isins = df["ISIN"].dropna().unique()
+    expirados = []
 
     for isin in isins:
         if not es_isin(isin):
             continue
 
-        datos = cache.get(isin)
+        entrada = cache.get(isin)
 
         # 🔁 Si no hay datos o forzamos, refrescamos sin más
-        if not datos or forzar:
-            motivo = "no está en caché" if not datos else "refresco forzado"
+        if not entrada or forzar:
+            motivo = "no está en caché" if not entrada else "refresco forzado"
             print(f"🔄 ISIN {isin} → {motivo} → actualizando...")
-            get_nav_real(isin, forzar=True)
+            expirados.append(isin)
             continue
 
-        # ⏳ Validar timestamp y decidir si refrescar
-        fecha_str = datos.get("fecha")
+        # ⏳ La fecha del NAV dice cuándo puede haber uno nuevo; el momento del scrapeo
+        # evita repetirlo mientras la gestora no lo haya publicado. Las entradas antiguas
+        # sin "obtenido" (p. ej. migradas del JSON) no lo tienen fiable y se tratan como desconocido.
+        datos = entrada["data"]
         try:
-            fecha_obj = datetime.fromisoformat(fecha_str)
-            segundos = (ahora - fecha_obj).total_seconds()
-            expirado = segundos > CACHE_TTL_HORAS * 3600
+            obtenido = datetime.fromisoformat(datos["obtenido"]) if datos.get("obtenido") else None
+            expirado, motivo = nav_expirado(datos, obtenido, ahora)
 
             if expirado:
-                print(f"⏳ ISIN {isin} con NAV expirado ({fecha_str}) → actualizando...")
-                get_nav_real(isin, forzar=True)
+                print(f"⏳ ISIN {isin} con NAV expirado ({motivo}) → actualizando...")
+                expirados.append(isin)
             else:
-                minutos = int(segundos / 60)
-                print(f"✅ ISIN {isin} con NAV reciente ({minutos} min de antigüedad)")
+                print(f"✅ ISIN {isin} con NAV vigente ({motivo})")
         except Exception as e:
             print(f"⚠️ Fecha inválida en caché para {isin}: {e} → forzando actualización")
-            get_nav_real(isin, forzar=True)
+            expirados.append(isin)
+
+    return expirados
+
+def refrescar_navs_si_expirados(df, forzar=False):
+    """
+    Revisa los ISIN en el DataFrame y actualiza su NAV si ha expirado,
+    o siempre si se fuerza el refresco. Bloquea hasta terminar.
+    """
+    for isin in isins_a_refrescar(df, forzar=forzar):
+        get_nav_real(isin, forzar=True)
+
+def _refrescar_isin_en_segundo_plano(isin):
+    try:
+        resultado = refrescar_nav(isin)
+        if resultado:
+            guardar_en_historico([resultado])
+            print(f"📦 NAV refrescado en segundo plano: {isin}")
+    except Exception as e:
+        print(f"⚠️ Error refrescando {isin} en segundo plano: {e}")
+    finally:
+        with _REFRESCO_LOCK:
+            _EN_REFRESCO.discard(isin)
+
+def refrescar_navs_en_segundo_plano(df, forzar=False):
+    """
+    Variante stale-while-revalidate de refrescar_navs_si_expirados: encola los ISIN
+    expirados en un worker de fondo y vuelve inmediatamente. La página sigue
+    mostrando los valores cacheados y el siguiente rerun recoge los nuevos.
+    Devuelve el conjunto de ISIN que se están refrescando.
+    """
+    for isin in isins_a_refrescar(df, forzar=forzar):
+        with _REFRESCO_LOCK:
+            if isin in _EN_REFRESCO:
+                continue
+            _EN_REFRESCO.add(isin)
+        _EXECUTOR_REFRESCO.submit(_refrescar_isin_en_segundo_plano, isin)
+
+    return isins_en_refresco()
+
+def isins_en_refresco():
+    """Devuelve los ISIN cuyo refresco en segundo plano sigue en curso."""
+    with _REFRESCO_LOCK:
+        return set(_EN_REFRESCO)
 
 # # Función anterior mantenida como fallback
 # import random
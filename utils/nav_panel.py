@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils import nav_store
+from utils.bloqueos import bloqueo_exclusivo
+from utils.config import NAV_HISTORICO_DIR
+
+# Panel consolidado de NAVs: una matriz (días naturales × ISIN) mapeada en memoria que
+# comparten sin copias todas las sesiones y procesos, en lugar de que cada uno monte
+# su propio DataFrame largo con pd.concat.
+#   data/nav_historico/_panel/indice.json       eje de fechas, ISINs y firma de cada histórico
+#   data/nav_historico/_panel/precios-{gen}.f8  precio as-of (forward-fill) por día e ISIN
+#   data/nav_historico/_panel/fechas-{gen}.i4   fecha de la observación usada (días desde 1970)
+# El eje es de días naturales: cada observación ocupa su propia fila, también las de
+# fin de semana o festivo, así que ninguna se pierde ni se adelanta.
+# Las matrices están en orden Fortran: cada ISIN es un bloque contiguo y al cambiar un
+# histórico solo se reescribe su columna. El eje de fechas y el número de columnas
+# tienen holgura para que el paso de los días o un ISIN nuevo no obliguen a regenerarlo todo.
+# El panel sirve las series diarias de rentabilidad (navs_diarios); las consultas as-of
+# puntuales van por utils.precios_asof.
+
+PANEL_DIR = "_panel"
+HOLGURA_DIAS = 90
+# Formato del panel en disco; un índice de otra versión se regenera
+VERSION_PANEL = 2
+HOLGURA_ISINS = 32
+
+# Cada cuánto comprueba un proceso si algún histórico ha cambiado
+COMPROBACION_SEG = 10
+
+SIN_OBSERVACION = np.iinfo(np.int32).min
+
+_paneles = {}
+_PANELES_LOCK = threading.Lock()
+
+
+def ruta_panel(directorio=None):
+    return Path(directorio if directorio is not None else NAV_HISTORICO_DIR) / PANEL_DIR
+
+
+def _leer_indice(carpeta):
+    try:
+        with open(carpeta / "indice.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _guardar_indice(carpeta, indice):
+    temporal = carpeta / f".indice-{uuid.uuid4().hex[:6]}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(indice, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, carpeta / "indice.json")
+
+
+def _eje(indice):
+    """Eje de días naturales del panel como datetime64[D]."""
+    return np.datetime64(indice["inicio"], "D") + np.arange(indice["n_fechas"])
+
+
+def _abrir(carpeta, indice, modo="r"):
+    forma = (indice["n_fechas"], indice["capacidad"])
+    precios = np.memmap(carpeta / f"precios-{indice['generacion']}.f8", dtype="float64", mode=modo, shape=forma, order="F")
+    fechas = np.memmap(carpeta / f"fechas-{indice['generacion']}.i4", dtype="int32", mode=modo, shape=forma, order="F")
+    return precios, fechas
+
+
+def _columna(isin, eje, directorio=None):
+    """Precios y fechas de observación de un ISIN sobre el eje, con forward-fill."""
+    precios = np.full(len(eje), np.nan)
+    fechas = np.full(len(eje), SIN_OBSERVACION, dtype="int32")
+
+    df = nav_store.leer(isin, columnas=["Price"], directorio=directorio).dropna(subset=["Price"])
+    if df.empty:
+        return precios, fechas
+
+    dias = df["Date"].values.astype("datetime64[D]")
+    # El almacén no repite fechas: cada observación cae en una fila distinta del eje
+    posiciones = (dias - eje[0]).astype("int64")
+    dentro = (posiciones >= 0) & (posiciones < len(eje))
+    precios[posiciones[dentro]] = df["Price"].values[dentro]
+    fechas[posiciones[dentro]] = dias[dentro].astype("int64")
+
+    ultima = np.where(fechas != SIN_OBSERVACION, np.arange(len(eje)), -1)
+    np.maximum.accumulate(ultima, out=ultima)
+    hay = ultima >= 0
+    return np.where(hay, precios[ultima], np.nan), np.where(hay, fechas[ultima], SIN_OBSERVACION).astype("int32")
+
+
+def _regenerar(carpeta, isins, firmas, directorio=None):
+    """Crea una generación nueva del panel con todos los ISIN y la publica en el índice."""
+    rangos = [nav_store.rango_fechas(isin, directorio) for isin in isins]
+    primeras = [r[0] for r in rangos if r[0] is not None]
+    ultimas = [r[1] for r in rangos if r[1] is not None]
+    inicio = min(primeras).date() if primeras else date.today()
+    fin = max([u.date() for u in ultimas] + [date.today()])
+
+    indice = {
+        "version": VERSION_PANEL,
+        "generacion": f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}",
+        "inicio": str(inicio),
+        "n_fechas": (fin - inicio).days + 1 + HOLGURA_DIAS,
+        "capacidad": len(isins) + HOLGURA_ISINS,
+        "isins": list(isins),
+        "firmas": {},
+    }
+    eje = _eje(indice)
+    precios, fechas = _abrir(carpeta, indice, modo="w+")
+    precios[:] = np.nan
+    fechas[:] = SIN_OBSERVACION
+    for j, isin in enumerate(isins):
+        precios[:, j], fechas[:, j] = _columna(isin, eje, directorio)
+        indice["firmas"][isin] = firmas[isin]
+    precios.flush()
+    fechas.flush()
+    del precios, fechas
+
+    indice["actualizado"] = datetime.now().isoformat(timespec="seconds")
+    _guardar_indice(carpeta, indice)
+
+    # Generaciones viejas: en Windows pueden seguir mapeadas por otro proceso; se reintenta en la siguiente
+    for archivo in carpeta.glob("*-*.*"):
+        if archivo.suffix in (".f8", ".i4") and indice["generacion"] not in archivo.name:
+            try:
+                archivo.unlink()
+            except OSError:
+                pass
+
+    print(f"🧮 Panel NAV regenerado: {len(isins)} ISINs × {indice['n_fechas']} días")
+    return indice
+
+
+def actualizar_panel(directorio=None):
+    """
+    Pone el panel al día con el almacén. Solo se recalculan las columnas de los ISIN
+    cuyo histórico ha cambiado; se regenera entero si el eje de fechas se queda corto,
+    no caben los ISIN nuevos o desaparece alguno. Devuelve el índice vigente.
+    """
+    carpeta = ruta_panel(directorio)
+    carpeta.mkdir(parents=True, exist_ok=True)
+
+    with bloqueo_exclusivo(f"nav_panel_{carpeta.resolve()}"):
+        isins = nav_store.listar_isins(directorio)
+        firmas = {isin: nav_store.firma(isin, directorio) for isin in isins}
+        indice = _leer_indice(carpeta)
+        if indice is None or indice.get("version") != VERSION_PANEL:
+            return _regenerar(carpeta, isins, firmas, directorio)
+
+        eje = _eje(indice)
+        cambiados = [isin for isin in isins if indice["firmas"].get(isin) != firmas[isin]]
+        hoy = np.datetime64(date.today(), "D")
+        if not cambiados and hoy <= eje[-1]:
+            return indice
+
+        nuevos = [isin for isin in cambiados if isin not in indice["isins"]]
+        rangos = [nav_store.rango_fechas(isin, directorio) for isin in cambiados]
+        fuera_de_eje = any(
+            primera is not None and (primera.to_datetime64() < eje[0] or ultima.to_datetime64() > eje[-1])
+            for primera, ultima in rangos
+        )
+        if (
+            hoy > eje[-1]
+            or fuera_de_eje
+            or set(indice["isins"]) - set(isins)
+            or len(indice["isins"]) + len(nuevos) > indice["capacidad"]
+        ):
+            return _regenerar(carpeta, isins, firmas, directorio)
+
+        precios, fechas = _abrir(carpeta, indice, modo="r+")
+        for isin in cambiados:
+            if isin in nuevos:
+                indice["isins"].append(isin)
+            j = indice["isins"].index(isin)
+            precios[:, j], fechas[:, j] = _columna(isin, eje, directorio)
+            indice["firmas"][isin] = firmas[isin]
+        precios.flush()
+        fechas.flush()
+        del precios, fechas
+
+        indice["actualizado"] = datetime.now().isoformat(timespec="seconds")
+        _guardar_indice(carpeta, indice)
+        print(f"🧮 Panel NAV actualizado: {len(cambiados)} ISINs ({', '.join(cambiados)})")
+        return indice
+
+
+def obtener_panel(directorio=None):
+    """
+    Vista de solo lectura del panel (memmap compartido) para este proceso. Como mucho
+    cada COMPROBACION_SEG se comprueba si hay históricos nuevos o cambiados.
+    Devuelve dict con eje (datetime64[D]), isins, columnas {isin: j}, precios y fechas.
+    """
+    carpeta = ruta_panel(directorio)
+    clave = str(carpeta)
+    with _PANELES_LOCK:
+        panel = _paneles.get(clave)
+        if panel is None or time.monotonic() - panel["comprobado"] > COMPROBACION_SEG:
+            indice = actualizar_panel(directorio)
+            if panel is None or panel["indice"] != indice:
+                precios, fechas = _abrir(carpeta, indice)
+                panel = {
+                    "indice": indice,
+                    "eje": _eje(indice),
+                    "isins": list(indice["isins"]),
+                    "columnas": {isin: j for j, isin in enumerate(indice["isins"])},
+                    "precios": precios,
+                    "fechas": fechas,
+                }
+            panel["comprobado"] = time.monotonic()
+            _paneles[clave] = panel
+        return panel
+
+
+def navs_diarios(isins, hasta, directorio=None):
+    """
+    Serie diaria (naturales) con forward-fill de cada ISIN desde su primer NAV hasta
+    `hasta`, en formato largo Fecha / ISIN / Price, leída del panel sin concatenar frames.
+    """
+    panel = obtener_panel(directorio)
+    hasta = np.datetime64(pd.Timestamp(hasta).date(), "D")
+    fechas, etiquetas, precios = [], [], []
+
+    for isin in isins:
+        j = panel["columnas"].get(isin)
+        if j is None:
+            continue
+        observadas = panel["fechas"][:, j]
+        hay = np.flatnonzero(observadas != SIN_OBSERVACION)
+        if not len(hay):
+            continue
+        primera = np.datetime64(int(observadas[hay[0]]), "D")
+        dias = np.arange(primera, hasta + 1, dtype="datetime64[D]")
+        filas = np.searchsorted(panel["eje"], dias, side="right") - 1
+        valores = np.where(filas >= 0, panel["precios"][np.maximum(filas, 0), j], np.nan)
+        fechas.append(dias)
+        precios.append(valores)
+        etiquetas.append(np.full(len(dias), isin, dtype=object))
+
+    if not fechas:
+        return pd.DataFrame(columns=["Fecha", "ISIN", "Price"])
+    df = pd.DataFrame({
+        "Fecha": np.concatenate(fechas).astype("datetime64[ns]"),
+        "ISIN": np.concatenate(etiquetas),
+        "Price": np.concatenate(precios),
+    })
+    return df.dropna(subset=["Price"]).reset_index(drop=True)
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.bloqueos import bloqueo_exclusivo
+from utils.config import NAV_HISTORICO_DIR
+
+# Almacén columnar de los históricos NAV.
+#   data/nav_historico/{ISIN}/part-*.parquet
+# Cada ISIN es un directorio con uno o varios ficheros Parquet tipados (Date como
+# fecha nativa, precios y Change % como float64). Añadir filas crea una parte nueva
+# en vez de reescribir el histórico; si hay demasiadas partes se compactan en una.
+#
+# El CSV de Investing.com sigue siendo el formato de importación/exportación. Los
+# {ISIN}.csv que haya en data/nav_historico se migran al almacén con migrar_csvs
+# (python -m utils.nav_store, o al arrancar la app). El CSV original no se toca (puede
+# estar versionado): la migración queda anotada en {ISIN}/origen_csv.json con el hash
+# del CSV, y solo se vuelve a importar si cambia. Las lecturas nunca migran ni escriben.
+#
+# Las escrituras de un ISIN deben hacerse bajo bloqueo_exclusivo(clave_bloqueo(isin)).
+#
+# Los históricos leídos se guardan en una caché LRU del proceso (compartida por todas
+# las sesiones de Streamlit), validada con el nombre, mtime y tamaño de cada parte: si
+# algún fichero cambia, aparece o desaparece, la entrada se vuelve a leer. La misma
+# entrada guarda los arrays de búsqueda as-of del ISIN (serie_precios), que cuentan
+# para el límite de memoria y caducan con el histórico.
+
+COLUMNAS = ["Date", "Price", "Open", "High", "Low", "Change %"]
+COLUMNAS_NUMERICAS = COLUMNAS[1:]
+ESQUEMA = pa.schema([("Date", pa.date32())] + [(col, pa.float64()) for col in COLUMNAS_NUMERICAS])
+
+# Partes por ISIN a partir de las cuales una escritura compacta el histórico
+MAX_PARTES = 16
+
+# Registro de la migración desde {ISIN}.csv, dentro de la carpeta del ISIN
+ORIGEN_CSV = "origen_csv.json"
+
+# Memoria máxima de la caché de históricos leídos
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_estadisticas_cache = {"aciertos": 0, "fallos": 0, "invalidaciones": 0, "expulsiones": 0}
+_CACHE_LOCK = threading.Lock()
+
+
+def _base(directorio=None):
+    return Path(directorio) if directorio is not None else NAV_HISTORICO_DIR
+
+
+def clave_bloqueo(isin):
+    return f"historico_{isin}"
+
+
+def ruta_isin(isin, directorio=None):
+    return _base(directorio) / isin
+
+
+def partes(isin, directorio=None):
+    """Ficheros Parquet del ISIN, del más antiguo al más reciente."""
+    carpeta = ruta_isin(isin, directorio)
+    if not carpeta.is_dir():
+        return []
+    return sorted(carpeta.glob("part-*.parquet"))
+
+
+def firma(isin, directorio=None):
+    """
+    Huella del contenido del histórico: las partes son inmutables y con nombre único,
+    así que basta con sus nombres (sin abrir los ficheros). None si no hay histórico.
+    """
+    archivos = partes(isin, directorio)
+    if not archivos:
+        return None
+    return hashlib.sha1("|".join(a.name for a in archivos).encode("utf-8")).hexdigest()[:16]
+
+
+def vacio(columnas=None):
+    df = pd.DataFrame({col: pd.Series(dtype="float64") for col in (columnas or COLUMNAS)})
+    if "Date" in df.columns:
+        df["Date"] = pd.Series(dtype="datetime64[ms]")
+    return df
+
+
+def normalizar(df):
+    """
+    DataFrame con las columnas estándar tipadas: Date como datetime (sin hora) y el
+    resto como float. Acepta los CSV guardados por la app (Change % con o sin "%").
+    Descarta filas sin fecha válida.
+    """
+    df = df.copy()
+    df.columns = [str(col).strip() for col in df.columns]
+    for col in COLUMNAS:
+        if col not in df.columns:
+            df[col] = None
+
+    fechas = df["Date"]
+    if not pd.api.types.is_datetime64_any_dtype(fechas):
+        fechas = pd.to_datetime(fechas.astype(str).str.strip().str[:10], format="%Y-%m-%d", errors="coerce")
+    df["Date"] = fechas.dt.normalize()
+
+    for col in COLUMNAS_NUMERICAS:
+        if not pd.api.types.is_float_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace("%", "", regex=False).str.strip(), errors="coerce")
+        df[col] = df[col].astype("float64")
+
+    return df.dropna(subset=["Date"])[COLUMNAS].reset_index(drop=True)
+
+
+def _escribir_parte(isin, df, directorio=None):
+    """Escribe `df` como una parte nueva (fichero temporal + rename: nunca queda a medias)."""
+    carpeta = ruta_isin(isin, directorio)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    nombre = f"part-{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:6]}.parquet"
+    tabla = pa.Table.from_pandas(normalizar(df), schema=ESQUEMA, preserve_index=False)
+    temporal = carpeta / f".{nombre}.tmp"
+    pq.write_table(tabla, temporal)
+    os.replace(temporal, carpeta / nombre)
+    return carpeta / nombre
+
+
+def _huella(archivos):
+    """(nombre, mtime, tamaño) de cada parte, o None si alguna ha desaparecido."""
+    huella = []
+    for archivo in archivos:
+        try:
+            estado = archivo.stat()
+        except FileNotFoundError:
+            return None
+        huella.append((archivo.name, estado.st_mtime_ns, estado.st_size))
+    return tuple(huella)
+
+
+def _leer_partes(archivos):
+    """Histórico completo a partir de sus partes. Si una fecha está en varias prevalece la más antigua."""
+    tablas = []
+    for archivo in archivos:
+        try:
+            tablas.append(pq.read_table(archivo, schema=ESQUEMA))
+        except FileNotFoundError:
+            # Compactado por otro proceso mientras se leía: la parte nueva ya tiene sus filas
+            continue
+
+    df = pa.concat_tables(tablas).to_pandas(date_as_object=False) if tablas else vacio()
+    if len(tablas) > 1:
+        df = df.drop_duplicates(subset=["Date"], keep="first")
+    return df.sort_values("Date", kind="stable").reset_index(drop=True)
+
+
+def _leer_con_cache(isin, archivos, directorio=None):
+    global _cache_bytes
+    clave = str(ruta_isin(isin, directorio))
+    huella = _huella(archivos)
+    with _CACHE_LOCK:
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada[0] == huella:
+            _cache.move_to_end(clave)
+            _estadisticas_cache["aciertos"] += 1
+            return entrada[1]
+        _estadisticas_cache["fallos"] += 1
+        if entrada is not None:
+            _estadisticas_cache["invalidaciones"] += 1
+
+    df = _leer_partes(archivos)
+    if huella is None:
+        return df
+
+    tamano = int(df.memory_usage(deep=True).sum())
+    with _CACHE_LOCK:
+        anterior = _cache.pop(clave, None)
+        if anterior is not None:
+            _cache_bytes -= anterior[2]
+        # (huella, histórico, bytes, serie as-of calculada al pedirla)
+        _cache[clave] = (huella, df, tamano, None)
+        _cache_bytes += tamano
+        while _cache_bytes > MAX_CACHE_BYTES and len(_cache) > 1:
+            _, (_, _, liberados, _) = _cache.popitem(last=False)
+            _cache_bytes -= liberados
+            _estadisticas_cache["expulsiones"] += 1
+    return df
+
+
+def serie_precios(isin, directorio=None):
+    """
+    (días desde 1970 como int64, precios) del ISIN, ordenados y sin precios vacíos: la
+    forma que usan las búsquedas as-of de utils.precios_asof. Se calcula una vez por
+    versión del histórico y se guarda en su entrada de la caché.
+    """
+    global _cache_bytes
+    archivos = partes(isin, directorio)
+    if not archivos:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="float64")
+
+    df = _leer_con_cache(isin, archivos, directorio)
+    clave = str(ruta_isin(isin, directorio))
+    with _CACHE_LOCK:
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada[1] is df and entrada[3] is not None:
+            return entrada[3]
+
+    precios = df["Price"].to_numpy(dtype="float64")
+    validos = ~np.isnan(precios)
+    serie = (df["Date"].values[validos].astype("datetime64[D]").astype("int64"), precios[validos])
+    for array in serie:
+        array.flags.writeable = False  # compartidos entre llamadas a través de la caché
+
+    with _CACHE_LOCK:
+        entrada = _cache.get(clave)
+        # Solo si la entrada sigue siendo la de este histórico (no se ha releído ni expulsado)
+        if entrada is not None and entrada[1] is df and entrada[3] is None:
+            adicional = serie[0].nbytes + serie[1].nbytes
+            _cache[clave] = (entrada[0], df, entrada[2] + adicional, serie)
+            _cache_bytes += adicional
+    return serie
+
+
+def estadisticas_cache():
+    """Aciertos, fallos, invalidaciones y expulsiones de la caché de históricos, con su ocupación."""
+    with _CACHE_LOCK:
+        return {**_estadisticas_cache, "entradas": len(_cache), "bytes": _cache_bytes, "max_bytes": MAX_CACHE_BYTES}
+
+
+def vaciar_cache():
+    global _cache_bytes
+    with _CACHE_LOCK:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+def leer(isin, columnas=None, desde=None, hasta=None, directorio=None):
+    """
+    Histórico de un ISIN ordenado por fecha y sin fechas repetidas.
+    - `columnas`: columnas de precio a devolver (Date siempre se incluye)
+    - `desde` / `hasta`: rango de fechas inclusivo
+    Si una fecha está en varias partes prevalece la más antigua. El histórico completo
+    sale de la caché del proceso mientras sus ficheros no cambien; se devuelve una copia.
+    """
+    columnas = ["Date"] + [col for col in (columnas or COLUMNAS_NUMERICAS) if col != "Date"]
+    archivos = partes(isin, directorio)
+    if not archivos:
+        return vacio(columnas)
+
+    df = _leer_con_cache(isin, archivos, directorio)
+    inicio, fin = 0, len(df)
+    if desde is not None:
+        inicio = df["Date"].searchsorted(pd.Timestamp(desde).normalize(), side="left")
+    if hasta is not None:
+        fin = df["Date"].searchsorted(pd.Timestamp(hasta).normalize(), side="right")
+    return df.iloc[inicio:fin][columnas].reset_index(drop=True)
+
+
+def rango_fechas(isin, directorio=None):
+    """
+    (primera, última) fecha del histórico como Timestamp, a partir de las
+    estadísticas de los Parquet (sin leer los datos). (None, None) si no hay.
+    """
+    minimos, maximos = [], []
+    for archivo in partes(isin, directorio):
+        metadatos = pq.ParquetFile(archivo).metadata
+        for i in range(metadatos.num_row_groups):
+            estadisticas = metadatos.row_group(i).column(0).statistics
+            if estadisticas is not None and estadisticas.has_min_max:
+                minimos.append(estadisticas.min)
+                maximos.append(estadisticas.max)
+    if not minimos:
+        return None, None
+    return pd.Timestamp(min(minimos)), pd.Timestamp(max(maximos))
+
+
+def existe(isin, directorio=None):
+    return bool(partes(isin, directorio))
+
+
+def anadir(isin, df, directorio=None):
+    """Añade filas como una parte nueva, sin reescribir lo existente. Compacta si hay demasiadas partes."""
+    if df.empty:
+        return
+    _escribir_parte(isin, df, directorio)
+    if len(partes(isin, directorio)) > MAX_PARTES:
+        compactar(isin, directorio)
+
+
+def escribir(isin, df, directorio=None):
+    """Sustituye el histórico completo del ISIN por `df` (una sola parte)."""
+    anteriores = partes(isin, directorio)
+    _escribir_parte(isin, df, directorio)
+    for archivo in anteriores:
+        archivo.unlink(missing_ok=True)
+
+
+def compactar(isin, directorio=None):
+    escribir(isin, leer(isin, directorio=directorio), directorio)
+
+
+def _hash_csv(path):
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def _leer_origen_csv(isin, directorio=None):
+    try:
+        with open(ruta_isin(isin, directorio) / ORIGEN_CSV, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _guardar_origen_csv(isin, registro, directorio=None):
+    ruta = ruta_isin(isin, directorio) / ORIGEN_CSV
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_name(f".{ruta.name}.tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(registro, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+
+def migrar_csv(isin, directorio=None):
+    """
+    Importa data/nav_historico/{ISIN}.csv al almacén si no se había migrado ya con el
+    mismo contenido. El CSV se deja donde está; de un CSV que ha cambiado solo se
+    añaden las fechas que no estén en el almacén (prevalece el precio guardado).
+    Toma el bloqueo del ISIN: no se debe llamar con él ya adquirido.
+    """
+    path = _base(directorio) / f"{isin}.csv"
+    if not path.exists():
+        return False
+    if _leer_origen_csv(isin, directorio).get("sha1") == _hash_csv(path):
+        return False
+    with bloqueo_exclusivo(clave_bloqueo(isin)):
+        # Otro proceso puede haberlo migrado mientras se esperaba el bloqueo
+        huella = _hash_csv(path)
+        if _leer_origen_csv(isin, directorio).get("sha1") == huella:
+            return False
+        df = normalizar(pd.read_csv(path, dtype=str, keep_default_na=False))
+        df = df[~df["Date"].isin(leer(isin, columnas=["Price"], directorio=directorio)["Date"])]
+        anadir(isin, df, directorio)
+        _guardar_origen_csv(isin, {
+            "archivo": path.name,
+            "sha1": huella,
+            "migrado": datetime.now().isoformat(timespec="seconds"),
+            "filas_nuevas": len(df),
+        }, directorio)
+    print(f"🗃️ Histórico {isin} migrado de CSV a Parquet ({len(df)} filas nuevas)")
+    return True
+
+
+def migrar_csvs(directorio=None):
+    """Migra los {ISIN}.csv nuevos o modificados del directorio de históricos. Paso explícito: ninguna lectura lo hace."""
+    base = _base(directorio)
+    if not base.exists():
+        return 0
+    return sum(migrar_csv(path.stem.strip(), directorio) for path in sorted(base.glob("*.csv")))
+
+
+def listar_isins(directorio=None):
+    base = _base(directorio)
+    if not base.exists():
+        return []
+    return sorted(carpeta.name for carpeta in base.iterdir() if carpeta.is_dir() and any(carpeta.glob("part-*.parquet")))
+
+
+def exportar_csv(isin, directorio=None):
+    """Histórico del ISIN como texto CSV (columnas de Investing.com, fechas YYYY-MM-DD)."""
+    df = leer(isin, directorio=directorio)
+    df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+    return df.to_csv(index=False)
+
+
+if __name__ == "__main__":
+    print(f"🗃️ {migrar_csvs()} históricos CSV migrados a {NAV_HISTORICO_DIR}")
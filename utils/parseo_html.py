@@ -0,0 +1,34 @@
+from lxml import html
+
+# Utilidades de parseo compartidas por los fetchers. Se usa lxml (parser en C) en
+# lugar de BeautifulSoup + html.parser: cada página se parsea una sola vez y se
+# extraen solo los nodos necesarios con XPath.
+
+
+def parsear_html(texto):
+    """Árbol lxml de una página HTML."""
+    try:
+        return html.fromstring(texto)
+    except ValueError:
+        # lxml no admite str con declaración de codificación XML: se le pasan bytes
+        return html.fromstring(texto.encode("utf-8"))
+
+
+def con_clase(clase):
+    """Predicado XPath equivalente a class_=`clase` de BeautifulSoup (una de las clases del nodo)."""
+    return f'contains(concat(" ", normalize-space(@class), " "), " {clase} ")'
+
+
+def clases(nodo):
+    return (nodo.get("class") or "").split()
+
+
+def texto_nodo(nodo, separador=""):
+    """Equivalente a get_text(separador, strip=True) de BeautifulSoup."""
+    return separador.join(t.strip() for t in nodo.itertext() if t.strip())
+
+
+def primero(nodo, xpath):
+    """Primer resultado de `xpath` o None."""
+    resultado = nodo.xpath(xpath)
+    return resultado[0] if resultado else None
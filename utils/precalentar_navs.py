@@ -0,0 +1,128 @@
+"""
+Precalentado de la caché de NAVs fuera de Streamlit.
+
+Recorre los ISIN de todas las carteras (data/transacciones/*.csv), refresca los que
+han expirado según el calendario de publicación y deja la caché lista para que la
+app se abra sin scrapear.
+
+    python -m utils.precalentar_navs                  # una pasada
+    python -m utils.precalentar_navs --cada-min 60    # en bucle cada hora
+    python -m utils.precalentar_navs --forzar --concurrencia 2 --peticiones-seg 0.5
+"""
+import argparse
+import statistics
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from utils import http_client
+from utils.config import TRANSACCIONES_DIR
+from utils.nav_fetcher import get_nav_real, isins_a_refrescar, limpiar_isin
+
+CONCURRENCIA_POR_DEFECTO = 4
+PETICIONES_SEG_POR_DEFECTO = 1.0
+
+
+def recopilar_isins(directorio=TRANSACCIONES_DIR):
+    """ISIN válidos de todas las carteras, sin duplicados y en orden estable."""
+    isins = set()
+    for ruta in sorted(directorio.glob("*.csv")):
+        try:
+            df = pd.read_csv(ruta)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer {ruta}: {e}")
+            continue
+        if "ISIN" not in df.columns:
+            continue
+        isins.update(limpiar_isin(df)["ISIN"].dropna())
+    return sorted(isins)
+
+
+def _precalentar_isin(isin):
+    inicio = time.perf_counter()
+    try:
+        datos = get_nav_real(isin, forzar=True)
+        error = None if datos else "sin NAV en ninguna fuente"
+    except Exception as e:
+        error = str(e)
+    return isin, error, time.perf_counter() - inicio
+
+
+def precalentar(forzar=False, concurrencia=CONCURRENCIA_POR_DEFECTO, isins=None):
+    """
+    Una pasada de precalentado. Devuelve un resumen con los ISIN obtenidos,
+    omitidos por estar vigentes, fallidos y las latencias de scrapeo.
+    """
+    inicio = time.perf_counter()
+    isins = recopilar_isins() if isins is None else list(isins)
+    pendientes = isins_a_refrescar(pd.DataFrame({"ISIN": isins}), forzar=forzar)
+
+    refrescados = set(pendientes)
+    obtenidos, fallidos, latencias = [], {}, []
+    with ThreadPoolExecutor(max_workers=max(1, concurrencia), thread_name_prefix="precalentado") as executor:
+        for isin, error, segundos in executor.map(_precalentar_isin, pendientes):
+            latencias.append(segundos)
+            if error:
+                fallidos[isin] = error
+            else:
+                obtenidos.append(isin)
+
+    return {
+        "total": len(isins),
+        "obtenidos": obtenidos,
+        "vigentes": [i for i in isins if i not in refrescados],
+        "fallidos": fallidos,
+        "latencias": latencias,
+        "duracion_seg": time.perf_counter() - inicio,
+    }
+
+
+def imprimir_resumen(resumen):
+    latencias = sorted(resumen["latencias"])
+    print("\n📊 Resumen del precalentado de NAVs")
+    print(f"  ISIN en carteras: {resumen['total']}")
+    print(f"  Obtenidos:        {len(resumen['obtenidos'])}")
+    print(f"  Vigentes (omit.): {len(resumen['vigentes'])}")
+    print(f"  Fallidos:         {len(resumen['fallidos'])}")
+    for isin, error in resumen["fallidos"].items():
+        print(f"    ❌ {isin}: {error}")
+    if latencias:
+        p95 = latencias[min(len(latencias) - 1, int(round(0.95 * (len(latencias) - 1))))]
+        print(
+            f"  Latencia por ISIN: media {statistics.mean(latencias):.2f}s · "
+            f"p50 {statistics.median(latencias):.2f}s · p95 {p95:.2f}s · máx {latencias[-1]:.2f}s"
+        )
+    print(f"  Duración total:   {resumen['duracion_seg']:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precalienta la caché de NAVs de todas las carteras.")
+    parser.add_argument("--forzar", action="store_true", help="refrescar también los NAV vigentes")
+    parser.add_argument("--concurrencia", type=int, default=CONCURRENCIA_POR_DEFECTO,
+                        help="ISIN scrapeados a la vez")
+    parser.add_argument("--peticiones-seg", type=float, default=PETICIONES_SEG_POR_DEFECTO,
+                        help="peticiones por segundo a cada host (0 = sin límite)")
+    parser.add_argument("--cada-min", type=float, default=None,
+                        help="repetir cada N minutos en lugar de una sola pasada")
+    args = parser.parse_args(argv)
+
+    http_client.limitar_peticiones_por_host(args.peticiones_seg)
+    fallos = 0
+    try:
+        while True:
+            print(f"⏱️ Precalentado de NAVs iniciado a las {datetime.now():%Y-%m-%d %H:%M:%S}")
+            resumen = precalentar(forzar=args.forzar, concurrencia=args.concurrencia)
+            imprimir_resumen(resumen)
+            fallos = len(resumen["fallidos"])
+            if not args.cada_min:
+                break
+            time.sleep(args.cada_min * 60)
+    except KeyboardInterrupt:
+        print("\n⏹️ Precalentado interrumpido")
+    finally:
+        http_client.cerrar_sesiones()
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+from utils import nav_store
+
+# Consultas as-of de NAVs por ISIN: la única implementación de la app (transacciones,
+# rentabilidad...). Cada histórico se consulta como dos arrays ordenados (días desde
+# 1970 y precios) que guarda la caché de históricos de nav_store, y cada consulta es
+# una búsqueda binaria (np.searchsorted) sin volver a leer el almacén.
+#   - ATRAS:    última observación en la fecha o antes (forward-fill)
+#   - ADELANTE: primera observación en la fecha o después
+#   - CERCANA:  la más próxima en cualquier sentido (a igual distancia, la anterior)
+# `tolerancia_dias` limita la distancia entre la fecha pedida y la observación
+# (0 = solo la fecha exacta).
+
+ATRAS, ADELANTE, CERCANA = "atras", "adelante", "cercana"
+
+_SIN_DISTANCIA = np.iinfo(np.int64).max
+
+
+def serie(isin, directorio=None):
+    """(días desde 1970 como int64, precios) del ISIN, ordenados y sin precios vacíos."""
+    return nav_store.serie_precios(isin, directorio)
+
+
+def indices_asof(valores, objetivos, direccion=ATRAS, tolerancia=None):
+    """
+    Posición en `valores` (array ordenado de enteros: días, nanosegundos...) de la
+    observación que corresponde a cada objetivo según `direccion`, o -1 si no hay
+    ninguna a `tolerancia` (en las mismas unidades) o menos.
+    """
+    valores = np.asarray(valores, dtype="int64")
+    objetivos = np.asarray(objetivos, dtype="int64")
+    n = len(valores)
+    if not n:
+        return np.full(len(objetivos), -1, dtype="int64")
+
+    antes = np.searchsorted(valores, objetivos, side="right") - 1
+    despues = np.searchsorted(valores, objetivos, side="left")
+    distancia_antes = np.where(antes >= 0, objetivos - valores[np.maximum(antes, 0)], _SIN_DISTANCIA)
+    distancia_despues = np.where(despues < n, valores[np.minimum(despues, n - 1)] - objetivos, _SIN_DISTANCIA)
+
+    if direccion == ATRAS:
+        posiciones, distancias = antes, distancia_antes
+    elif direccion == ADELANTE:
+        posiciones, distancias = despues, distancia_despues
+    elif direccion == CERCANA:
+        usar_antes = distancia_antes <= distancia_despues
+        posiciones = np.where(usar_antes, antes, despues)
+        distancias = np.where(usar_antes, distancia_antes, distancia_despues)
+    else:
+        raise ValueError(f"Dirección as-of desconocida: {direccion}")
+
+    validas = distancias != _SIN_DISTANCIA
+    if tolerancia is not None:
+        validas &= distancias <= tolerancia
+    return np.where(validas, posiciones, -1)
+
+
+def buscar_navs(isins, fechas, direccion=ATRAS, tolerancia_dias=None, directorio=None):
+    """
+    Consulta vectorizada sobre pares (ISIN, fecha) alineados. Cada ISIN se resuelve
+    con una única búsqueda sobre su serie.
+    Devuelve (precios, fechas_observacion) como arrays; NaN / NaT donde no hay NAV.
+    """
+    isins = pd.Series(list(isins), dtype=object)
+    dias_pedidos = pd.to_datetime(pd.Series(list(fechas)), errors="coerce").values.astype("datetime64[D]")
+    precios = np.full(len(isins), np.nan)
+    observadas = np.full(len(isins), np.datetime64("NaT"), dtype="datetime64[D]")
+
+    filas_validas = np.flatnonzero(~np.isnat(dias_pedidos) & isins.map(lambda x: isinstance(x, str) and bool(x)).to_numpy())
+    grupos = pd.Series(filas_validas).groupby(isins.iloc[filas_validas].to_numpy(), sort=False)
+    for isin, filas in grupos:
+        filas = filas.to_numpy()
+        dias, valores = serie(isin, directorio)
+        posiciones = indices_asof(dias, dias_pedidos[filas].astype("int64"), direccion, tolerancia_dias)
+        encontradas = posiciones >= 0
+        precios[filas[encontradas]] = valores[posiciones[encontradas]]
+        observadas[filas[encontradas]] = dias[posiciones[encontradas]].astype("datetime64[D]")
+    return precios, observadas
+
+
+def buscar_nav(isin, fecha, direccion=ATRAS, tolerancia_dias=None, directorio=None):
+    """(fecha de la observación, NAV) para un ISIN y una fecha, o (None, None)."""
+    precios, fechas = buscar_navs([isin], [fecha], direccion, tolerancia_dias, directorio)
+    if np.isnan(precios[0]):
+        return None, None
+    return pd.Timestamp(fechas[0]), float(precios[0])
@@ -5,7 +5,7 @@ from utils.config import (
     NAV_HISTORICO_DIR,
     get_benchmark_path,
 )
-from utils.historial_nav import cargar_historico_isin
+from utils import nav_panel, precios_asof
 # =========================================
 #  DATA ACCESS LAYER
 # =========================================
@@ -38,65 +38,35 @@ def load_transactions_clean(portfolio_name):
     return df
 
 #Data Access Layer
-def load_all_navs(isin_list, df_transactions):
+def load_all_navs(isin_list):
     """
-    Loads NAV histories for given ISINs, fills gaps to cover entire date range.
+    Daily NAV series (Fecha, ISIN, Price) for the given ISINs up to today, forward-filled
+    from each first NAV. Reads the shared memory-mapped NAV panel.
     """
-    nav_frames = []
-    full_range = pd.date_range(df_transactions["Fecha"].min(), pd.Timestamp.today(), freq="D")
-
-    for isin in isin_list:
-        df_nav = cargar_historico_isin(isin)
-        if df_nav.empty:
-            continue
-        df_nav["Fecha"] = pd.to_datetime(df_nav["Date"], errors="coerce")
-        df_nav = df_nav.dropna(subset=["Fecha"])
-        df_nav = df_nav[["Fecha", "Price"]].copy()
-        df_nav["ISIN"] = isin
-
-        # Fill to full date range
-        df_nav = fill_nav_series(df_nav, pd.Timestamp.today())
-        nav_frames.append(df_nav)
-
-    if nav_frames:
-        df_navs = pd.concat(nav_frames, ignore_index=True)
-        return df_navs.dropna(subset=["Price"])
-    return pd.DataFrame(columns=["Fecha", "ISIN", "Price"])
+    return nav_panel.navs_diarios(isin_list, pd.Timestamp.today())
 
 #Data Access Layer
 def find_closest_nav_price(df, target_date, price_column="Price", tolerance_days=30):
+    """
+    Row of `df` (indexed by Fecha) closest to `target_date` in either direction, within
+    `tolerance_days`; on a tie the earlier one. Binary search on the sorted index.
+    Returns (date, value) or (None, None).
+    """
     if df.empty:
         return None, None
 
-    df = df.reset_index().rename(columns={"Fecha": "DateIndex"})
-    df["Diff"] = (df["DateIndex"] - target_date).abs()
-
-    df = df[df["Diff"] <= pd.Timedelta(days=tolerance_days)]
-    if df.empty:
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    dates = pd.DatetimeIndex(df.index).as_unit("ns")
+    pos = precios_asof.indices_asof(
+        dates.asi8,
+        [pd.Timestamp(target_date).as_unit("ns").value],
+        precios_asof.CERCANA,
+        pd.Timedelta(days=tolerance_days).value,
+    )[0]
+    if pos < 0:
         return None, None
-
-    closest_row = df.sort_values("Diff").iloc[0]
-    return closest_row["DateIndex"], closest_row[price_column]
-
-
-#Data Access Layer
-def fill_nav_series(df_nav, today):
-    """
-    Forward-fills NAV only from first available NAV date to today.
-    No extrapolation before first NAV.
-    """
-    if df_nav.empty:
-        return pd.DataFrame(columns=["Fecha", "ISIN", "Price"])
-    
-    first_date = df_nav["Fecha"].min()
-    date_range = pd.date_range(first_date, today, freq="D")
-    
-    isin = df_nav["ISIN"].iloc[0]
-    df_nav = df_nav.set_index("Fecha").sort_index()
-    df_nav = df_nav.reindex(date_range)
-    df_nav["ISIN"] = isin
-    df_nav["Price"] = df_nav["Price"].fillna(method="ffill")
-    return df_nav.reset_index().rename(columns={"index": "Fecha"})
+    return dates[pos], df[price_column].iloc[pos]
 
 
 #Data Acces Layer
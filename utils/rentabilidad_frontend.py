@@ -22,7 +22,7 @@ def mostrar_rentabilidad(portfolio_name: str):
     isin_list = df_holdings["ISIN"].unique()
 
     # Load NAVs with forward fill
-    df_navs = rb.load_all_navs(isin_list, df_tx)
+    df_navs = rb.load_all_navs(isin_list)
 
     # Portfolio valuation
     df_portfolio_full = rb.compute_portfolio_valuation(df_holdings, df_navs)
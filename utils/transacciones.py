@@ -4,9 +4,10 @@ import logging
 import pandas as pd
 import streamlit as st
 from utils.nav_fetcher import get_nav_real as get_nav
-from utils.nav_fetcher import cargar_cache_nav
+from utils.nav_fetcher import buscar_nav_en_cache
 from utils.nav_cache import actualizar_cache_isin
 from utils.config import TRANSACCIONES_DIR, NAV_HISTORICO_DIR
+from utils import precios_asof
 
 logging.basicConfig(level=logging.DEBUG, format="%(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
@@ -56,8 +57,7 @@ def guardar_transacciones(cartera, df):
 
 @st.cache_data
 def extraer_isin(nombre):
-    cache = cargar_cache_nav()
-    datos = cache.get(nombre)
+    datos = buscar_nav_en_cache(nombre, subcadena=False) if isinstance(nombre, str) and nombre.strip() else None
     if datos and datos.get("isin") and datos.get("nav") is not None:
         return datos["isin"]
     return "—"
@@ -221,45 +221,22 @@ def mostrar_tabla_transacciones(cartera):
 
     return df
 
+def obtener_nav_asof(isin, fecha, dias_max=None, nav_historico_dir=NAV_HISTORICO_DIR):
+    """
+    Último NAV conocido del ISIN en `fecha` (forward-fill), por búsqueda binaria sobre
+    el histórico en memoria (utils.precios_asof).
+    Con `dias_max` se descarta si la observación es más antigua que esos días.
+    Devuelve (fecha del NAV, precio) o (None, None).
+    """
+    return precios_asof.buscar_nav(isin, fecha, precios_asof.ATRAS, dias_max, nav_historico_dir)
+
 def buscar_precio_historico_cercano(isin, fecha_transaccion, nav_historico_dir, dias_max=7):
     """
     Busca en histórico NAV el precio más cercano anterior a la fecha_transaccion,
     siempre que esté a 7 días o menos.
     """
-    path = nav_historico_dir / f"{isin}.csv"
-    if not path.exists():
-        return None
-
-    df = pd.read_csv(path)
-    if "Date" not in df.columns or "Price" not in df.columns:
-        return None
-
-    # Asegurar fechas en datetime
-    df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-    df = df.dropna(subset=["Date"])
-
-    # ✅ Convertir fecha_transaccion a Timestamp para evitar error de tipo
-    fecha_transaccion = pd.Timestamp(fecha_transaccion)
-
-    # Filtrar fechas anteriores o iguales
-    df = df[df["Date"] <= fecha_transaccion]
-
-    if df.empty:
-        return None
-
-    # Elegir fecha más cercana anterior
-    df["diff_days"] = (fecha_transaccion - df["Date"]).dt.days
-    df = df[df["diff_days"] >= 0]
-    df = df.sort_values("diff_days")
-
-    if df.empty:
-        return None
-
-    closest = df.iloc[0]
-    if closest["diff_days"] <= dias_max:
-        return closest["Price"]
-    else:
-        return None
+    _, precio = obtener_nav_asof(isin, pd.Timestamp(fecha_transaccion), dias_max, nav_historico_dir)
+    return precio
 
 
 def formulario_nueva_transaccion(cartera: str) -> None:
@@ -474,17 +451,33 @@ def buscar_nav_para_transaccion(isin, fecha, nav_historico_dir):
     Devuelve el Price si se encuentra, o None.
     """
     try:
-        path = nav_historico_dir / f"{isin}.csv"
-        if not path.exists():
-            return None
-        df = pd.read_csv(path)
-        df["Date"] = pd.to_datetime(df["Date"], errors='coerce')
-        match = df[df["Date"] == pd.to_datetime(fecha)]
-        if not match.empty:
-            return match.iloc[0]["Price"]
+        _, precio = precios_asof.buscar_nav(isin, fecha, precios_asof.ATRAS, 0, nav_historico_dir)
+        return precio
     except Exception as e:
         print(f"Error buscando NAV: {e}")
     return None
+
+def autocompletar_precios_nav(df, filas, nav_historico_dir=NAV_HISTORICO_DIR, dias_max=7):
+    """
+    Rellena el Precio vacío o 0 de las `filas` indicadas con el NAV del histórico en la
+    fecha de la transacción o, si no lo hay, el anterior más cercano (≤ `dias_max` días),
+    igual que el formulario. Una sola consulta vectorizada para todas las filas.
+    Devuelve el número de precios rellenados.
+    """
+    if "ISIN" not in df.columns or "Precio" not in df.columns:
+        return 0
+    precios = pd.to_numeric(df.loc[filas, "Precio"], errors="coerce")
+    pendientes = precios.index[(precios.isna() | (precios == 0)) & df.loc[filas, "ISIN"].notna()]
+    if pendientes.empty:
+        return 0
+
+    navs, _ = precios_asof.buscar_navs(
+        df.loc[pendientes, "ISIN"], pd.to_datetime(df.loc[pendientes, "Fecha"], errors="coerce"),
+        precios_asof.ATRAS, dias_max, nav_historico_dir,
+    )
+    encontrados = pd.Series(navs, index=pendientes).dropna()
+    df.loc[encontrados.index, "Precio"] = encontrados
+    return len(encontrados)
             
 def importar_transacciones_excel(cartera):
     st.markdown("---")
@@ -498,11 +491,13 @@ def importar_transacciones_excel(cartera):
                 st.error("El archivo no contiene todas las columnas requeridas.")
                 return
             df = cargar_transacciones(cartera)
+            filas_nuevas = pd.RangeIndex(len(df), len(df) + len(df_excel))
             df = pd.concat([df, df_excel], ignore_index=True)
             
             from utils.nav_fetcher import limpiar_isin, validar_isin_vs_nombre
             df = limpiar_isin(df)
             validar_isin_vs_nombre(df)                     
+            autocompletados = autocompletar_precios_nav(df, filas_nuevas)
 
             #Vigilancia de stock de participaciones
             problemas = validar_stock_no_negativo(df)
@@ -525,7 +520,10 @@ def importar_transacciones_excel(cartera):
                 return
 
             guardar_transacciones(cartera, df)
-            st.success(f"Se han importado {len(df_excel)} transacciones correctamente.")
+            st.success(
+                f"Se han importado {len(df_excel)} transacciones correctamente"
+                f" ({autocompletados} precios autocompletados desde histórico NAV)."
+            )
             st.rerun()
         except Exception as e:
             st.error(f"Error al procesar el archivo: {e}")